@@ -0,0 +1,212 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+from langchain_core.messages import AIMessage, ToolMessage
+
+from app.caching import LRUCache, ar, try_redis
+from app.config import get_admission_config
+from app.metrics import Counter, Histogram
+
+CONTINUING, NEW_TURN = 0, 1  # lower goes first
+SLOTS_KEY = "admission:llm-slots"
+BUCKET_KEY = "admission:bucket:{name}"
+LOCAL_SLOT = "local"
+
+admission_rejections = Counter("admission_rejections_total", "Messages and LLM calls turned away by admission control.", ("reason",))
+llm_slot_wait = Histogram("llm_slot_wait_seconds", "Time LLM calls queued for a concurrency slot.", ("priority",))
+
+_cfg = get_admission_config()
+
+class AdmissionRejected(Exception):
+    """Raised when a message or LLM call is over a limit; `retry_after` is a hint in seconds."""
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"rejected by admission control: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+def _reject(reason: str, retry_after: float):
+    admission_rejections.inc(reason=reason)
+    raise AdmissionRejected(reason, retry_after)
+
+# KEYS: bucket. ARGV: rate (tokens per second), burst, max wait, ttl.
+# Returns the wait until a token is free; the token is taken (ahead of time) only if
+# that wait is within max wait. Redis time is used, so hosts' clocks don't matter.
+TAKE_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local rate, burst, max_wait = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = math.max(0, (1 - tokens) / rate)
+if wait <= max_wait then
+    tokens = tokens - 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return tostring(wait)
+"""
+
+# KEYS: slots. ARGV: limit, ttl, slot id. Slots are scored by expiry, so a dead worker's run out.
+ACQUIRE_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[1]) then
+    redis.call('ZADD', KEYS[1], now + tonumber(ARGV[2]), ARGV[3])
+    return 1
+end
+return 0
+"""
+
+_take = ar.register_script(TAKE_SCRIPT)
+_acquire = ar.register_script(ACQUIRE_SCRIPT)
+# An evicted bucket starts full again, which only loosens its limit
+_local_buckets = LRUCache(maxsize=10000, ttl=3600)
+
+async def _take_token(name: str, per_minute: float, burst: int, max_wait: float) -> float:
+    """Takes a token from the `name` bucket if one is free within `max_wait` seconds; returns the wait."""
+    rate = per_minute / 60
+    if _cfg["backend"] == "redis":
+        ttl = math.ceil(burst / rate) + 1  # by then the bucket is full again
+        wait = await try_redis(lambda: _take(keys=[BUCKET_KEY.format(name=name)], args=[rate, burst, max_wait, ttl]))
+        if wait is not None:
+            return float(wait)
+    # Local, or Redis is unreachable: the limit applies per worker
+    now = time.monotonic()
+    tokens, updated = _local_buckets.get(name) or (burst, now)
+    tokens = min(burst, tokens + (now - updated) * rate)
+    wait = max(0.0, (1 - tokens) / rate)
+    if wait <= max_wait:
+        tokens -= 1
+    _local_buckets.set(name, (tokens, now))
+    return wait
+
+class SlotGate:
+    """Hands out LLM call slots, at most ADMISSION_LLM_CONCURRENCY at a time.
+
+    Calls waiting in this process line up by priority, then arrival. Only the first in
+    line polls the Redis slots, which other workers may be holding. Once
+    ADMISSION_MAX_WAITING calls are waiting, more are turned away at once.
+    """
+    def __init__(self):
+        self._waiting = []  # heap of (priority, arrival, wake-up event)
+        self._arrivals = itertools.count()
+        self._local_slots = 0
+
+    @property
+    def saturated(self) -> bool:
+        return len(self._waiting) >= _cfg["max_waiting"]
+
+    async def _try_acquire(self) -> str | None:
+        if _cfg["backend"] == "redis":
+            slot = uuid.uuid4().hex
+            acquired = await try_redis(lambda: _acquire(keys=[SLOTS_KEY], args=[_cfg["llm_concurrency"], _cfg["slot_ttl"], slot]))
+            if acquired is not None:
+                return slot if acquired else None
+        if self._local_slots < _cfg["llm_concurrency"]:
+            self._local_slots += 1
+            return LOCAL_SLOT
+        return None
+
+    def _wake_first(self):
+        if self._waiting:
+            self._waiting[0][2].set()
+
+    async def acquire(self, priority: int, max_wait: float) -> str:
+        if not self._waiting:
+            slot = await self._try_acquire()
+            if slot:
+                return slot
+        if self.saturated:
+            _reject("queue_full", _cfg["max_wait"])
+
+        entry = (priority, next(self._arrivals), asyncio.Event())
+        heapq.heappush(self._waiting, entry)
+        start = time.monotonic()
+        try:
+            while True:
+                first = self._waiting[0] is entry
+                if first:
+                    slot = await self._try_acquire()
+                    if slot:
+                        llm_slot_wait.observe(time.monotonic() - start, priority=str(priority))
+                        return slot
+                remaining = start + max_wait - time.monotonic()
+                if remaining <= 0:
+                    _reject("wait_timeout", _cfg["max_wait"])
+                # Releases in this worker wake the first waiter; those in others have to be polled
+                timeout = min(_cfg["poll_interval"], remaining) if first and _cfg["backend"] == "redis" else remaining
+                entry[2].clear()
+                try:
+                    await asyncio.wait_for(entry[2].wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._waiting.remove(entry)
+            heapq.heapify(self._waiting)
+            self._wake_first()
+
+    async def release(self, slot: str):
+        if slot == LOCAL_SLOT:
+            self._local_slots -= 1
+        else:
+            await try_redis(lambda: ar.zrem(SLOTS_KEY, slot))  # or it expires
+        self._wake_first()
+
+_gate = SlotGate()
+
+def turn_priority(messages: list) -> int:
+    """Calls inside a turn already under way go before the first call of a new turn.
+
+    A turn is under way once it has answered tool calls, whether from a tool node, an
+    assistant hand-off or a resumed confirmation. A new user message starts a new turn,
+    even in an old chat.
+    """
+    last = messages[-1] if messages else None
+    if isinstance(last, ToolMessage) or (isinstance(last, AIMessage) and last.tool_calls):
+        return CONTINUING
+    return NEW_TURN
+
+async def admit_message(user_id: str):
+    """Checks a new user message against the user's rate limit and the LLM backlog.
+
+    Raises AdmissionRejected straight away rather than queueing the message. Answers
+    to tool confirmations continue a turn and are not checked.
+    """
+    if not _cfg["enabled"]:
+        return
+    if _gate.saturated:
+        _reject("overloaded", _cfg["max_wait"])
+    wait = await _take_token(f"user:{user_id}", _cfg["user_rate"], _cfg["user_burst"], 0)
+    if wait > 0:
+        _reject("user_rate", wait)
+
+@asynccontextmanager
+async def llm_call(priority: int):
+    """Holds a token of the provider's rate limit and an LLM concurrency slot for the body.
+
+    The token comes first, so a call waiting out the provider's rate limit doesn't hold
+    a slot that others could use. Raises AdmissionRejected when both don't come within
+    ADMISSION_MAX_WAIT seconds.
+    """
+    if not _cfg["enabled"]:
+        yield
+        return
+    start = time.monotonic()
+    wait = await _take_token(f"provider:{_cfg['provider']}", _cfg["provider_rate"], _cfg["provider_burst"], _cfg["max_wait"])
+    if wait > _cfg["max_wait"]:
+        _reject("provider_rate", wait)
+    if wait:
+        await asyncio.sleep(wait)
+    slot = await _gate.acquire(priority, max(0.0, start + _cfg["max_wait"] - time.monotonic()))
+    try:
+        yield
+    finally:
+        await _gate.release(slot)
@@ -9,11 +9,15 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from app.routes import router
+from app.config import get_metrics_config
+from app.metrics import RequestMetricsMiddleware
 
-def create_app() -> FastAPI:
-    app = FastAPI()
+def create_app(lifespan=None) -> FastAPI:
+    app = FastAPI(lifespan=lifespan)
     app.include_router(router)
     app.add_middleware(SessionMiddleware, secret_key=os.environ["SESSION_SECRET"])
+    if get_metrics_config()["enabled"]:
+        app.add_middleware(RequestMetricsMiddleware)
     app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
     return app
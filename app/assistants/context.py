@@ -0,0 +1,99 @@
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import (
+    BaseMessage,
+    HumanMessage,
+    RemoveMessage,
+    SystemMessage,
+    get_buffer_string,
+    trim_messages,
+)
+from langchain_core.messages.utils import count_tokens_approximately
+from langchain_core.runnables import Runnable, RunnableLambda
+
+from app import admission
+from app.config import get_context_config
+from app.state import State
+
+SUMMARY_PROMPT = """Fold the conversation below into the running summary of this customer support chat.
+Keep facts the assistants will need later: order IDs, the user's requests, decisions and outcomes.
+
+Current summary:
+{summary}
+
+Conversation:
+{conversation}
+"""
+
+def _window(messages: list[BaseMessage], max_tokens: int) -> list[BaseMessage]:
+    """Returns the latest messages that fit in `max_tokens`, starting on a user turn.
+
+    Cutting on a user turn keeps tool calls and their results together. If the
+    current turn alone exceeds the budget it is kept whole.
+    """
+    window = trim_messages(
+        messages,
+        max_tokens=max_tokens,
+        strategy="last",
+        token_counter=count_tokens_approximately,
+        start_on="human",
+    )
+    if window:
+        return window
+    last_human = max((i for i, m in enumerate(messages) if isinstance(m, HumanMessage)), default=0)
+    return messages[last_human:]
+
+def trim_context(state: State) -> dict:
+    """Bounds the messages sent to an assistant to the configured token budget.
+
+    The running summary, if any, stands in for the trimmed-off history.
+    """
+    messages = _window(state["messages"], get_context_config()["max_tokens"])
+    if state.get("summary"):
+        messages = [SystemMessage(content=f"Summary of the earlier conversation:\n{state['summary']}")] + messages
+    return {**state, "messages": messages}
+
+def create_summarization_node(llm: BaseChatModel) -> Runnable:
+    """Creates a node that folds messages outside the context window into `State.summary`.
+
+    It only runs once the thread grows past the trigger size, and removes the folded
+    messages from the state so checkpoints stop growing with them.
+    """
+    cfg = get_context_config()
+    # The summary is internal, so its tokens are kept out of the user's token stream
+    llm = llm.with_config(tags=["nostream"])
+
+    def _split(state: State):
+        messages = state["messages"]
+        if count_tokens_approximately(messages) <= cfg["summary_trigger_tokens"]:
+            return None
+        older = messages[:len(messages) - len(_window(messages, cfg["max_tokens"]))]
+        return older or None
+
+    def _update(older: list[BaseMessage], summary: str) -> dict:
+        return {
+            "summary": summary,
+            "messages": [RemoveMessage(id=message.id) for message in older],
+        }
+
+    def _prompt(state: State, older: list[BaseMessage]) -> str:
+        return SUMMARY_PROMPT.format(
+            summary=state.get("summary") or "(none)",
+            conversation=get_buffer_string(older),
+        )
+
+    def summarize_conversation(state: State) -> dict:
+        older = _split(state)
+        if not older:
+            return {}
+        response = llm.invoke(_prompt(state, older))
+        return _update(older, response.content)
+
+    async def asummarize_conversation(state: State) -> dict:
+        older = _split(state)
+        if not older:
+            return {}
+        async with admission.llm_call(admission.turn_priority(state["messages"])):
+            response = await llm.ainvoke(_prompt(state, older))
+        return _update(older, response.content)
+
+    return RunnableLambda(summarize_conversation, afunc=asummarize_conversation)
@@ -1,14 +1,18 @@
 from typing import Callable
 
-from langchain_core.runnables import Runnable
+from langchain_core.runnables import Runnable, RunnableLambda
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.messages import ToolMessage
-from langgraph.prebuilt import tools_condition
+from langchain_core.messages import AIMessage, ToolMessage
+from langgraph.prebuilt import ToolNode, tools_condition
 from langgraph.graph import END
+from langgraph.types import RetryPolicy
 
+from app import admission
 from app.tools import tools_registry, CompleteOrEscalate
-from app.config import get_llm
+from app.config import get_llm, get_tool_retry_config
 from app.state import State
+from app.store import get_cached_user_profile
+from app.assistants.context import trim_context
 from app.assistants.registry import get_assistants, get_supervisor
 
 def create_supervisor(system_prompt: str, tools: list) -> Runnable:
@@ -18,7 +22,7 @@ def create_supervisor(system_prompt: str, tools: list) -> Runnable:
         ("placeholder", "{messages}"),
     ])
     llm = get_llm()
-    chain = prompt | llm.bind_tools(tools=tools)
+    chain = RunnableLambda(trim_context) | prompt | llm.bind_tools(tools=tools)
     return chain
 
 def create_entry_node(assistant_name: str, new_dialog_state: str) -> Callable:
@@ -27,9 +31,10 @@ def create_entry_node(assistant_name: str, new_dialog_state: str) -> Callable:
     The goal is to make sure that the assistant is clear about the current scope.
     """
     def entry_node(state: State) -> dict:
-        tool_call_id = state["messages"][-1].tool_calls[0]["id"]
+        tool_call, *other_tool_calls = state["messages"][-1].tool_calls
+        tool_call_id = tool_call["id"]
         return {
-            "messages": [
+            "messages": decline_tool_calls(other_tool_calls, "Only one assistant can be delegated to at a time.") + [
                 ToolMessage(
                     content=f"""The assistant is now the {assistant_name}. 
 Reflect on the above conversation between the supervisor agent and the user.
@@ -57,15 +62,26 @@ def create_assistant(system_prompt: str, tool_tag: str = None) -> Runnable:
         ("placeholder", "{messages}"),
     ])
     llm = get_llm()
-    chain = prompt | llm.bind_tools(tools=tools)
+    chain = RunnableLambda(trim_context) | prompt | llm.bind_tools(tools=tools)
     return chain
 
-def create_node(runnable: Runnable) -> Callable:
-    """Creates a runnable assistant graph node."""
+def create_node(runnable: Runnable) -> Runnable:
+    """Creates a runnable assistant graph node.
+
+    The node exposes both a sync and an async implementation, so the graph can be
+    driven with `invoke` as well as `ainvoke` without blocking the event loop.
+    Async LLM calls go through admission control.
+    """
     def node(state: State):
         response = runnable.invoke(state)
         return {"messages": [response]}
-    return node
+
+    async def anode(state: State):
+        async with admission.llm_call(admission.turn_priority(state["messages"])):
+            response = await runnable.ainvoke(state)
+        return {"messages": [response]}
+
+    return RunnableLambda(node, afunc=anode)
 
 def route_to_workflow(state: State) -> str:
     """Routes to the last active assistant/workflow in the dialog_state stack."""
@@ -78,12 +94,30 @@ def route_to_workflow(state: State) -> str:
 
     # Validate against known assistant names
     last_assistant = dialog_state[-1]
-    valid_assistants = list(get_assistants().keys()) + supervisor["name"]
+    valid_assistants = list(get_assistants().keys()) + [supervisor["name"]]
     if last_assistant not in valid_assistants:
         # gracefully return to supervisor
         return supervisor["name"]
     return last_assistant
 
+def route_user_info(state: State) -> str:
+    """Skips fetching the user profile while the thread's copy matches the cached one.
+
+    The cached profile is dropped when the user changes and expires after
+    PROFILE_CACHE_TTL, so a stale copy in the thread's state is re-read then.
+    """
+    profile = state.get("user_profile")
+    if profile and profile == get_cached_user_profile(profile["user_id"]):
+        return route_to_workflow(state)
+    return "fetch_user_info"
+
+def route_pre_router(state: State) -> str:
+    """Follows the pre-router's hand-off if it made one, otherwise falls back to the supervisor."""
+    last_message = state["messages"][-1]
+    if isinstance(last_message, AIMessage) and last_message.tool_calls:
+        return route_supervisor(state)
+    return get_supervisor()["name"]
+
 def route_supervisor(state: State):
     """Determines the next node after the supervisor runs, based on the tool call."""
     route = tools_condition(state)
@@ -115,9 +149,79 @@ def create_assistant_route_tools(assistant_name: str):
         if did_cancel:
             return "leave_skill"
         # control flow should be passed to a tool.
-        user_management_sensitive_tools = tools_registry.get_tools_by_tags(assistant_name, "sensitive")
-        sensitive_tools_names = [tool.name for tool in user_management_sensitive_tools]
-        if any(tool_call["name"] in sensitive_tools_names for tool_call in tool_calls):
+        # Safe calls run first, so they don't wait on the user confirming the sensitive ones.
+        sensitive_tools_names = tools_registry.get_tool_names_by_tags(assistant_name, "sensitive")
+        if all(tool_call["name"] in sensitive_tools_names for tool_call in tool_calls):
             return f"sensitive_tools_{assistant_name}"
         return f"safe_tools_{assistant_name}"
     return route_node
+
+def create_safe_tools_route(assistant_name: str):
+    """Creates the route taken after a safe tool node: on to the sensitive tool node
+    if the same batch also holds sensitive calls, otherwise back to the assistant.
+    """
+    def route_after_safe_tools(state: State):
+        sensitive_tools_names = tools_registry.get_tool_names_by_tags(assistant_name, "sensitive")
+        if any(tool_call["name"] in sensitive_tools_names for tool_call in get_pending_tool_calls(state["messages"])):
+            return f"sensitive_tools_{assistant_name}"
+        return assistant_name
+    return route_after_safe_tools
+
+def get_pending_tool_calls(messages: list) -> list[dict]:
+    """Tool calls of the latest AI message that have no ToolMessage answer yet."""
+    index = max(i for i, message in enumerate(messages) if isinstance(message, AIMessage))
+    answered = {message.tool_call_id for message in messages[index + 1:] if isinstance(message, ToolMessage)}
+    return [tool_call for tool_call in messages[index].tool_calls if tool_call["id"] not in answered]
+
+def decline_tool_calls(tool_calls: list[dict], reason: str) -> list[ToolMessage]:
+    """Answers tool calls that won't be executed, so every call still gets a result."""
+    return [
+        ToolMessage(content=f"Tool call not executed. {reason}", tool_call_id=tool_call["id"])
+        for tool_call in tool_calls
+    ]
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+def is_transient_error(error: Exception) -> bool:
+    """Whether a failed tool call may succeed when retried: dropped connections, timeouts, rate limits and server errors."""
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    # Google API errors carry the HTTP response as `resp`, requests and httpx errors as `response`
+    status = getattr(getattr(error, "resp", None), "status", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status in RETRYABLE_STATUSES
+
+def create_tool_retry_policy() -> RetryPolicy:
+    """Retries a tool node with exponential backoff when it fails on a transient error."""
+    cfg = get_tool_retry_config()
+    return RetryPolicy(
+        max_attempts=cfg["max_attempts"],
+        initial_interval=cfg["initial_interval"],
+        max_interval=cfg["max_interval"],
+        retry_on=is_transient_error,
+    )
+
+def create_tool_node(tools: list, deferred_tool_names: set[str] = frozenset()) -> Runnable:
+    """Creates a tool node that runs the pending calls of the latest AI message.
+
+    Independent calls in one batch run concurrently (thread pool for `invoke`,
+    asyncio for `ainvoke`). Calls named in `deferred_tool_names` are left for
+    another node; calls to unknown tools get an error result.
+    """
+    tool_node = ToolNode(tools)
+
+    def select(state: State) -> dict:
+        messages = state["messages"]
+        index = max(i for i, message in enumerate(messages) if isinstance(message, AIMessage))
+        tool_calls = [
+            tool_call for tool_call in get_pending_tool_calls(messages)
+            if tool_call["name"] not in deferred_tool_names
+        ]
+        return {"messages": messages[:index] + [messages[index].model_copy(update={"tool_calls": tool_calls})]}
+
+    def tool_calls(state: State, config):
+        return tool_node.invoke(select(state), config)
+
+    async def atool_calls(state: State, config):
+        return await tool_node.ainvoke(select(state), config)
+
+    return RunnableLambda(tool_calls, afunc=atool_calls)
@@ -0,0 +1,66 @@
+import re
+import uuid
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from app.assistants.registry import get_assistants
+from app.state import State
+
+# Marks the hand-offs the pre-router made, whose request is the user's own message
+PREROUTED_ID_PREFIX = "prerouted_"
+
+class RuleRouter:
+    """Routes a message to an assistant when its regex rules, and no other assistant's, match.
+
+    Rules come from the `route_patterns` of each assistant in the registry. Anything
+    ambiguous or unmatched is left to the supervisor LLM.
+    """
+    def __init__(self, patterns: dict[str, list[str]]):
+        self.patterns = {
+            name: [re.compile(pattern, re.IGNORECASE) for pattern in assistant_patterns]
+            for name, assistant_patterns in patterns.items()
+        }
+
+    def route(self, text: str) -> str | None:
+        matches = [
+            name for name, patterns in self.patterns.items()
+            if any(pattern.search(text) for pattern in patterns)
+        ]
+        return matches[0] if len(matches) == 1 else None
+
+def get_router() -> RuleRouter:
+    return RuleRouter({
+        name: cfg["route_patterns"]
+        for name, cfg in get_assistants().items()
+        if cfg.get("route_patterns")
+    })
+
+def create_prerouter_node(router: RuleRouter):
+    """Creates a node that hands obvious requests straight to an assistant.
+
+    On a confident match it emits the same hand-off tool call the supervisor would
+    have made, so the entry nodes work unchanged. Otherwise it leaves the state as is.
+    `router` can be anything with a `route(text) -> assistant name | None` method.
+    """
+    assistants = get_assistants()
+
+    def pre_router(state: State) -> dict:
+        message = state["messages"][-1]
+        if not isinstance(message, HumanMessage) or not isinstance(message.content, str):
+            return {}
+        assistant_name = router.route(message.content)
+        if assistant_name is None:
+            return {}
+        return {
+            "messages": [
+                AIMessage(
+                    content="",
+                    tool_calls=[{
+                        "name": assistants[assistant_name]["entry_tool"].__name__,
+                        "args": {"request": message.content},
+                        "id": f"{PREROUTED_ID_PREFIX}{uuid.uuid4().hex}",
+                    }],
+                )
+            ]
+        }
+    return pre_router
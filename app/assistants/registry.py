@@ -26,18 +26,31 @@ ASSISTANT_REGISTRY = {
         "system_prompt": ORDER_MANAGEMENT_ASSISTANT_SYSTEM_PROMPT,
         "entry_tool": ToOrderManagementAssistant,
         "tool_tag": "order_management",
+        "route_patterns": [
+            r"\border\s*(?:id|number|no\.?)?\s*#?\s*\d{3,}\b",  # order ID
+            r"#\d{4,}\b",
+            r"\b(?:track|where is|status of|eta of)\b.*\b(?:order|package|parcel)\b",
+            r"\brefund status\b",
+        ],
     },
     "knowledge_base": {
         "name": "Knowledge Base Assistant",
         "system_prompt": KNOWLEDGE_BASE_ASSISTANT_SYSTEM_PROMPT,
         "entry_tool": ToKnowledgeBaseAssistant,
         "tool_tag": "knowledge_base",
+        "route_patterns": [
+            r"\b(?:policy|policies|faq)\b",
+            r"\bhow (?:do|can) i\b(?!.*\b(?:e-?mails?|inbox|calendar)\b)",
+        ],
     },
     "user_management": {
         "name": "User Management Assistant",
         "system_prompt": USER_MANAGEMENT_ASSISTANT_SYSTEM_PROMPT,
         "entry_tool": ToUserManagementAssistant,
         "tool_tag": "user_management",
+        "route_patterns": [
+            r"\b(?:e-?mails?|inbox|gmail|calendar|meetings?)\b",
+        ],
     },
 }
 
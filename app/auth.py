@@ -1,7 +1,91 @@
-from passlib.hash import bcrypt
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+from app.config import get_auth_config
+from app.metrics import Counter, Gauge, Histogram
+
+# bcrypt only uses the first 72 bytes of a password; passlib truncated silently, so we do too
+MAX_PASSWORD_BYTES = 72
+
+_cfg = get_auth_config()
+
+password_hash_duration = Histogram(
+    "password_hash_duration_seconds",
+    "Time spent hashing or verifying a password, excluding the queue wait.",
+    ("operation",),
+)
+password_hash_queue_wait = Histogram(
+    "password_hash_queue_wait_seconds",
+    "Time a password operation waited for a hashing worker.",
+    ("operation",),
+)
+password_hash_rejected = Counter(
+    "password_hash_rejected_total",
+    "Password operations rejected because the hashing queue was full.",
+    ("operation",),
+)
+password_hash_queue_depth = Gauge(
+    "password_hash_queue_depth",
+    "Password operations running or waiting for a hashing worker.",
+)
+
+class HashingBusyError(Exception):
+    """Raised when the hashing queue is full; callers should ask the client to retry."""
+
+def _encode(password: str) -> bytes:
+    return password.encode("utf-8")[:MAX_PASSWORD_BYTES]
 
 def hash_password(password: str) -> str:
-    return bcrypt.hash(password)
+    return bcrypt.hashpw(_encode(password), bcrypt.gensalt(rounds=_cfg["bcrypt_rounds"])).decode()
 
 def verify_password(plain: str, hashed: str) -> bool:
-    return bcrypt.verify(plain, hashed)
\ No newline at end of file
+    try:
+        return bcrypt.checkpw(_encode(plain), hashed.encode())
+    except ValueError:
+        return False  # not a bcrypt hash
+
+def needs_rehash(hashed: str) -> bool:
+    """Whether `hashed` was made with a bcrypt cost other than the configured one."""
+    try:
+        return int(hashed.split("$")[2]) != _cfg["bcrypt_rounds"]
+    except (IndexError, ValueError):
+        return True
+
+# bcrypt releases the GIL, so a small thread pool hashes in parallel without
+# competing with the event loop or the request thread pool
+
+_executor = ThreadPoolExecutor(max_workers=_cfg["hash_workers"], thread_name_prefix="password-hash")
+_pending = 0
+_pending_lock = threading.Lock()
+
+async def _run(operation: str, fn, *args):
+    global _pending
+    with _pending_lock:
+        if _pending >= _cfg["hash_workers"] + _cfg["hash_queue_size"]:
+            password_hash_rejected.inc(operation=operation)
+            raise HashingBusyError("password hashing queue is full")
+        _pending += 1
+        password_hash_queue_depth.set(_pending)
+    queued_at = time.perf_counter()
+
+    def run():
+        password_hash_queue_wait.observe(time.perf_counter() - queued_at, operation=operation)
+        with password_hash_duration.time(operation=operation):
+            return fn(*args)
+
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, run)
+    finally:
+        with _pending_lock:
+            _pending -= 1
+            password_hash_queue_depth.set(_pending)
+
+async def ahash_password(password: str) -> str:
+    return await _run("hash", hash_password, password)
+
+async def averify_password(plain: str, hashed: str) -> bool:
+    return await _run("verify", verify_password, plain, hashed)
@@ -1,19 +1,72 @@
 import redis
-import json
-from datetime import datetime, timezone
+import redis.asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable
 
-r = redis.Redis(host="localhost", port=6379, db=0)
+from app.config import get_redis_config
 
-def cache_gmail_token(user_id: str, credentials: dict, expiry):
-    if expiry.tzinfo is None:
-        expiry = expiry.replace(tzinfo=timezone.utc)
+_redis_cfg = get_redis_config()
+_redis_options = {
+    "max_connections": _redis_cfg["max_connections"],
+    "socket_timeout": _redis_cfg["socket_timeout"],
+    "socket_connect_timeout": _redis_cfg["connect_timeout"],
+}
+# Clients for sync code (tools, worker threads) and for the event loop, each with its own bounded pool
+r = redis.Redis(connection_pool=redis.ConnectionPool.from_url(_redis_cfg["url"], **_redis_options))
+ar = redis.asyncio.Redis(connection_pool=redis.asyncio.ConnectionPool.from_url(_redis_cfg["url"], **_redis_options))
 
-    ttl = int((expiry - datetime.now(timezone.utc)).total_seconds())
+_redis_down_until = 0.0
 
-    redis_key = f"gmail:token:{user_id}"
-    r.set(redis_key, json.dumps(credentials), ex=ttl)
+async def try_redis(command: Callable[[], Awaitable], default=None):
+    """Runs an async Redis command, returning `default` if Redis fails or is slow.
 
-def get_cached_gmail_token(user_id: str):
-    redis_key = f"gmail:token:{user_id}"
-    val = r.get(redis_key)
-    return json.loads(val) if val else None
\ No newline at end of file
+    After a failure Redis is skipped for `REDIS_RETRY_AFTER` seconds, so requests
+    don't each wait out the timeout while it is down.
+    """
+    global _redis_down_until
+    if time.monotonic() < _redis_down_until:
+        return default
+    try:
+        return await command()
+    except (redis.RedisError, OSError):
+        _redis_down_until = time.monotonic() + _redis_cfg["retry_after"]
+        return default
+
+class LRUCache:
+    """Thread-safe, size-bounded, process-local cache with a per-entry TTL."""
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float | None = None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def keys(self) -> list:
+        now = time.monotonic()
+        with self._lock:
+            return [key for key, (_, expires_at) in self._data.items() if expires_at >= now]
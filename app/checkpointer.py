@@ -0,0 +1,247 @@
+import asyncio
+import json
+from typing import Any, AsyncIterator, Iterator, Sequence
+
+import redis
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+    writes_sort_key,
+)
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+from app.config import get_agent_connection_string, get_checkpointer_config, get_redis_config
+from app.database import db
+
+NAMESPACES_KEY = "checkpoint:namespaces:{thread_id}"
+INDEX_KEY = "checkpoint:index:{thread_id}:{checkpoint_ns}"
+CHECKPOINT_KEY = "checkpoint:{thread_id}:{checkpoint_ns}:{checkpoint_id}"
+WRITES_KEY = "checkpoint:writes:{thread_id}:{checkpoint_ns}:{checkpoint_id}"
+
+def _decode(value: bytes | str) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+def thread_ids(client: redis.Redis) -> list[str]:
+    """Threads with checkpoints, found by their namespace sets, which expire with the thread."""
+    prefix = NAMESPACES_KEY.format(thread_id="")
+    return sorted(_decode(key)[len(prefix):] for key in client.scan_iter(match=prefix + "*", count=1000))
+
+class RedisSaver(BaseCheckpointSaver):
+    """Checkpointer backed by Redis, so every worker and host sees the same threads.
+
+    Each checkpoint is a hash and each checkpoint's pending writes another, keyed by
+    thread, namespace and checkpoint id. Checkpoint ids sort by time, so a sorted set
+    per thread and namespace (all scores 0, ordered by id) finds the latest one.
+    With `ttl` set, a thread's keys expire `ttl` seconds after its last write.
+    """
+    def __init__(self, client: redis.Redis, ttl: int | None = None, serde=None):
+        super().__init__(serde=serde)
+        self.client = client
+        self.ttl = ttl
+
+    def _keys(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> tuple[str, str]:
+        ids = {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id}
+        return CHECKPOINT_KEY.format(**ids), WRITES_KEY.format(**ids)
+
+    def _expire(self, pipe, *keys: str):
+        if self.ttl:
+            for key in keys:
+                pipe.expire(key, self.ttl)
+
+    def _tuple(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> CheckpointTuple | None:
+        checkpoint_key, writes_key = self._keys(thread_id, checkpoint_ns, checkpoint_id)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hgetall(checkpoint_key)
+        pipe.hvals(writes_key)
+        stored, raw_writes = pipe.execute()
+        if not stored:
+            return None
+
+        writes = []
+        for raw in raw_writes:
+            header, value = raw.split(b"\n", 1)
+            write = json.loads(header)
+            writes.append((write, self.serde.loads_typed((write["type"], value))))
+        writes.sort(key=lambda w: writes_sort_key(w[0]["task_path"], w[0]["task_id"], w[0]["idx"]))
+
+        parent_id = _decode(stored.get(b"parent_checkpoint_id", b""))
+        return CheckpointTuple(
+            {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id}},
+            self.serde.loads_typed((_decode(stored[b"type"]), stored[b"checkpoint"])),
+            json.loads(stored[b"metadata"]),
+            {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": parent_id}} if parent_id else None,
+            [(write["task_id"], write["channel"], value) for write, value in writes],
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        thread_id = str(config["configurable"]["thread_id"])
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = get_checkpoint_id(config)
+        if not checkpoint_id:
+            index_key = INDEX_KEY.format(thread_id=thread_id, checkpoint_ns=checkpoint_ns)
+            latest = self.client.zrevrangebylex(index_key, "+", "-", start=0, num=1)
+            if not latest:
+                return None
+            checkpoint_id = _decode(latest[0])
+        return self._tuple(thread_id, checkpoint_ns, checkpoint_id)
+
+    def list(
+        self,
+        config: RunnableConfig | None,
+        *,
+        filter: dict[str, Any] | None = None,
+        before: RunnableConfig | None = None,
+        limit: int | None = None,
+    ) -> Iterator[CheckpointTuple]:
+        configurable = (config or {}).get("configurable", {})
+        if "thread_id" in configurable:
+            threads = [str(configurable["thread_id"])]
+        else:
+            threads = thread_ids(self.client)
+        checkpoint_id = get_checkpoint_id(config) if config else None
+        upper = f"({get_checkpoint_id(before)}" if before else "+"
+
+        for thread_id in threads:
+            if configurable.get("checkpoint_ns") is not None:
+                namespaces = [configurable["checkpoint_ns"]]
+            else:
+                namespaces = [_decode(ns) for ns in self.client.smembers(NAMESPACES_KEY.format(thread_id=thread_id))]
+            found = []
+            for checkpoint_ns in namespaces:
+                ids = self.client.zrevrangebylex(INDEX_KEY.format(thread_id=thread_id, checkpoint_ns=checkpoint_ns), upper, "-")
+                found.extend((_decode(i), checkpoint_ns) for i in ids if checkpoint_id in (None, _decode(i)))
+            # Newest first across namespaces, like the SQLite checkpointer
+            for found_id, checkpoint_ns in sorted(found, reverse=True):
+                checkpoint_tuple = self._tuple(thread_id, checkpoint_ns, found_id)
+                if checkpoint_tuple is None:
+                    continue  # expired
+                if filter and any(checkpoint_tuple.metadata.get(k) != v for k, v in filter.items()):
+                    continue
+                yield checkpoint_tuple
+                if limit is not None:
+                    limit -= 1
+                    if limit <= 0:
+                        return
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = str(config["configurable"]["thread_id"])
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        type_, serialized = self.serde.dumps_typed(checkpoint)
+        checkpoint_key, _ = self._keys(thread_id, checkpoint_ns, checkpoint["id"])
+        index_key = INDEX_KEY.format(thread_id=thread_id, checkpoint_ns=checkpoint_ns)
+        namespaces_key = NAMESPACES_KEY.format(thread_id=thread_id)
+
+        pipe = self.client.pipeline()
+        pipe.hset(checkpoint_key, mapping={
+            "type": type_,
+            "checkpoint": serialized,
+            "metadata": json.dumps(get_checkpoint_metadata(config, metadata), ensure_ascii=False),
+            "parent_checkpoint_id": config["configurable"].get("checkpoint_id") or "",
+        })
+        pipe.zadd(index_key, {checkpoint["id"]: 0})
+        pipe.sadd(namespaces_key, checkpoint_ns)
+        self._expire(pipe, checkpoint_key, index_key, namespaces_key)
+        pipe.execute()
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        _, writes_key = self._keys(
+            str(config["configurable"]["thread_id"]),
+            str(config["configurable"]["checkpoint_ns"]),
+            str(config["configurable"]["checkpoint_id"]),
+        )
+        # Special channels (errors, interrupts) replace earlier writes; the rest are written once
+        replace = all(channel in WRITES_IDX_MAP for channel, _ in writes)
+        pipe = self.client.pipeline()
+        for idx, (channel, value) in enumerate(writes):
+            idx = WRITES_IDX_MAP.get(channel, idx)
+            type_, serialized = self.serde.dumps_typed(value)
+            header = json.dumps({"task_id": task_id, "task_path": task_path, "idx": idx, "channel": channel, "type": type_})
+            field, raw = f"{task_id}:{idx}", header.encode() + b"\n" + serialized
+            if replace:
+                pipe.hset(writes_key, field, raw)
+            else:
+                pipe.hsetnx(writes_key, field, raw)
+        self._expire(pipe, writes_key)
+        pipe.execute()
+
+    def delete_thread(self, thread_id: str) -> None:
+        thread_id = str(thread_id)
+        namespaces_key = NAMESPACES_KEY.format(thread_id=thread_id)
+        keys = [namespaces_key]
+        for checkpoint_ns in map(_decode, self.client.smembers(namespaces_key)):
+            index_key = INDEX_KEY.format(thread_id=thread_id, checkpoint_ns=checkpoint_ns)
+            keys.append(index_key)
+            for checkpoint_id in map(_decode, self.client.zrange(index_key, 0, -1)):
+                keys.extend(self._keys(thread_id, checkpoint_ns, checkpoint_id))
+        self.client.delete(*keys)
+
+    # redis-py's sync client is thread-safe, so the async API runs it off the event loop
+
+    async def aget_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: RunnableConfig | None,
+        *,
+        filter: dict[str, Any] | None = None,
+        before: RunnableConfig | None = None,
+        limit: int | None = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        checkpoints = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for checkpoint_tuple in checkpoints:
+            yield checkpoint_tuple
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+def create_checkpointer() -> BaseCheckpointSaver:
+    """A synchronous checkpointer for CHECKPOINT_BACKEND; the web app builds an async SQLite one instead."""
+    cfg = get_checkpointer_config()
+    if cfg["backend"] == "redis":
+        redis_cfg = get_redis_config()
+        client = redis.Redis.from_url(
+            cfg["redis_url"],
+            socket_timeout=redis_cfg["socket_timeout"],
+            socket_connect_timeout=redis_cfg["connect_timeout"],
+        )
+        return RedisSaver(client, ttl=cfg["ttl"])
+    return SqliteSaver(db.connect_checkpoint_db(get_agent_connection_string()))
@@ -0,0 +1,175 @@
+import argparse
+import asyncio
+import json
+import logging
+import sqlite3
+from datetime import datetime, timedelta
+
+from app.config import get_agent_connection_string, get_checkpoint_compaction_config
+from app.database import db, queries
+
+logger = logging.getLogger(__name__)
+
+def _has_checkpoint_tables(conn: sqlite3.Connection) -> bool:
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'checkpoints'").fetchone()
+    return row is not None
+
+def prune_checkpoints(conn: sqlite3.Connection, keep_last: int) -> int:
+    """Keeps only the latest `keep_last` checkpoints per thread and namespace."""
+    if keep_last < 1:
+        raise ValueError("keep_last must be at least 1")
+    # checkpoint ids are time-ordered, so the newest checkpoints sort last
+    cursor = conn.execute(
+        """
+        DELETE FROM checkpoints WHERE rowid IN (
+            SELECT rowid FROM (
+                SELECT rowid, ROW_NUMBER() OVER (
+                    PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC
+                ) AS position
+                FROM checkpoints
+            ) WHERE position > ?
+        )
+        """,
+        (keep_last,),
+    )
+    return cursor.rowcount
+
+def delete_threads(conn: sqlite3.Connection, thread_ids: set[str]) -> int:
+    deleted = 0
+    for thread_id in thread_ids:
+        deleted += conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,)).rowcount
+    return deleted
+
+def delete_orphaned_writes(conn: sqlite3.Connection) -> int:
+    """Removes pending writes whose checkpoint no longer exists."""
+    cursor = conn.execute(
+        """
+        DELETE FROM writes WHERE NOT EXISTS (
+            SELECT 1 FROM checkpoints c
+            WHERE c.thread_id = writes.thread_id
+              AND c.checkpoint_ns = writes.checkpoint_ns
+              AND c.checkpoint_id = writes.checkpoint_id
+        )
+        """
+    )
+    return cursor.rowcount
+
+def incremental_vacuum(conn: sqlite3.Connection, pages: int) -> None:
+    """Returns up to `pages` free pages to the filesystem.
+
+    Databases created before auto_vacuum was set are skipped until `vacuum` has
+    been run on them once.
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        logger.warning("checkpoint database is not in incremental auto_vacuum mode; run `python -m app.checkpoints vacuum` once with the app stopped")
+        return
+    conn.execute(f"PRAGMA incremental_vacuum({int(pages)})")
+
+def full_vacuum(conn: sqlite3.Connection) -> None:
+    """Rewrites the whole database in incremental auto_vacuum mode.
+
+    It needs exclusive use of the file, so it only runs from the command line.
+    """
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+
+def get_checkpoint_metrics(conn: sqlite3.Connection) -> dict:
+    """Size of the checkpoint database and checkpoint rows per thread."""
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    freelist_count = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    metrics = {
+        "db_size_bytes": page_size * page_count,
+        "free_bytes": page_size * freelist_count,
+        "threads": 0,
+        "checkpoints": 0,
+        "writes": 0,
+        "max_checkpoints_per_thread": 0,
+    }
+    if not _has_checkpoint_tables(conn):
+        return metrics
+
+    threads, checkpoints, max_per_thread = conn.execute(
+        """
+        SELECT COUNT(*), COALESCE(SUM(rows), 0), COALESCE(MAX(rows), 0)
+        FROM (SELECT COUNT(*) AS rows FROM checkpoints GROUP BY thread_id)
+        """
+    ).fetchone()
+    metrics["threads"] = threads
+    metrics["checkpoints"] = checkpoints
+    metrics["max_checkpoints_per_thread"] = max_per_thread
+    metrics["writes"] = conn.execute("SELECT COUNT(*) FROM writes").fetchone()[0]
+    return metrics
+
+def compact(conn: sqlite3.Connection, keep_last: int, stale_thread_ids: set[str], vacuum_pages: int) -> dict:
+    if not _has_checkpoint_tables(conn):
+        return {"pruned": 0, "deleted": 0, "writes": 0}
+
+    with conn:
+        deleted = delete_threads(conn, stale_thread_ids)
+        pruned = prune_checkpoints(conn, keep_last)
+        writes = delete_orphaned_writes(conn)
+    incremental_vacuum(conn, vacuum_pages)
+    return {"pruned": pruned, "deleted": deleted, "writes": writes}
+
+def get_stale_thread_ids(conn: sqlite3.Connection, retention_days: int | None) -> set[str]:
+    """Threads whose chat was deleted or has not been updated within the retention window."""
+    if not _has_checkpoint_tables(conn):
+        return set()
+
+    thread_ids = {row[0] for row in conn.execute("SELECT DISTINCT thread_id FROM checkpoints")}
+    session = next(db.get_session())
+    try:
+        stale = thread_ids - queries.get_chat_ids(session)
+        if retention_days is not None:
+            cutoff = datetime.now() - timedelta(days=retention_days)
+            stale |= thread_ids & queries.get_chat_ids(session, updated_before=cutoff)
+    finally:
+        session.close()
+    return stale
+
+def compact_checkpoint_db() -> dict:
+    cfg = get_checkpoint_compaction_config()
+    conn = db.connect_checkpoint_db(get_agent_connection_string())
+    try:
+        stale_thread_ids = get_stale_thread_ids(conn, cfg["retention_days"])
+        return compact(conn, cfg["keep_last"], stale_thread_ids, cfg["vacuum_pages"])
+    finally:
+        conn.close()
+
+async def run_compaction_job(interval_seconds: int):
+    """Compacts the checkpoint database every `interval_seconds`, off the event loop."""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            result = await asyncio.to_thread(compact_checkpoint_db)
+            logger.info("checkpoint compaction: %s", result)
+        except Exception:
+            logger.exception("checkpoint compaction failed")
+
+# Usage: python -m app.checkpoints compact|stats|vacuum
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the LangGraph checkpoint database.")
+    parser.add_argument("command", choices=["compact", "stats", "vacuum"], help="vacuum rewrites the database; stop the app first")
+    args = parser.parse_args()
+
+    match args.command:
+        case "compact":
+            result = compact_checkpoint_db()
+        case "stats":
+            conn = db.connect_checkpoint_db(get_agent_connection_string())
+            try:
+                result = get_checkpoint_metrics(conn)
+            finally:
+                conn.close()
+        case "vacuum":
+            conn = db.connect_checkpoint_db(get_agent_connection_string())
+            try:
+                full_vacuum(conn)
+                result = get_checkpoint_metrics(conn)
+            finally:
+                conn.close()
+    print(json.dumps(result, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -3,9 +3,14 @@ import os
 from dotenv import load_dotenv
 load_dotenv()
 
-from langchain.chat_models import init_chat_model
+from functools import lru_cache
 
 def get_llm():
+    """The chat model for LLM_NAME/LLM_PROVIDER, shared by every caller in the process.
+
+    One instance means one provider client and one pooled HTTP connection for the
+    supervisor, the assistants and the summarizer.
+    """
     llm_name = os.environ.get("LLM_NAME")
     llm_provider = os.environ.get("LLM_PROVIDER")
 
@@ -14,12 +19,226 @@ def get_llm():
     if not llm_provider:
         raise ValueError("failed to load LLM_PROVIDER env")
 
-    llm = init_chat_model(model=llm_name, model_provider=llm_provider)
-    return llm
+    return _init_llm(llm_name, llm_provider)
+
+@lru_cache(maxsize=None)
+def _init_llm(llm_name: str, llm_provider: str):
+    # Provider packages are heavy, so they are imported on first use
+    from langchain.chat_models import init_chat_model
+    return init_chat_model(model=llm_name, model_provider=llm_provider)
+
+def get_server_config() -> dict:
+    """APP_ENV=production runs without auto-reload.
+
+    WEB_CONCURRENCY sets the number of worker processes. More than one needs state
+    shared between workers: see `get_checkpointer_config` and `get_thread_lock_config`.
+    """
+    production = os.environ.get("APP_ENV", "development").lower() == "production"
+    workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+    return {
+        "host": os.environ.get("HOST", "0.0.0.0"),
+        "port": int(os.environ.get("PORT", 8000)),
+        "workers": workers,
+        "reload": not production and workers == 1,  # uvicorn can't reload several workers
+    }
+
+def get_context_config() -> dict:
+    return {
+        "max_tokens": int(os.environ.get("CONTEXT_MAX_TOKENS", 4000)),
+        "summary_enabled": os.environ.get("CONTEXT_SUMMARY_ENABLED", "").lower() in ("1", "true", "yes"),
+        "summary_trigger_tokens": int(os.environ.get("CONTEXT_SUMMARY_TRIGGER_TOKENS", 8000)),
+    }
+
+def get_redis_config() -> dict:
+    return {
+        "url": os.environ.get("REDIS_URL", "redis://localhost:6379/0"),
+        "max_connections": int(os.environ.get("REDIS_MAX_CONNECTIONS", 50)),
+        "socket_timeout": float(os.environ.get("REDIS_SOCKET_TIMEOUT", 0.5)),
+        "connect_timeout": float(os.environ.get("REDIS_CONNECT_TIMEOUT", 0.5)),
+        "retry_after": float(os.environ.get("REDIS_RETRY_AFTER", 5)),  # seconds to skip Redis after a failure
+    }
+
+def get_profile_cache_config() -> dict:
+    return {
+        "ttl": int(os.environ.get("PROFILE_CACHE_TTL", 3600)),
+    }
+
+def get_store_config() -> dict:
+    """Long-term store settings; STORE_NAMESPACE_TTLS looks like `user_profile=3600,memories=86400`."""
+    namespace_ttls = {}
+    for entry in filter(None, os.environ.get("STORE_NAMESPACE_TTLS", "").split(",")):
+        namespace, ttl = entry.split("=")
+        namespace_ttls[namespace.strip()] = int(ttl)
+    return {
+        "backend": os.environ.get("STORE_BACKEND", "sqlite"),
+        "db_name": os.environ.get("STORE_DB_NAME"),
+        "redis_url": os.environ.get("STORE_REDIS_URL", os.environ.get("REDIS_URL", "redis://localhost:6379/0")),
+        "local_cache_size": int(os.environ.get("STORE_LOCAL_CACHE_SIZE", 1024)),
+        "local_ttl": int(os.environ.get("STORE_LOCAL_TTL", 60)),
+        "namespace_ttls": namespace_ttls,
+    }
+
+def get_knowledge_base_config() -> dict:
+    return {
+        "index_dir": os.environ.get("KB_INDEX_DIR", "data/kb_index"),
+        "top_k": int(os.environ.get("KB_TOP_K", 3)),
+    }
+
+def get_response_cache_config() -> dict:
+    return {
+        "enabled": os.environ.get("KB_RESPONSE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes"),
+        "maxsize": int(os.environ.get("KB_RESPONSE_CACHE_SIZE", 1024)),
+        "ttl": int(os.environ.get("KB_RESPONSE_CACHE_TTL", 3600)),
+        "threshold": float(os.environ.get("KB_RESPONSE_CACHE_THRESHOLD", 0.9)),
+    }
+
+def get_prerouter_config() -> dict:
+    return {
+        "enabled": os.environ.get("PREROUTER_ENABLED", "true").lower() in ("1", "true", "yes"),
+    }
+
+def get_checkpointer_config() -> dict:
+    """CHECKPOINT_BACKEND=redis shares conversation state between workers on several hosts.
+
+    Workers on one host can share the SQLite checkpoint database instead.
+    """
+    retention_days = os.environ.get("CHECKPOINT_RETENTION_DAYS")
+    return {
+        "backend": os.environ.get("CHECKPOINT_BACKEND", "sqlite"),
+        "redis_url": os.environ.get("CHECKPOINT_REDIS_URL", os.environ.get("REDIS_URL", "redis://localhost:6379/0")),
+        # Redis threads expire instead of being compacted
+        "ttl": int(retention_days) * 86400 if retention_days else None,
+    }
+
+def is_shared_deployment() -> bool:
+    """Whether turns may run in more than one process: several workers, or threads checkpointed in Redis."""
+    return int(os.environ.get("WEB_CONCURRENCY", 1)) > 1 or get_checkpointer_config()["backend"] == "redis"
+
+def get_thread_lock_config() -> dict:
+    """Turns on one chat run one at a time; the Redis lock extends that across workers."""
+    shared = is_shared_deployment()
+    return {
+        "backend": os.environ.get("THREAD_LOCK_BACKEND", "redis" if shared else "local"),
+        "timeout": float(os.environ.get("THREAD_LOCK_TIMEOUT", 60)),  # renewed while the turn runs
+        "wait": float(os.environ.get("THREAD_LOCK_WAIT", 30)),  # before answering "busy"
+    }
+
+def get_job_queue_config() -> dict:
+    """Background jobs running confirmed tool calls and sent messages outside the request."""
+    return {
+        "backend": os.environ.get("JOB_QUEUE_BACKEND", "sqlite"),
+        "db_name": os.environ.get("JOB_QUEUE_DB_NAME"),  # defaults to the agent state database
+        "redis_url": os.environ.get("JOB_QUEUE_REDIS_URL", os.environ.get("REDIS_URL", "redis://localhost:6379/0")),
+        "workers": int(os.environ.get("JOB_WORKERS", 4)),  # per web worker process
+        "per_user_limit": int(os.environ.get("JOB_PER_USER_LIMIT", 2)),  # running jobs per user
+        "max_attempts": int(os.environ.get("JOB_MAX_ATTEMPTS", 3)),
+        "retry_backoff": float(os.environ.get("JOB_RETRY_BACKOFF", 2)),  # seconds, doubled per attempt
+        "retry_backoff_max": float(os.environ.get("JOB_RETRY_BACKOFF_MAX", 60)),
+        "lease_seconds": int(os.environ.get("JOB_LEASE_SECONDS", 300)),  # a dead worker's job runs again after this
+        "retention_seconds": int(os.environ.get("JOB_RETENTION_SECONDS", 86400)),  # finished jobs
+        "poll_interval": float(os.environ.get("JOB_POLL_INTERVAL", 0.5)),
+    }
+
+def get_admission_config() -> dict:
+    """Limits on LLM calls; the Redis backend makes the concurrency and rate limits global across workers."""
+    shared = is_shared_deployment()
+    return {
+        "enabled": os.environ.get("ADMISSION_ENABLED", "true").lower() in ("1", "true", "yes"),
+        "backend": os.environ.get("ADMISSION_BACKEND", "redis" if shared else "local"),
+        "llm_concurrency": int(os.environ.get("ADMISSION_LLM_CONCURRENCY", 8)),
+        "max_waiting": int(os.environ.get("ADMISSION_MAX_WAITING", 32)),  # LLM calls queued per process
+        "max_wait": float(os.environ.get("ADMISSION_MAX_WAIT", 20)),  # seconds, before giving up on a call
+        "slot_ttl": int(os.environ.get("ADMISSION_SLOT_TTL", 120)),  # a crashed worker's slots free up after this
+        "poll_interval": float(os.environ.get("ADMISSION_POLL_INTERVAL", 0.05)),  # for slots held by other workers
+        "user_rate": float(os.environ.get("ADMISSION_USER_RATE", 20)),  # messages per minute
+        "user_burst": int(os.environ.get("ADMISSION_USER_BURST", 5)),
+        "provider": os.environ.get("LLM_PROVIDER", ""),
+        "provider_rate": float(os.environ.get("ADMISSION_PROVIDER_RATE", 300)),  # LLM calls per minute
+        "provider_burst": int(os.environ.get("ADMISSION_PROVIDER_BURST", 20)),
+    }
+
+def get_tool_retry_config() -> dict:
+    """Retries of read-only tool calls that failed on a transient error (connection, 429, 5xx)."""
+    return {
+        "max_attempts": int(os.environ.get("TOOL_RETRY_ATTEMPTS", 3)),  # 1 disables retries
+        "initial_interval": float(os.environ.get("TOOL_RETRY_INTERVAL", 0.5)),
+        "max_interval": float(os.environ.get("TOOL_RETRY_MAX_INTERVAL", 8)),
+    }
 
 def get_agent_connection_string():
    return os.environ.get("AGENT_STATE_DB_NAME")
 
+def get_message_page_size() -> int:
+    return int(os.environ.get("MESSAGE_PAGE_SIZE", 50))
+
+def get_sql_debug() -> bool:
+    return os.environ.get("SQL_DEBUG", "").lower() in ("1", "true", "yes")
+
+def get_db_pool_config() -> dict:
+    return {
+        "pool_size": int(os.environ.get("DB_POOL_SIZE", 5)),
+        "max_overflow": int(os.environ.get("DB_POOL_MAX_OVERFLOW", 10)),
+        "pool_timeout": int(os.environ.get("DB_POOL_TIMEOUT", 30)),
+    }
+
+def get_sqlite_pragmas() -> dict:
+    """SQLite pragmas shared by the app database and the agent checkpoint database."""
+    return {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "foreign_keys": "ON",
+        "busy_timeout": int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 5000)),
+        "mmap_size": int(os.environ.get("SQLITE_MMAP_SIZE", 268435456)),  # 256 MiB
+        "cache_size": int(os.environ.get("SQLITE_CACHE_SIZE", -65536)),  # negative means KiB, 64 MiB
+    }
+
+def get_checkpoint_compaction_config() -> dict:
+    retention_days = os.environ.get("CHECKPOINT_RETENTION_DAYS")
+    return {
+        "keep_last": int(os.environ.get("CHECKPOINT_KEEP_LAST", 20)),
+        "retention_days": int(retention_days) if retention_days else None,
+        "vacuum_pages": int(os.environ.get("CHECKPOINT_VACUUM_PAGES", 1000)),
+        "interval_seconds": int(os.environ.get("CHECKPOINT_COMPACTION_INTERVAL", 3600)),  # 0 disables the job
+    }
+
+def get_gmail_config() -> dict:
+    """Gmail API client settings; GMAIL_API_ROOT_URL points the client at a stand-in server."""
+    root_url = os.environ.get("GMAIL_API_ROOT_URL", "https://gmail.googleapis.com/").rstrip("/") + "/"
+    return {
+        "root_url": root_url,
+        "batch_uri": root_url + "batch/gmail/v1",
+        "batch_size": int(os.environ.get("GMAIL_BATCH_SIZE", 50)),  # Gmail allows up to 100 calls per batch
+        "timeout": int(os.environ.get("GMAIL_TIMEOUT", 10)),
+        "num_retries": int(os.environ.get("GMAIL_NUM_RETRIES", 2)),
+        "client_cache_size": int(os.environ.get("GMAIL_CLIENT_CACHE_SIZE", 256)),
+        "client_ttl": int(os.environ.get("GMAIL_CLIENT_TTL", 3600)),
+        "metadata_cache_size": int(os.environ.get("GMAIL_METADATA_CACHE_SIZE", 1024)),
+        "metadata_ttl": int(os.environ.get("GMAIL_METADATA_TTL", 86400)),
+    }
+
+def get_google_credentials_config() -> dict:
+    return {
+        "refresh_margin": int(os.environ.get("GOOGLE_TOKEN_REFRESH_MARGIN", 300)),  # seconds before expiry
+        "refresh_interval": int(os.environ.get("GOOGLE_TOKEN_REFRESH_INTERVAL", 60)),  # 0 disables the job
+        "lock_timeout": int(os.environ.get("GOOGLE_TOKEN_LOCK_TIMEOUT", 30)),
+        "cache_size": int(os.environ.get("GOOGLE_CREDENTIALS_CACHE_SIZE", 1024)),
+        "cache_ttl": int(os.environ.get("GOOGLE_CREDENTIALS_CACHE_TTL", 3600)),
+        "presence_ttl": int(os.environ.get("GOOGLE_CREDENTIALS_PRESENCE_TTL", 30)),
+    }
+
+def get_metrics_config() -> dict:
+    return {
+        "enabled": os.environ.get("METRICS_ENABLED", "true").lower() in ("1", "true", "yes"),
+        "trace_log_enabled": os.environ.get("TRACE_LOG_ENABLED", "").lower() in ("1", "true", "yes"),
+    }
+
+def get_auth_config() -> dict:
+    return {
+        "bcrypt_rounds": int(os.environ.get("BCRYPT_ROUNDS", 12)),  # existing hashes are upgraded on login
+        "hash_workers": int(os.environ.get("AUTH_HASH_WORKERS", 2)),
+        "hash_queue_size": int(os.environ.get("AUTH_HASH_QUEUE_SIZE", 32)),
+    }
+
 def get_authorised_redirect_uris() -> list:
    return ["http://localhost:8000/auth/callback"]
 
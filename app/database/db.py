@@ -1,20 +1,73 @@
 import os
+import sqlite3
 
+import aiosqlite
 from sqlmodel import create_engine, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlalchemy import event
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import create_async_engine
 
 from dotenv import load_dotenv
 load_dotenv()
 
+from app.config import get_sql_debug, get_db_pool_config, get_sqlite_pragmas
+
+def get_pragma_statements() -> list[str]:
+    return [f"PRAGMA {name} = {value}" for name, value in get_sqlite_pragmas().items()]
+
+def configure_sqlite_connection(dbapi_connection):
+    """Applies the shared pragma policy to a DBAPI sqlite connection."""
+    cursor = dbapi_connection.cursor()
+    for statement in get_pragma_statements():
+        cursor.execute(statement)
+    cursor.close()
+
+# Set before any table exists, so compaction can free pages without a full VACUUM;
+# it has no effect on a database that was created without it
+CHECKPOINT_AUTO_VACUUM = "PRAGMA auto_vacuum = INCREMENTAL"
+
+def connect_checkpoint_db(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute(CHECKPOINT_AUTO_VACUUM)
+    configure_sqlite_connection(conn)
+    return conn
+
+async def aconnect_checkpoint_db(path: str) -> aiosqlite.Connection:
+    conn = await aiosqlite.connect(path)
+    await conn.execute(CHECKPOINT_AUTO_VACUUM)
+    for statement in get_pragma_statements():
+        await conn.execute(statement)
+    return conn
+
 sqlite_file = os.environ.get("SQLITE_DB_NAME")
-engine = create_engine(f"sqlite:///{sqlite_file}", echo=True)
+engine = create_engine(
+    f"sqlite:///{sqlite_file}",
+    echo=get_sql_debug(),
+    poolclass=QueuePool,
+    connect_args={"check_same_thread": False},
+    **get_db_pool_config(),
+)
+async_engine = create_async_engine(
+    f"sqlite+aiosqlite:///{sqlite_file}",
+    echo=get_sql_debug(),
+    poolclass=AsyncAdaptedQueuePool,
+    **get_db_pool_config(),
+)
 
 @event.listens_for(engine, "connect")
+@event.listens_for(async_engine.sync_engine, "connect")
 def set_sqlite_pragma(dbapi_connection, connection_record):
-    cursor = dbapi_connection.cursor()
-    cursor.execute("PRAGMA foreign_keys = ON")
-    cursor.close()
+    configure_sqlite_connection(dbapi_connection)
 
 def get_session():
     with Session(engine) as session:
-        yield session
\ No newline at end of file
+        yield session
+
+def new_async_session():
+    # Rows stay loaded after commit, so a turn's writes need no refresh round-trips
+    return AsyncSession(async_engine, expire_on_commit=False)
+
+async def get_async_session():
+    async with new_async_session() as session:
+        yield session
@@ -1,15 +1,25 @@
-from .users_sql import create_user, get_user_by_email, get_user_by_id
-from .chats_sql import create_chat, get_chats_by_user, get_chat_by_id, delete_chat_by_id
-from .messages_sql import create_message, get_messages_by_chat_id
+from .users_sql import create_user, acreate_user, get_user_by_email, aget_user_by_email, get_user_by_id, aget_user_by_id, aupdate_user_password
+from .chats_sql import create_chat, get_chats_by_user, aget_chats_by_user, get_chat_by_id, aget_chat_by_id, get_chat_ids, delete_chat_by_id
+from .messages_sql import create_message, acreate_messages, get_messages_by_chat_id, get_messages_page, aget_messages_page
 
 __all__ = [
     "create_user",
+    "acreate_user",
     "get_user_by_email",
+    "aget_user_by_email",
     "get_user_by_id",
+    "aget_user_by_id",
+    "aupdate_user_password",
     "create_chat",
     "get_chats_by_user",
+    "aget_chats_by_user",
     "get_chat_by_id",
+    "aget_chat_by_id",
+    "get_chat_ids",
     "delete_chat_by_id",
     "create_message",
+    "acreate_messages",
     "get_messages_by_chat_id",
+    "get_messages_page",
+    "aget_messages_page",
 ]
\ No newline at end of file
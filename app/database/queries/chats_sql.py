@@ -1,4 +1,7 @@
+from datetime import datetime
+
 from sqlmodel import Session, select, delete
+from sqlmodel.ext.asyncio.session import AsyncSession
 from ..models import Chat
 
 def create_chat(session: Session, chat: Chat):
@@ -8,11 +11,23 @@ def create_chat(session: Session, chat: Chat):
     return chat
 
 def get_chats_by_user(session: Session, user_id: str):
-    return session.exec(select(Chat).where(Chat.user_id == user_id)).all()
+    return session.exec(select(Chat).where(Chat.user_id == user_id).order_by(Chat.updated_at.desc())).all()
+
+async def aget_chats_by_user(session: AsyncSession, user_id: str):
+    return (await session.exec(select(Chat).where(Chat.user_id == user_id).order_by(Chat.updated_at.desc()))).all()
 
 def get_chat_by_id(session: Session, id: str):
     return session.exec(select(Chat).where(Chat.id == id)).first()
 
+async def aget_chat_by_id(session: AsyncSession, id: str):
+    return (await session.exec(select(Chat).where(Chat.id == id))).first()
+
+def get_chat_ids(session: Session, updated_before: datetime | None = None) -> set[str]:
+    query = select(Chat.id)
+    if updated_before:
+        query = query.where(Chat.updated_at < updated_before)
+    return set(session.exec(query).all())
+
 def delete_chat_by_id(session: Session, id: str):
     result = session.exec(delete(Chat).where(Chat.id == id))
     session.commit()
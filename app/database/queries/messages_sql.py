@@ -1,5 +1,9 @@
-from sqlmodel import Session, select
-from ..models import Message
+from datetime import datetime
+
+from sqlalchemy import tuple_
+from sqlmodel import Session, select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+from ..models import Chat, Message
 
 def create_message(session: Session, chat_id: str, role: str, content:str) -> Message:
     message = Message(chat_id=chat_id, role=role, content=content)
@@ -8,5 +12,49 @@ def create_message(session: Session, chat_id: str, role: str, content:str) -> Me
     session.refresh(message)
     return message
 
+async def acreate_messages(session: AsyncSession, chat_id: str, messages: list[tuple[str, str]]) -> list[Message]:
+    """Inserts a turn's `(role, content)` messages in a single transaction, in order.
+
+    The chat's `updated_at` is bumped in the same transaction.
+    """
+    rows = [Message(chat_id=chat_id, role=role, content=content) for role, content in messages]
+    session.add_all(rows)
+    await session.exec(update(Chat).where(Chat.id == chat_id).values(updated_at=datetime.now()))
+    await session.commit()
+    return rows
+
 def get_messages_by_chat_id(session: Session, chat_id: str):
     return session.exec(select(Message).where(Message.chat_id == chat_id)).all()
+
+def encode_message_cursor(message: Message) -> str:
+    return f"{message.created_at.isoformat()}_{message.id}"
+
+def decode_message_cursor(cursor: str) -> tuple[datetime, int]:
+    """Parses a cursor produced by `encode_message_cursor`. Raises ValueError if malformed."""
+    created_at, id = cursor.rsplit("_", 1)
+    return datetime.fromisoformat(created_at), int(id)
+
+def _messages_page_query(chat_id: str, limit: int, before: str | None):
+    query = select(Message).where(Message.chat_id == chat_id)
+    if before:
+        query = query.where(tuple_(Message.created_at, Message.id) < decode_message_cursor(before))
+    # One extra row tells whether an older page exists
+    return query.order_by(Message.created_at.desc(), Message.id.desc()).limit(limit + 1)
+
+def _messages_page(messages: list[Message], limit: int) -> tuple[list[Message], str | None]:
+    has_more = len(messages) > limit
+    messages = list(reversed(messages[:limit]))
+    next_cursor = encode_message_cursor(messages[0]) if has_more else None
+    return messages, next_cursor
+
+def get_messages_page(session: Session, chat_id: str, limit: int, before: str | None = None) -> tuple[list[Message], str | None]:
+    """Returns up to `limit` messages older than the `before` cursor, oldest first.
+
+    Pages are keyed on (created_at, id), so each one is a single range scan over the
+    (chat_id, created_at) index. The second value is the cursor of the next older page,
+    or None when there is nothing left to load.
+    """
+    return _messages_page(session.exec(_messages_page_query(chat_id, limit, before)).all(), limit)
+
+async def aget_messages_page(session: AsyncSession, chat_id: str, limit: int, before: str | None = None) -> tuple[list[Message], str | None]:
+    return _messages_page((await session.exec(_messages_page_query(chat_id, limit, before))).all(), limit)
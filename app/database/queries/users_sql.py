@@ -1,4 +1,5 @@
 from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from ..models import User
 
 def create_user(session: Session, user: User):
@@ -11,4 +12,22 @@ def get_user_by_email(session: Session, email: str):
     return session.exec(select(User).where(User.email == email)).first()
 
 def get_user_by_id(session: Session, id: str):
-    return session.exec(select(User).where(User.id == id)).first()
\ No newline at end of file
+    return session.exec(select(User).where(User.id == id)).first()
+
+async def aget_user_by_id(session: AsyncSession, id: str):
+    return (await session.exec(select(User).where(User.id == id))).first()
+
+async def acreate_user(session: AsyncSession, user: User):
+    session.add(user)
+    await session.commit()
+    await session.refresh(user)
+    return user
+
+async def aget_user_by_email(session: AsyncSession, email: str):
+    return (await session.exec(select(User).where(User.email == email))).first()
+
+async def aupdate_user_password(session: AsyncSession, user: User, password: str):
+    user.password = password
+    session.add(user)
+    await session.commit()
+    return user
@@ -0,0 +1,215 @@
+import base64
+import threading
+from functools import lru_cache
+
+import httplib2
+from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from googleapiclient.http import BatchHttpRequest
+
+from app import google_auth
+from app.caching import LRUCache
+from app.config import get_gmail_config
+
+METADATA_HEADERS = ["From", "Subject", "Date"]
+EXCLUDED_LABELS = {"TRASH", "SPAM"}
+
+_cfg = get_gmail_config()
+
+@lru_cache(maxsize=1)
+def get_gmail_service():
+    """The Gmail API resource, built once per process.
+
+    Building parses the discovery document, so it is shared by every user; requests
+    are executed with each user's own authorized http.
+    """
+    return build(
+        "gmail",
+        "v1",
+        http=httplib2.Http(),
+        client_options={"api_endpoint": _cfg["root_url"]},
+        static_discovery=True,
+    )
+
+class _BatchRequest(BatchHttpRequest):
+    """A batch that raises on parts rejected with 401 instead of refreshing the credentials itself."""
+    def _refresh_and_apply_credentials(self, request, http):
+        raise HttpError(httplib2.Response({"status": 401}), b"", uri=request.uri)
+
+class GmailClient:
+    """Gmail API calls made with one user's credentials.
+
+    An httplib2 connection is not thread-safe, so calls through the same client are
+    serialized; different users' clients run concurrently. A request rejected with
+    401 is retried once after `google_auth` refreshes the token, rather than by
+    AuthorizedHttp, which would bypass its single-flight refresh and token store.
+    """
+    def __init__(self, user_id: str, credentials: Credentials):
+        self.user_id = user_id
+        self.credentials = credentials
+        self.http = AuthorizedHttp(credentials, http=httplib2.Http(timeout=_cfg["timeout"]), refresh_status_codes=())
+        self._lock = threading.Lock()
+
+    def _with_renewal(self, send):
+        with self._lock:
+            try:
+                return send()
+            except HttpError as e:
+                if e.resp.status != 401 or not google_auth.renew_rejected_token(self.user_id, self.credentials):
+                    raise
+                return send()
+
+    def _execute(self, request):
+        return self._with_renewal(lambda: request.execute(http=self.http, num_retries=_cfg["num_retries"]))
+
+    def list_message_ids(self, max_results: int) -> list[str]:
+        messages = get_gmail_service().users().messages()
+        response = self._execute(messages.list(userId="me", maxResults=max_results))
+        return [message["id"] for message in response.get("messages", [])]
+
+    def get_messages(self, message_ids: list[str], format: str = "metadata") -> list[dict]:
+        """Fetches messages with one batch HTTP request per `batch_size` ids.
+
+        Messages deleted in the meantime are skipped. The result keeps the order of `message_ids`.
+        """
+        messages = get_gmail_service().users().messages()
+        results, errors = {}, []
+
+        def collect(request_id, response, exception):
+            if exception is None:
+                results[request_id] = response
+            elif not (isinstance(exception, HttpError) and exception.resp.status == 404):
+                errors.append(exception)
+
+        kwargs = {"metadataHeaders": METADATA_HEADERS} if format == "metadata" else {}
+        for start in range(0, len(message_ids), _cfg["batch_size"]):
+            batch = _BatchRequest(callback=collect, batch_uri=_cfg["batch_uri"])
+            for message_id in message_ids[start:start + _cfg["batch_size"]]:
+                batch.add(messages.get(userId="me", id=message_id, format=format, **kwargs), request_id=message_id)
+            self._with_renewal(lambda: batch.execute(http=self.http))
+        if errors:
+            raise errors[0]
+        return [results[message_id] for message_id in message_ids if message_id in results]
+
+    def get_history(self, start_history_id: str) -> tuple[set[str], set[str], str]:
+        """Message ids added and removed since `start_history_id`, and the latest history id.
+
+        Raises HttpError 404 when `start_history_id` is too old to sync from.
+        """
+        history = get_gmail_service().users().history()
+        added, removed = set(), set()
+        page_token, history_id = None, start_history_id
+        while True:
+            response = self._execute(history.list(
+                userId="me",
+                startHistoryId=start_history_id,
+                historyTypes=["messageAdded", "messageDeleted", "labelAdded"],
+                pageToken=page_token,
+            ))
+            for record in response.get("history", []):
+                for change in record.get("messagesAdded", []):
+                    added.add(change["message"]["id"])
+                for change in record.get("messagesDeleted", []):
+                    removed.add(change["message"]["id"])
+                for change in record.get("labelsAdded", []):
+                    if EXCLUDED_LABELS & set(change.get("labelIds", [])):
+                        removed.add(change["message"]["id"])
+            history_id = response.get("historyId", history_id)
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                return added - removed, removed, history_id
+
+    def get_history_id(self) -> str:
+        return self._execute(get_gmail_service().users().getProfile(userId="me"))["historyId"]
+
+_clients = LRUCache(maxsize=_cfg["client_cache_size"], ttl=_cfg["client_ttl"])
+
+def get_gmail_client(user_id: str, credentials: Credentials) -> GmailClient:
+    """A cached client per user, rebuilt only when the user's credentials object changes.
+
+    Token refreshes update the credentials in place, so they keep the client and its connection.
+    """
+    client = _clients.get(user_id)
+    if client is None or client.credentials is not credentials:
+        client = GmailClient(user_id, credentials)
+        _clients.set(user_id, client)
+    return client
+
+# Recent message metadata per user, kept current through the Gmail history API
+
+_mailboxes = LRUCache(maxsize=_cfg["metadata_cache_size"], ttl=_cfg["metadata_ttl"])
+
+def _summary(message: dict) -> dict:
+    headers = {h["name"].lower(): h["value"] for h in message.get("payload", {}).get("headers", [])}
+    return {
+        "id": message["id"],
+        "snippet": message.get("snippet", ""),
+        "sender": headers.get("from"),
+        "subject": headers.get("subject"),
+        "internal_date": int(message.get("internalDate", 0)),
+        "history_id": message.get("historyId"),
+    }
+
+def _full_sync(client: GmailClient, window: int) -> dict:
+    messages = client.get_messages(client.list_message_ids(window))
+    history_ids = [int(m["historyId"]) for m in messages if m.get("historyId")]
+    history_id = str(max(history_ids)) if history_ids else client.get_history_id()
+    return {"history_id": history_id, "window": window, "messages": [_summary(m) for m in messages]}
+
+def _incremental_sync(client: GmailClient, mailbox: dict) -> dict:
+    window = mailbox["window"]
+    added, removed, history_id = client.get_history(mailbox["history_id"])
+    if not added and not removed:
+        return {**mailbox, "history_id": history_id}
+    cached = [m for m in mailbox["messages"] if m["id"] not in removed]
+    if len(cached) < len(mailbox["messages"]):
+        # Deletions emptied part of the cached window; refill it from the mailbox
+        return _full_sync(client, window)
+    cached_ids = {m["id"] for m in cached}
+    new = [_summary(m) for m in client.get_messages(sorted(added - cached_ids))]
+    messages = sorted(new + cached, key=lambda m: m["internal_date"], reverse=True)
+    return {"history_id": history_id, "window": window, "messages": messages[:window]}
+
+def get_recent_messages(user_id: str, credentials: Credentials, max_results: int = 5, include_body: bool = False) -> list[dict]:
+    """The user's most recent messages, newest first.
+
+    Metadata comes from a per-user cache that is brought up to date with the history
+    API, so an unchanged mailbox costs one request. Bodies are fetched only when asked for.
+    """
+    client = get_gmail_client(user_id, credentials)
+    mailbox = _mailboxes.get(user_id)
+    if mailbox is None or mailbox["window"] < max_results:
+        mailbox = _full_sync(client, max_results)
+    else:
+        try:
+            mailbox = _incremental_sync(client, mailbox)
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+            # The history id expired; start over
+            mailbox = _full_sync(client, mailbox["window"])
+    _mailboxes.set(user_id, mailbox)
+
+    emails = [
+        {k: m[k] for k in ("id", "snippet", "sender", "subject")}
+        for m in mailbox["messages"][:max_results]
+    ]
+    if include_body:
+        bodies = {m["id"]: extract_body(m["payload"]) for m in client.get_messages([e["id"] for e in emails], format="full")}
+        for email in emails:
+            email["body"] = bodies.get(email["id"])
+    return emails
+
+def extract_body(payload):
+    if "parts" in payload:
+        for part in payload["parts"]:
+            if part.get("mimeType") in ["text/plain", "text/html"]:
+                data = part["body"].get("data")
+                if data:
+                    return base64.urlsafe_b64decode(data).decode("utf-8")
+            # Recursively check nested parts
+            if "parts" in part:
+                return extract_body(part)
+    return None
@@ -0,0 +1,220 @@
+import asyncio
+import json
+import logging
+import threading
+import weakref
+from datetime import datetime, timedelta, timezone
+
+import redis
+import requests
+from google.auth.exceptions import RefreshError
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+
+from app.caching import LRUCache, ar, r, try_redis
+from app.config import get_google_client_config, get_google_credentials_config
+
+logger = logging.getLogger(__name__)
+
+# The refresh token is long-lived and kept apart from the access token, which
+# expires together with its key
+REFRESH_KEY = "google:refresh:{user_id}"
+TOKEN_KEY = "google:token:{user_id}"
+LOCK_KEY = "google:refresh-lock:{user_id}"
+LEGACY_TOKEN_KEY = "gmail:token:{user_id}"
+
+_cfg = get_google_credentials_config()
+# One Credentials object per user and process, so authorized http clients built on
+# it (see app.gmail) see refreshed tokens without being rebuilt
+_credentials = LRUCache(maxsize=_cfg["cache_size"], ttl=_cfg["cache_ttl"])
+# Whether a user has connected Google, checked on every page render
+_presence = LRUCache(maxsize=_cfg["cache_size"], ttl=_cfg["presence_ttl"])
+# One lock per user with a refresh running or waiting; unused locks are dropped
+_user_locks: weakref.WeakValueDictionary[str, threading.Lock] = weakref.WeakValueDictionary()
+_user_locks_guard = threading.Lock()
+# Pooled connections to the token endpoint, shared by every refresh
+_token_session = requests.Session()
+
+def _user_lock(user_id: str) -> threading.Lock:
+    with _user_locks_guard:
+        lock = _user_locks.get(user_id)
+        if lock is None:
+            lock = _user_locks[user_id] = threading.Lock()
+        return lock
+
+def _as_utc(expiry: datetime) -> datetime:
+    return expiry if expiry.tzinfo else expiry.replace(tzinfo=timezone.utc)
+
+def _store_access_token(user_id: str, credentials: Credentials, pipe=None):
+    expiry = _as_utc(credentials.expiry)
+    ttl = int((expiry - datetime.now(timezone.utc)).total_seconds())
+    if ttl <= 0:
+        return
+    (pipe or r).set(TOKEN_KEY.format(user_id=user_id), json.dumps({"token": credentials.token, "expiry": expiry.isoformat()}), ex=ttl)
+
+def save_credentials(user_id: str, credentials: Credentials):
+    """Stores the credentials from a completed OAuth consent flow."""
+    pipe = r.pipeline(transaction=False)
+    if credentials.refresh_token:
+        pipe.set(REFRESH_KEY.format(user_id=user_id), json.dumps({
+            "refresh_token": credentials.refresh_token,
+            "scopes": list(credentials.scopes or []),
+        }))
+    _store_access_token(user_id, credentials, pipe)
+    pipe.execute()
+    _credentials.delete(user_id)
+    _presence.set(user_id, True)
+
+def delete_credentials(user_id: str):
+    r.delete(REFRESH_KEY.format(user_id=user_id), TOKEN_KEY.format(user_id=user_id), LEGACY_TOKEN_KEY.format(user_id=user_id))
+    _credentials.delete(user_id)
+    _presence.delete(user_id)
+
+def _load(user_id: str) -> Credentials | None:
+    refresh_raw, token_raw, legacy_raw = r.mget(
+        REFRESH_KEY.format(user_id=user_id),
+        TOKEN_KEY.format(user_id=user_id),
+        LEGACY_TOKEN_KEY.format(user_id=user_id),
+    )
+    if not refresh_raw and legacy_raw:
+        # Credentials cached before refresh tokens were stored on their own
+        refresh_raw = legacy_raw
+        r.set(REFRESH_KEY.format(user_id=user_id), legacy_raw)
+        r.delete(LEGACY_TOKEN_KEY.format(user_id=user_id))
+    if not refresh_raw and not token_raw:
+        return None
+    refresh = json.loads(refresh_raw) if refresh_raw else {}
+    token = json.loads(token_raw) if token_raw else {}
+    client = get_google_client_config()["web"]
+    credentials = Credentials(
+        token=token.get("token"),
+        refresh_token=refresh.get("refresh_token"),
+        token_uri=client["token_uri"],
+        client_id=client["client_id"],
+        client_secret=client["client_secret"],
+        scopes=refresh.get("scopes"),
+    )
+    if token.get("expiry"):
+        # google-auth compares against a naive UTC datetime
+        credentials.expiry = datetime.fromisoformat(token["expiry"]).astimezone(timezone.utc).replace(tzinfo=None)
+    return credentials
+
+def _expires_soon(credentials: Credentials) -> bool:
+    if not credentials.token or not credentials.expiry:
+        return True
+    margin = timedelta(seconds=_cfg["refresh_margin"])
+    return _as_utc(credentials.expiry) - margin <= datetime.now(timezone.utc)
+
+def _refresh(user_id: str, credentials: Credentials) -> Credentials | None:
+    """Refreshes the access token at most once across threads and workers.
+
+    A thread lock collapses concurrent refreshes in this process; a Redis lock does
+    the same across workers, whose waiters pick up the token the holder stores.
+    """
+    with _user_lock(user_id):
+        if not _expires_soon(credentials):
+            return credentials  # refreshed by another thread while we waited
+        stored = _load(user_id)
+        if stored is None:
+            return None
+        if not _expires_soon(stored):
+            credentials.token, credentials.expiry = stored.token, stored.expiry
+            return credentials
+        if not credentials.refresh_token:
+            return None
+
+        lock = r.lock(LOCK_KEY.format(user_id=user_id), timeout=_cfg["lock_timeout"], blocking_timeout=_cfg["lock_timeout"])
+        if not lock.acquire():
+            raise TimeoutError(f"timed out waiting for the Google token refresh of user {user_id}")
+        try:
+            stored = _load(user_id)
+            if stored is not None and not _expires_soon(stored):
+                credentials.token, credentials.expiry = stored.token, stored.expiry
+                return credentials
+            try:
+                credentials.refresh(Request(_token_session))
+            except RefreshError:
+                # The refresh token was revoked or expired; the user has to consent again
+                logger.warning("google refresh token rejected for user %s", user_id)
+                delete_credentials(user_id)
+                return None
+            _store_access_token(user_id, credentials)
+            return credentials
+        finally:
+            try:
+                lock.release()
+            except redis.exceptions.LockError:
+                pass  # held longer than lock_timeout; the lock already expired
+
+def renew_rejected_token(user_id: str, credentials: Credentials) -> bool:
+    """Refreshes an access token the API rejected before it expired.
+
+    The token is dropped from Redis unless another worker already replaced it, and
+    the refresh goes through `_refresh` like any other. Returns False when the user
+    has to consent again.
+    """
+    key = TOKEN_KEY.format(user_id=user_id)
+    stored = r.get(key)
+    if stored and json.loads(stored)["token"] == credentials.token:
+        r.delete(key)
+    credentials.token = None
+    return _refresh(user_id, credentials) is not None
+
+def get_credentials(user_id: str) -> Credentials | None:
+    """Valid credentials for the user, refreshed when the access token is about to expire.
+
+    Returns None when the user has not connected a Google account.
+    """
+    credentials = _credentials.get(user_id)
+    if credentials is None:
+        credentials = _load(user_id)
+        if credentials is None:
+            return None
+        _credentials.set(user_id, credentials)
+    if _expires_soon(credentials):
+        credentials = _refresh(user_id, credentials)
+        if credentials is None:
+            _credentials.delete(user_id)
+    return credentials
+
+async def ahas_credentials(user_id: str) -> bool:
+    """Whether the user has connected a Google account, cached for `presence_ttl` seconds.
+
+    Reports False without caching it when Redis is unavailable.
+    """
+    present = _presence.get(user_id)
+    if present is not None:
+        return present
+    count = await try_redis(lambda: ar.exists(
+        REFRESH_KEY.format(user_id=user_id),
+        TOKEN_KEY.format(user_id=user_id),
+        LEGACY_TOKEN_KEY.format(user_id=user_id),
+    ))
+    if count is None:
+        return False
+    _presence.set(user_id, count > 0)
+    return count > 0
+
+def refresh_expiring_credentials() -> int:
+    """Refreshes the access tokens of recently active users that expire within the refresh margin.
+
+    Active users are the ones whose credentials this process holds; inactive users
+    are refreshed on demand by `get_credentials` instead.
+    """
+    refreshed = 0
+    for user_id in _credentials.keys():
+        credentials = _credentials.get(user_id)
+        if credentials is not None and _expires_soon(credentials):
+            refreshed += get_credentials(user_id) is not None
+    return refreshed
+
+async def run_refresh_job(interval_seconds: int):
+    """Refreshes access tokens ahead of expiry every `interval_seconds`, off the event loop."""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            refreshed = await asyncio.to_thread(refresh_expiring_credentials)
+            if refreshed:
+                logger.info("refreshed %d google access tokens", refreshed)
+        except Exception:
+            logger.exception("google token refresh failed")
@@ -1,22 +1,24 @@
 from typing import Optional, Literal, Callable
 
-import sqlite3
-
 from langgraph.graph import StateGraph, START, END
-from langgraph.prebuilt import ToolNode
 
-from langchain_core.messages import HumanMessage, ToolMessage
-from langgraph.checkpoint.sqlite import SqliteSaver
-from langgraph.store.memory import InMemoryStore
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.store.base import BaseStore
 from langchain_core.runnables import RunnableConfig
 
 import app.tools as tools
-from app.config import get_agent_connection_string
+from app.config import get_context_config, get_response_cache_config, get_prerouter_config, get_llm
+from app import instrumentation
+from app.checkpointer import create_checkpointer
+from app.store import get_store
 
 from app.state import State
-from app.assistants import factory, registry
+from app.assistants import context, factory, prerouter, registry
+from app.knowledge_base import response_cache
 
 SENSITIVE_NODE = "sensitive_tools"
+KNOWLEDGE_BASE = "knowledge_base"
 
 def user_info(state: State, config: RunnableConfig):
     user_profile = tools.get_user_info.invoke(state)
@@ -31,39 +33,62 @@ def pop_dialog_state(state: State) -> dict:
     """
 
     messages = []
-    if state["messages"][-1].tool_calls:
-        # Note: Doesn't currently handle the edge case where the llm performs parallel tool calls
+    tool_calls = state["messages"][-1].tool_calls
+    if tool_calls:
+        # Every parallel tool call needs an answer; only the escalation is acted on
+        escalation = next((tc for tc in tool_calls if tc["name"] == "CompleteOrEscalate"), tool_calls[0])
         messages.append(
             ToolMessage(
                 content="Resuming dialog with the supervisor agent. Please reflect on the past conversation and assist the user as needed.",
-                tool_call_id=state["messages"][-1].tool_calls[0]["id"],
+                tool_call_id=escalation["id"],
             )
         )
+        others = [tc for tc in tool_calls if tc["id"] != escalation["id"]]
+        messages += factory.decline_tool_calls(others, "Control was handed back to the supervisor agent.")
     return {
         "dialog_state": "pop",
         "messages": messages,
     }
 
-def build_graph():
+def build_graph(checkpointer: Optional[BaseCheckpointSaver] = None, store: Optional[BaseStore] = None):
     graph_builder = StateGraph(State)
 
     supervisor_registry = registry.get_supervisor()
     assistant_registry = registry.get_assistants()
 
     # Nodes
+    # New requests go through the deterministic pre-router before reaching the supervisor LLM
+    prerouter_enabled = get_prerouter_config()["enabled"]
+    workflow_nodes = {name: name for name in assistant_registry}
+    workflow_nodes[supervisor_registry["name"]] = "pre_router" if prerouter_enabled else supervisor_registry["name"]
+    entry_point = START
+    if get_context_config()["summary_enabled"]:
+        graph_builder.add_node("summarize_conversation", context.create_summarization_node(get_llm()))
+        graph_builder.add_edge(START, "summarize_conversation")
+        entry_point = "summarize_conversation"
+
+    # The profile is checkpointed with the thread, and only fetched again once its cached copy changes
     graph_builder.add_node("fetch_user_info", user_info)
-    graph_builder.add_edge(START, "fetch_user_info")
+    graph_builder.add_conditional_edges(
+        entry_point,
+        factory.route_user_info,
+        {"fetch_user_info": "fetch_user_info", **workflow_nodes},
+    )
     graph_builder.add_conditional_edges(
         "fetch_user_info",
         factory.route_to_workflow,
-        [name for name in assistant_registry] + [supervisor_registry["name"]]
+        workflow_nodes,
     )
 
     # Supervisor node
     supervisor = factory.create_supervisor(registry.SUPERVISOR["system_prompt"], registry.SUPERVISOR["tools"])
     graph_builder.add_node(registry.SUPERVISOR["name"], factory.create_node(supervisor))
 
+    # Knowledge base questions other users already asked are answered from cache, before entering the assistant
+    kb_cache = response_cache.get_response_cache() if get_response_cache_config()["enabled"] else None
+
     # Assistant nodes
+    tool_retry = factory.create_tool_retry_policy()
     interrupt_before_node = []
     for assistant_name, cfg in assistant_registry.items():
         # Entry Nodes
@@ -77,14 +102,21 @@ def build_graph():
             tool_tag=cfg.get("tool_tag"),
         )
         assistant_node = factory.create_node(assistant)
+        sensitive_tools = tools.tools_registry.get_tools_by_tags(assistant_name, "sensitive")
+        sensitive_tool_names = tools.tools_registry.get_tool_names_by_tags(assistant_name, "sensitive")
+        if assistant_name == KNOWLEDGE_BASE and kb_cache:
+            assistant_node = response_cache.create_cache_writer(assistant_node, kb_cache)
         graph_builder.add_node(assistant_name, assistant_node)
 
         # Tools
         safe_tools = tools.tools_registry.get_tools_by_tags(assistant_name, "safe")
-        graph_builder.add_node(f"safe_tools_{assistant_name}", ToolNode(safe_tools))
-
-        sensitive_tools = tools.tools_registry.get_tools_by_tags(assistant_name, "sensitive")
-        graph_builder.add_node(f"sensitive_tools_{assistant_name}", ToolNode(sensitive_tools))
+        # Only read-only tools are retried; a sensitive call may have taken effect before failing
+        graph_builder.add_node(
+            f"safe_tools_{assistant_name}",
+            factory.create_tool_node(safe_tools, sensitive_tool_names),
+            retry_policy=tool_retry,
+        )
+        graph_builder.add_node(f"sensitive_tools_{assistant_name}", factory.create_tool_node(sensitive_tools))
 
         # Routing
         graph_builder.add_edge(entry_node_name, assistant_name)
@@ -100,7 +132,11 @@ def build_graph():
                 END,
             ],
         )
-        graph_builder.add_edge(f"safe_tools_{assistant_name}", assistant_name)
+        graph_builder.add_conditional_edges(
+            f"safe_tools_{assistant_name}",
+            factory.create_safe_tools_route(assistant_name),
+            [f"sensitive_tools_{assistant_name}", assistant_name],
+        )
         graph_builder.add_edge(f"sensitive_tools_{assistant_name}", assistant_name)
 
         interrupt_before_node.append(f"sensitive_tools_{assistant_name}")
@@ -108,30 +144,49 @@ def build_graph():
     graph_builder.add_node("leave_skill", pop_dialog_state)
 
     # Conditional edge from supervisor to all entry nodes + END
+    supervisor_routes = {f"enter_{name}": f"enter_{name}" for name in assistant_registry}
+    supervisor_routes[END] = END
+    if kb_cache:
+        graph_builder.add_node("knowledge_base_cache", response_cache.create_cache_lookup_node(kb_cache))
+        graph_builder.add_conditional_edges(
+            "knowledge_base_cache",
+            response_cache.route_cache_lookup,
+            {"hit": END, "miss": f"enter_{KNOWLEDGE_BASE}"},
+        )
+        supervisor_routes[f"enter_{KNOWLEDGE_BASE}"] = "knowledge_base_cache"
     graph_builder.add_conditional_edges(
         supervisor_registry["name"],
         factory.route_supervisor,
-        [f"enter_{name}" for name in assistant_registry] + [END],
+        supervisor_routes,
     )
 
+    if prerouter_enabled:
+        graph_builder.add_node("pre_router", prerouter.create_prerouter_node(prerouter.get_router()))
+        graph_builder.add_conditional_edges(
+            "pre_router",
+            factory.route_pre_router,
+            {**supervisor_routes, supervisor_registry["name"]: supervisor_registry["name"]},
+        )
+
     graph_builder.add_edge("leave_skill", supervisor_registry["name"])
 
     # Short-term (within-thread) memory
-    db_string = get_agent_connection_string()
-    conn = sqlite3.connect(db_string, check_same_thread=False)
-    memory = SqliteSaver(conn)
+    if checkpointer is None:
+        checkpointer = create_checkpointer()
+    checkpointer = instrumentation.instrument_checkpointer(checkpointer)
 
     # Long-term (cross-thread) memory
-    in_memory_store = InMemoryStore()
+    if store is None:
+        store = get_store()
 
     return graph_builder.compile(
         name = "Customer Support Graph",
-        checkpointer = memory,
-        store = in_memory_store,
+        checkpointer = checkpointer,
+        store = store,
         interrupt_before = interrupt_before_node,
     )
 
-def graph_updates(graph, thread_id: str, user_id: str, user_input: str | None = None):
+async def graph_updates(graph, thread_id: str, user_id: str, user_input: str | None = None, message_id: str | None = None):
     config = {
         "configurable": {
             "thread_id": thread_id,
@@ -140,26 +195,77 @@ def graph_updates(graph, thread_id: str, user_id: str, user_input: str | None =
     }
     messages = None
     if user_input:
-        messages = {"messages": [HumanMessage(content=user_input)]}
-    messages = graph.invoke(messages, config)
+        messages = {"messages": [HumanMessage(content=user_input, id=message_id)]}
+    tracer = instrumentation.start_turn(thread_id)
+    if tracer:
+        config["callbacks"] = [tracer]
+    try:
+        messages = await graph.ainvoke(messages, config)
+    finally:
+        if tracer:
+            tracer.finish()
     return messages
 
-def graph_reject_tool_call(graph, thread_id: str, user_id: str):
+async def graph_stream(graph, thread_id: str, user_id: str, user_input: str | None = None):
+    """Run the graph and yield its progress as `(kind, data)` events.
+
+    `token` events carry LLM output as it is generated, `tool` events the name of each
+    tool once its tool node has run.
+    """
+    config = {
+        "configurable": {
+            "thread_id": thread_id,
+            "user_id": user_id,
+        }
+    }
+    messages = None
+    if user_input:
+        messages = {"messages": [HumanMessage(content=user_input)]}
+    tracer = instrumentation.start_turn(thread_id)
+    if tracer:
+        config["callbacks"] = [tracer]
+    try:
+        async for mode, chunk in graph.astream(messages, config, stream_mode=["messages", "updates"]):
+            if mode == "messages":
+                message, _ = chunk
+                # Models that don't stream emit one complete AIMessage instead of chunks
+                if isinstance(message, AIMessage) and isinstance(message.content, str) and message.content:
+                    yield "token", message.content
+            elif mode == "updates":
+                for node_name, update in chunk.items():
+                    if not node_name.startswith(("safe_tools_", "sensitive_tools_")) or not update:
+                        continue
+                    for tool_message in update.get("messages", []):
+                        yield "tool", tool_message.name
+    finally:
+        if tracer:
+            tracer.finish()
+
+async def graph_reject_tool_call(graph, thread_id: str, user_id: str):
     config = {
         "configurable": {
             "thread_id": thread_id,
             "user_id": user_id,
         }
     }
-    snapshot = graph.get_state(config)
-    tool_id = snapshot.values["messages"][-1].tool_calls[0]["id"]
+    snapshot = await graph.aget_state(config)
+    # Safe calls of the same batch have already run; only the sensitive ones are pending
+    pending_tool_calls = factory.get_pending_tool_calls(snapshot.values["messages"])
     messages = {
         "messages": [
             ToolMessage(
-                tool_call_id = tool_id,
+                tool_call_id = tool_call["id"],
                 content = f"The user rejected the tool call when asked for confirmation. Continue assisting the user, accounting for the user's input."
             )
+            for tool_call in pending_tool_calls
         ]
     }
-    messages = graph.invoke(messages, config)
+    tracer = instrumentation.start_turn(thread_id)
+    if tracer:
+        config["callbacks"] = [tracer]
+    try:
+        messages = await graph.ainvoke(messages, config)
+    finally:
+        if tracer:
+            tracer.finish()
     return messages
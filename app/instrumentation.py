@@ -0,0 +1,247 @@
+import json
+import logging
+import threading
+import time
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langgraph.checkpoint.base import BaseCheckpointSaver
+
+from app.config import get_metrics_config
+from app.metrics import Counter, Histogram
+
+trace_logger = logging.getLogger("app.trace")
+
+_cfg = get_metrics_config()
+
+graph_turn_duration = Histogram("graph_turn_duration_seconds", "Wall time of one graph run, until it ends or interrupts.")
+graph_node_duration = Histogram("graph_node_duration_seconds", "Wall time per graph node.", ("node",))
+llm_duration = Histogram("llm_duration_seconds", "Wall time per LLM call, by the node making it.", ("node",))
+llm_time_to_first_token = Histogram(
+    "llm_time_to_first_token_seconds",
+    "Time until a streaming LLM call yields its first token, by the node making it.",
+    ("node",),
+)
+llm_tokens = Counter("llm_tokens_total", "LLM tokens by node and kind (prompt or completion).", ("node", "kind"))
+tool_duration = Histogram("tool_duration_seconds", "Wall time per tool call.", ("tool", "status"))
+checkpoint_duration = Histogram(
+    "checkpoint_duration_seconds",
+    "Checkpointer call latency.",
+    ("operation",),
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+
+_turn_listeners = []
+
+def add_turn_listener(listener):
+    """Calls `listener(tracer)` with every finished turn, e.g. to aggregate spans in a benchmark."""
+    _turn_listeners.append(listener)
+
+def _usage(response) -> tuple[int, int]:
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+
+class TurnTracer(BaseCallbackHandler):
+    """Callback handler timing the nodes, LLM calls and tools of one graph run.
+
+    Measurements go to the metrics registry as they complete. `finish` records the
+    turn and, when TRACE_LOG_ENABLED is set, logs all spans as one JSON line.
+    """
+    run_inline = True
+    ignore_retriever = True
+    ignore_custom_event = True
+
+    def __init__(self, thread_id: str):
+        self.thread_id = thread_id
+        self.start = time.perf_counter()
+        self.spans = []
+        self._root = None
+        self._open = {}
+        self._lock = threading.Lock()
+
+    def _begin(self, run_id: UUID, **span):
+        with self._lock:
+            self._open[run_id] = {**span, "start": time.perf_counter()}
+
+    def _end(self, run_id: UUID, **fields) -> dict | None:
+        with self._lock:
+            span = self._open.pop(run_id, None)
+            if span is None:
+                return None
+            span["seconds"] = time.perf_counter() - span.pop("start")
+            span.update(fields)
+            self.spans.append(span)
+            return span
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        if self._root is None and parent_run_id is None:
+            self._root = run_id
+        elif parent_run_id == self._root and metadata and "langgraph_node" in metadata:
+            self._begin(run_id, type="node", name=metadata["langgraph_node"])
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        span = self._end(run_id)
+        if span:
+            graph_node_duration.observe(span["seconds"], node=span["name"])
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        span = self._end(run_id, error=type(error).__name__)
+        if span:
+            graph_node_duration.observe(span["seconds"], node=span["name"])
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        self._begin(run_id, type="llm", name=(metadata or {}).get("langgraph_node", ""))
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        with self._lock:
+            span = self._open.get(run_id)
+            if span is not None and "ttft_seconds" not in span:
+                span["ttft_seconds"] = time.perf_counter() - span["start"]
+                llm_time_to_first_token.observe(span["ttft_seconds"], node=span["name"])
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        prompt_tokens, completion_tokens = _usage(response)
+        span = self._end(run_id, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        if span:
+            llm_duration.observe(span["seconds"], node=span["name"])
+            llm_tokens.inc(prompt_tokens, node=span["name"], kind="prompt")
+            llm_tokens.inc(completion_tokens, node=span["name"], kind="completion")
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        span = self._end(run_id, error=type(error).__name__)
+        if span:
+            llm_duration.observe(span["seconds"], node=span["name"])
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._begin(run_id, type="tool", name=kwargs.get("name") or serialized.get("name", ""))
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        span = self._end(run_id)
+        if span:
+            tool_duration.observe(span["seconds"], tool=span["name"], status="ok")
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        span = self._end(run_id, error=type(error).__name__)
+        if span:
+            tool_duration.observe(span["seconds"], tool=span["name"], status="error")
+
+    def finish(self):
+        seconds = time.perf_counter() - self.start
+        self.seconds = seconds
+        graph_turn_duration.observe(seconds)
+        for listener in _turn_listeners:
+            listener(self)
+        if _cfg["trace_log_enabled"]:
+            trace_logger.info(json.dumps({
+                "thread_id": self.thread_id,
+                "seconds": round(seconds, 4),
+                "prompt_tokens": sum(s.get("prompt_tokens", 0) for s in self.spans),
+                "completion_tokens": sum(s.get("completion_tokens", 0) for s in self.spans),
+                "spans": [
+                    {k: round(v, 4) if isinstance(v, float) else v for k, v in span.items()}
+                    for span in self.spans
+                ],
+            }))
+
+def start_turn(thread_id: str) -> TurnTracer | None:
+    """A tracer for one graph run, or None when metrics are disabled."""
+    return TurnTracer(thread_id) if _cfg["enabled"] else None
+
+class InstrumentedCheckpointer(BaseCheckpointSaver):
+    """Delegates to `saver`, timing its reads and writes.
+
+    Only this wrapper is timed, so a saver whose async methods call its sync ones
+    (like RedisSaver) counts each operation once.
+    """
+    def __init__(self, saver: BaseCheckpointSaver):
+        self.saver = saver
+
+    @property
+    def serde(self):
+        return self.saver.serde
+
+    @property
+    def config_specs(self):
+        return self.saver.config_specs
+
+    def get_tuple(self, config):
+        with checkpoint_duration.time(operation="get"):
+            return self.saver.get_tuple(config)
+
+    async def aget_tuple(self, config):
+        with checkpoint_duration.time(operation="get"):
+            return await self.saver.aget_tuple(config)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        with checkpoint_duration.time(operation="put"):
+            return self.saver.put(config, checkpoint, metadata, new_versions)
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        with checkpoint_duration.time(operation="put"):
+            return await self.saver.aput(config, checkpoint, metadata, new_versions)
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        with checkpoint_duration.time(operation="put_writes"):
+            return self.saver.put_writes(config, writes, task_id, task_path)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        with checkpoint_duration.time(operation="put_writes"):
+            return await self.saver.aput_writes(config, writes, task_id, task_path)
+
+    def list(self, config, **kwargs):
+        return self.saver.list(config, **kwargs)
+
+    def alist(self, config, **kwargs):
+        return self.saver.alist(config, **kwargs)
+
+    def delete_thread(self, thread_id):
+        return self.saver.delete_thread(thread_id)
+
+    async def adelete_thread(self, thread_id):
+        return await self.saver.adelete_thread(thread_id)
+
+    def delete_for_runs(self, run_ids):
+        return self.saver.delete_for_runs(run_ids)
+
+    async def adelete_for_runs(self, run_ids):
+        return await self.saver.adelete_for_runs(run_ids)
+
+    def copy_thread(self, source_thread_id, target_thread_id):
+        return self.saver.copy_thread(source_thread_id, target_thread_id)
+
+    async def acopy_thread(self, source_thread_id, target_thread_id):
+        return await self.saver.acopy_thread(source_thread_id, target_thread_id)
+
+    def prune(self, thread_ids, **kwargs):
+        return self.saver.prune(thread_ids, **kwargs)
+
+    async def aprune(self, thread_ids, **kwargs):
+        return await self.saver.aprune(thread_ids, **kwargs)
+
+    def get_delta_channel_history(self, **kwargs):
+        return self.saver.get_delta_channel_history(**kwargs)
+
+    async def aget_delta_channel_history(self, **kwargs):
+        return await self.saver.aget_delta_channel_history(**kwargs)
+
+    def get_next_version(self, current, channel):
+        return self.saver.get_next_version(current, channel)
+
+    def with_allowlist(self, extra_allowlist):
+        saver = self.saver.with_allowlist(extra_allowlist)
+        return self if saver is self.saver else InstrumentedCheckpointer(saver)
+
+    def __getattr__(self, name):
+        # The saver's own attributes, e.g. its connection or Redis client
+        return getattr(self.saver, name)
+
+def instrument_checkpointer(checkpointer: BaseCheckpointSaver) -> BaseCheckpointSaver:
+    """Wraps the checkpointer to time its reads and writes; a no-op when metrics are disabled."""
+    if not _cfg["enabled"]:
+        return checkpointer
+    return InstrumentedCheckpointer(checkpointer)
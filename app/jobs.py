@@ -0,0 +1,405 @@
+import asyncio
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Awaitable, Callable
+
+import redis
+
+from app.config import get_agent_connection_string, get_job_queue_config
+from app.database import db
+from app.metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+job_duration = Histogram("job_duration_seconds", "Wall time per background job attempt.", ("kind", "status"))
+job_queue_wait = Histogram("job_queue_wait_seconds", "Time from enqueue until a worker first picks a job up.", ("kind",))
+
+_cfg = get_job_queue_config()
+# Set on enqueue so idle workers in this process don't wait for the next poll
+_wakeup: asyncio.Event | None = None
+
+class JobQueue(ABC):
+    """Durable queue of background jobs, shared by the workers of every process.
+
+    A claimed job is leased for `lease_seconds`, and its worker extends the lease while
+    the job runs; if the worker dies, the job is queued again once the lease runs out.
+    `claim` skips users who already have `per_user_limit` jobs running. Finished jobs
+    are kept for `retention_seconds`. Jobs are dicts with `id`, `kind`, `user_id`,
+    `payload`, `status`, `attempts`, `result`, `error` and `created_at`.
+    """
+    def __init__(self, lease_seconds: int, retention_seconds: int):
+        self.lease_seconds = lease_seconds
+        self.retention_seconds = retention_seconds
+
+    @abstractmethod
+    def enqueue(self, kind: str, user_id: str, payload: dict) -> str:
+        ...
+
+    @abstractmethod
+    def claim(self, per_user_limit: int) -> dict | None:
+        ...
+
+    @abstractmethod
+    def extend_lease(self, job_id: str) -> None:
+        ...
+
+    @abstractmethod
+    def complete(self, job_id: str, result: dict) -> None:
+        ...
+
+    @abstractmethod
+    def retry(self, job_id: str, error: str, delay: float) -> None:
+        ...
+
+    @abstractmethod
+    def fail(self, job_id: str, error: str) -> None:
+        ...
+
+    @abstractmethod
+    def get(self, job_id: str) -> dict | None:
+        ...
+
+class SqliteJobQueue(JobQueue):
+    """Queue backed by a SQLite table; claims are single UPDATE statements, so workers
+    in other processes sharing the database never claim the same job."""
+    SWEEP_INTERVAL_SECONDS = 300
+    COLUMNS = "id, kind, user_id, payload, status, attempts, result, error, created_at"
+
+    def __init__(self, conn: sqlite3.Connection, **kwargs):
+        super().__init__(**kwargs)
+        self.conn = conn
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        with self._lock, self.conn:
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    run_at REAL NOT NULL,
+                    lease_until REAL,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_run_at ON jobs(status, run_at)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_user_status ON jobs(user_id, status)")
+
+    def _job(self, row) -> dict:
+        job_id, kind, user_id, payload, status, attempts, result, error, created_at = row
+        return {
+            "id": job_id,
+            "kind": kind,
+            "user_id": user_id,
+            "payload": json.loads(payload),
+            "status": status,
+            "attempts": attempts,
+            "result": json.loads(result) if result else None,
+            "error": error,
+            "created_at": created_at,
+        }
+
+    def enqueue(self, kind, user_id, payload):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock, self.conn:
+            self.conn.execute(
+                """
+                INSERT INTO jobs (id, kind, user_id, payload, status, run_at, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (job_id, kind, str(user_id), json.dumps(payload), QUEUED, now, now, now),
+            )
+        return job_id
+
+    def claim(self, per_user_limit):
+        now = time.time()
+        with self._lock, self.conn:
+            # Jobs of workers that died mid-run
+            self.conn.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE status = ? AND lease_until < ?",
+                (QUEUED, now, RUNNING, now),
+            )
+            row = self.conn.execute(
+                f"""
+                UPDATE jobs SET status = ?, attempts = attempts + 1, lease_until = ?, updated_at = ?
+                WHERE id = (
+                    SELECT id FROM jobs AS queued
+                    WHERE status = ? AND run_at <= ?
+                      AND (SELECT COUNT(*) FROM jobs WHERE user_id = queued.user_id AND status = ?) < ?
+                    ORDER BY run_at LIMIT 1
+                )
+                RETURNING {self.COLUMNS}
+                """,
+                (RUNNING, now + self.lease_seconds, now, QUEUED, now, RUNNING, per_user_limit),
+            ).fetchone()
+            if now - self._last_sweep > self.SWEEP_INTERVAL_SECONDS:
+                self.conn.execute(
+                    "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                    (DONE, FAILED, now - self.retention_seconds),
+                )
+                self._last_sweep = now
+        return self._job(row) if row else None
+
+    def extend_lease(self, job_id):
+        now = time.time()
+        with self._lock, self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET lease_until = ?, updated_at = ? WHERE id = ? AND status = ?",
+                (now + self.lease_seconds, now, job_id, RUNNING),
+            )
+
+    def _finish(self, job_id: str, status: str, result: dict | None, error: str | None, run_at: float | None = None):
+        now = time.time()
+        with self._lock, self.conn:
+            # A job whose lease ran out may already be running elsewhere; its outcome wins
+            self.conn.execute(
+                """
+                UPDATE jobs SET status = ?, result = ?, error = ?, run_at = COALESCE(?, run_at),
+                    lease_until = NULL, updated_at = ?
+                WHERE id = ? AND status = ?
+                """,
+                (status, json.dumps(result) if result is not None else None, error, run_at, now, job_id, RUNNING),
+            )
+
+    def complete(self, job_id, result):
+        self._finish(job_id, DONE, result, None)
+
+    def retry(self, job_id, error, delay):
+        self._finish(job_id, QUEUED, None, error, run_at=time.time() + delay)
+
+    def fail(self, job_id, error):
+        self._finish(job_id, FAILED, None, error)
+
+    def get(self, job_id):
+        with self._lock:
+            row = self.conn.execute(f"SELECT {self.COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._job(row) if row else None
+
+# KEYS: queued, leases. ARGV: now, lease seconds, per-user limit.
+# Job and per-user keys are derived in the script, so this needs a single Redis node.
+CLAIM_SCRIPT = """
+local now = tonumber(ARGV[1])
+for _, id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now)) do
+    redis.call('ZREM', KEYS[2], id)
+    local user = redis.call('HGET', 'job:' .. id, 'user_id')
+    if user then
+        redis.call('DECR', 'jobs:running:' .. user)
+        redis.call('HSET', 'job:' .. id, 'status', 'queued', 'updated_at', now)
+        redis.call('ZADD', KEYS[1], now, id)
+    else
+        redis.call('ZREM', KEYS[1], id)
+    end
+end
+for _, id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now, 'LIMIT', 0, 100)) do
+    local user = redis.call('HGET', 'job:' .. id, 'user_id')
+    if not user then
+        redis.call('ZREM', KEYS[1], id)
+    elseif (tonumber(redis.call('GET', 'jobs:running:' .. user)) or 0) < tonumber(ARGV[3]) then
+        redis.call('ZREM', KEYS[1], id)
+        redis.call('INCR', 'jobs:running:' .. user)
+        redis.call('ZADD', KEYS[2], now + tonumber(ARGV[2]), id)
+        redis.call('HINCRBY', 'job:' .. id, 'attempts', 1)
+        redis.call('HSET', 'job:' .. id, 'status', 'running', 'updated_at', now)
+        return id
+    end
+end
+return false
+"""
+
+# KEYS: queued, leases. ARGV: id, status, result, error, now, run_at, retention seconds.
+FINISH_SCRIPT = """
+if redis.call('ZREM', KEYS[2], ARGV[1]) == 0 then
+    return 0
+end
+local key = 'job:' .. ARGV[1]
+redis.call('DECR', 'jobs:running:' .. redis.call('HGET', key, 'user_id'))
+redis.call('HSET', key, 'status', ARGV[2], 'result', ARGV[3], 'error', ARGV[4], 'updated_at', ARGV[5])
+if ARGV[2] == 'queued' then
+    redis.call('ZADD', KEYS[1], ARGV[6], ARGV[1])
+else
+    redis.call('EXPIRE', key, ARGV[7])
+end
+return 1
+"""
+
+class RedisJobQueue(JobQueue):
+    """Queue backed by Redis, for workers spread over several hosts.
+
+    Each job is a hash. Queued jobs sit in a sorted set scored by when they may run,
+    running ones in another scored by lease expiry, and a counter per user tracks
+    their running jobs. Claims and outcomes are Lua scripts, so they are atomic.
+    """
+    QUEUED_KEY = "jobs:queued"
+    LEASES_KEY = "jobs:leases"
+
+    def __init__(self, client: redis.Redis, **kwargs):
+        super().__init__(**kwargs)
+        self.client = client
+        self._claim = client.register_script(CLAIM_SCRIPT)
+        self._finish_script = client.register_script(FINISH_SCRIPT)
+
+    def enqueue(self, kind, user_id, payload):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        pipe = self.client.pipeline()
+        pipe.hset(f"job:{job_id}", mapping={
+            "kind": kind,
+            "user_id": str(user_id),
+            "payload": json.dumps(payload),
+            "status": QUEUED,
+            "attempts": 0,
+            "created_at": now,
+            "updated_at": now,
+        })
+        pipe.zadd(self.QUEUED_KEY, {job_id: now})
+        pipe.execute()
+        return job_id
+
+    def claim(self, per_user_limit):
+        job_id = self._claim(keys=[self.QUEUED_KEY, self.LEASES_KEY], args=[time.time(), self.lease_seconds, per_user_limit])
+        return self.get(job_id.decode()) if job_id else None
+
+    def extend_lease(self, job_id):
+        # XX: a lease that already ran out stays with whoever holds it now
+        self.client.zadd(self.LEASES_KEY, {job_id: time.time() + self.lease_seconds}, xx=True)
+
+    def _finish(self, job_id: str, status: str, result: dict | None, error: str | None, run_at: float = 0):
+        self._finish_script(
+            keys=[self.QUEUED_KEY, self.LEASES_KEY],
+            args=[job_id, status, json.dumps(result) if result is not None else "", error or "", time.time(), run_at, self.retention_seconds],
+        )
+
+    def complete(self, job_id, result):
+        self._finish(job_id, DONE, result, None)
+
+    def retry(self, job_id, error, delay):
+        self._finish(job_id, QUEUED, None, error, run_at=time.time() + delay)
+
+    def fail(self, job_id, error):
+        self._finish(job_id, FAILED, None, error)
+
+    def get(self, job_id):
+        stored = {k.decode(): v.decode() for k, v in self.client.hgetall(f"job:{job_id}").items()}
+        if not stored:
+            return None
+        return {
+            "id": job_id,
+            "kind": stored["kind"],
+            "user_id": stored["user_id"],
+            "payload": json.loads(stored["payload"]),
+            "status": stored["status"],
+            "attempts": int(stored["attempts"]),
+            "result": json.loads(stored["result"]) if stored.get("result") else None,
+            "error": stored.get("error") or None,
+            "created_at": float(stored["created_at"]),
+        }
+
+@lru_cache(maxsize=1)
+def get_job_queue() -> JobQueue:
+    kwargs = {"lease_seconds": _cfg["lease_seconds"], "retention_seconds": _cfg["retention_seconds"]}
+    if _cfg["backend"] == "redis":
+        return RedisJobQueue(redis.Redis.from_url(_cfg["redis_url"]), **kwargs)
+    conn = db.connect_checkpoint_db(_cfg["db_name"] or get_agent_connection_string())
+    return SqliteJobQueue(conn, **kwargs)
+
+async def aenqueue(kind: str, user_id: str, payload: dict) -> str:
+    job_id = await asyncio.to_thread(get_job_queue().enqueue, kind, user_id, payload)
+    if _wakeup is not None:
+        _wakeup.set()
+    return job_id
+
+async def aget_job(job_id: str) -> dict | None:
+    return await asyncio.to_thread(get_job_queue().get, job_id)
+
+def _retry_delay(attempts: int) -> float:
+    delay = min(_cfg["retry_backoff"] * 2 ** (attempts - 1), _cfg["retry_backoff_max"])
+    return delay * random.uniform(0.5, 1)  # jitter, so retries of a burst spread out
+
+async def _heartbeat(queue: JobQueue, job_id: str):
+    """Extends a running job's lease, so a long turn isn't claimed again and run twice."""
+    while True:
+        await asyncio.sleep(queue.lease_seconds / 3)
+        try:
+            await asyncio.to_thread(queue.extend_lease, job_id)
+        except Exception:
+            logger.warning("failed to extend the lease of job %s", job_id, exc_info=True)
+
+async def _run(queue: JobQueue, handlers: dict, job: dict):
+    kind = job["kind"]
+    if job["attempts"] == 1:
+        job_queue_wait.observe(time.time() - job["created_at"], kind=kind)
+    handler = handlers.get(kind)
+    if handler is None:
+        await asyncio.to_thread(queue.fail, job["id"], f"no handler for {kind} jobs")
+        return
+
+    start = time.perf_counter()
+    heartbeat = asyncio.create_task(_heartbeat(queue, job["id"]))
+    try:
+        result = await handler(job)
+    except asyncio.CancelledError:
+        # Shutting down: hand the job to another worker rather than waiting out the lease
+        await asyncio.to_thread(queue.retry, job["id"], "worker stopped", 0)
+        raise
+    except Exception as e:
+        job_duration.observe(time.perf_counter() - start, kind=kind, status="error")
+        error = f"{type(e).__name__}: {e}"
+        if job["attempts"] < _cfg["max_attempts"]:
+            logger.warning("job %s (%s) failed on attempt %d, retrying: %s", job["id"], kind, job["attempts"], error)
+            await asyncio.to_thread(queue.retry, job["id"], error, _retry_delay(job["attempts"]))
+        else:
+            logger.exception("job %s (%s) failed after %d attempts", job["id"], kind, job["attempts"])
+            await asyncio.to_thread(queue.fail, job["id"], error)
+        return
+    finally:
+        heartbeat.cancel()
+    job_duration.observe(time.perf_counter() - start, kind=kind, status="ok")
+    await asyncio.to_thread(queue.complete, job["id"], result)
+
+async def _work(queue: JobQueue, handlers: dict, wakeup: asyncio.Event):
+    while True:
+        try:
+            job = await asyncio.to_thread(queue.claim, _cfg["per_user_limit"])
+        except Exception:
+            logger.exception("failed to claim a job")
+            job = None
+        if job is None:
+            try:
+                await asyncio.wait_for(wakeup.wait(), _cfg["poll_interval"])
+            except asyncio.TimeoutError:
+                pass
+            wakeup.clear()
+            continue
+        try:
+            await _run(queue, handlers, job)
+        except Exception:
+            # Recording the outcome failed; the job runs again once its lease is out
+            logger.exception("failed to record the outcome of job %s", job["id"])
+
+async def run_workers(handlers: dict[str, Callable[[dict], Awaitable[dict]]]):
+    """Runs JOB_WORKERS workers until cancelled, passing each claimed job to `handlers[job["kind"]]`.
+
+    A handler's return value is stored as the job's result. A handler that raises is
+    retried with exponential backoff, up to JOB_MAX_ATTEMPTS attempts in all.
+    """
+    global _wakeup
+    _wakeup = asyncio.Event()
+    queue = get_job_queue()
+    await asyncio.gather(*(_work(queue, handlers, _wakeup) for _ in range(_cfg["workers"])))
@@ -0,0 +1,3 @@
+from .index import KnowledgeBaseIndex, get_index, tokenize
+
+__all__ = ["KnowledgeBaseIndex", "get_index", "tokenize"]
@@ -0,0 +1,237 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+from app.config import get_knowledge_base_config
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_RE.findall(text.lower())
+
+def hashed_embeddings(texts: list[str], dim: int) -> np.ndarray:
+    """Embeds texts locally by feature-hashing their unigrams and bigrams.
+
+    Returns L2-normalized float32 vectors, so a dot product is the cosine similarity.
+    """
+    vectors = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        tokens = tokenize(text)
+        for feature in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+            h = zlib.crc32(feature.encode())
+            vectors[row, h % dim] += 1.0 if h & 0x80000000 else -1.0
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+class KnowledgeBaseIndex:
+    """BM25 inverted index over FAQ chunks, with optional dense vectors.
+
+    The index is a directory of flat numpy arrays opened with `mmap_mode="r"`, so
+    every worker process maps the same pages instead of loading its own copy:
+
+    - `postings_offsets.npy`: start of each term's postings, by term id
+    - `postings_docs.npy` / `postings_tf.npy`: chunk ids and term frequencies
+    - `doc_lengths.npy`: chunk lengths in tokens
+    - `chunks.bin` / `chunk_offsets.npy`: UTF-8 chunk texts
+    - `embeddings.npy`: optional, normalized dense vectors
+    - `vocab.json` / `meta.json`: term ids, BM25 parameters, sources and version
+    """
+    def __init__(self, path: str | Path):
+        # Resolved once, so every file comes from the same version even if it is replaced meanwhile
+        self.path = path = Path(path).resolve()
+        with open(path / "meta.json") as f:
+            self.meta = json.load(f)
+        with open(path / "vocab.json") as f:
+            self.vocab = json.load(f)
+
+        self.postings_offsets = np.load(path / "postings_offsets.npy", mmap_mode="r")
+        self.postings_docs = np.load(path / "postings_docs.npy", mmap_mode="r")
+        self.postings_tf = np.load(path / "postings_tf.npy", mmap_mode="r")
+        self.doc_lengths = np.load(path / "doc_lengths.npy", mmap_mode="r")
+        self.chunk_offsets = np.load(path / "chunk_offsets.npy", mmap_mode="r")
+        self.chunk_sources = np.load(path / "chunk_sources.npy", mmap_mode="r")
+        self.texts = np.memmap(path / "chunks.bin", dtype=np.uint8, mode="r")
+        self._length_norm = None
+        self.embeddings = None
+        if self.meta["embedding_dim"]:
+            self.embeddings = np.load(path / "embeddings.npy", mmap_mode="r")
+
+    @property
+    def version(self) -> str:
+        return self.meta["version"]
+
+    def __len__(self) -> int:
+        return self.meta["n_chunks"]
+
+    def chunk(self, i: int) -> dict:
+        start, end = self.chunk_offsets[i], self.chunk_offsets[i + 1]
+        return {
+            "text": bytes(self.texts[start:end]).decode("utf-8"),
+            "source": self.meta["sources"][self.chunk_sources[i]],
+        }
+
+    def bm25_scores(self, query: str) -> np.ndarray:
+        k1, b = self.meta["k1"], self.meta["b"]
+        n_chunks, avg_length = self.meta["n_chunks"], self.meta["avg_length"]
+        scores = np.zeros(n_chunks, dtype=np.float32)
+        if self._length_norm is None:
+            self._length_norm = (k1 * (1 - b + b * np.asarray(self.doc_lengths) / avg_length)).astype(np.float32)
+        length_norm = self._length_norm
+        for term in set(tokenize(query)):
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            start, end = self.postings_offsets[term_id], self.postings_offsets[term_id + 1]
+            docs = self.postings_docs[start:end]
+            tf = self.postings_tf[start:end]
+            idf = np.log(1 + (n_chunks - len(docs) + 0.5) / (len(docs) + 0.5))
+            scores[docs] += idf * tf * (k1 + 1) / (tf + length_norm[docs])
+        return scores
+
+    def dense_scores(self, query: str) -> np.ndarray:
+        query_vector = hashed_embeddings([query], self.meta["embedding_dim"])[0]
+        return self.embeddings @ query_vector
+
+    def search(self, query: str, k: int = 3, dense: bool = True) -> list[dict]:
+        """Returns the top `k` chunks, fusing BM25 and dense rankings when vectors exist."""
+        rankings = [self.bm25_scores(query)]
+        if dense and self.embeddings is not None:
+            rankings.append(self.dense_scores(query))
+
+        # Reciprocal rank fusion over each ranking's top candidates
+        fused = Counter()
+        for scores in rankings:
+            candidates = min(len(scores), k * 10)
+            top = np.argpartition(-scores, candidates - 1)[:candidates]
+            top = top[np.argsort(-scores[top])]
+            for rank, i in enumerate(top):
+                if scores[i] > 0:
+                    fused[int(i)] += 1 / (60 + rank)
+
+        return [
+            {**self.chunk(i), "score": score}
+            for i, score in fused.most_common(k)
+        ]
+
+    @classmethod
+    def build(cls, chunks: list[dict], path: str | Path, embedding_dim: int = 0, k1: float = 1.5, b: float = 0.75) -> "KnowledgeBaseIndex":
+        """Builds an index for `chunks` (dicts with `text` and `source`) and publishes it at `path`.
+
+        The files go to a new directory next to `path`, named after the index version,
+        and `path` is a symlink switched to it in one rename. Processes reading the
+        previous index keep their mapped files intact and load the new one on their
+        next `get_index()`.
+        """
+        if not chunks:
+            raise ValueError("cannot build an index without chunks")
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        staging = Path(tempfile.mkdtemp(prefix=f".{path.name}-", dir=path.parent))
+        try:
+            version = cls._write(chunks, staging, embedding_dim, k1, b)
+            target = path.parent / f"{path.name}-{version}"
+            if target.exists():
+                shutil.rmtree(staging)  # the same index was built before
+            else:
+                staging.rename(target)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        _publish(path, target)
+        return cls(path)
+
+    @staticmethod
+    def _write(chunks: list[dict], path: Path, embedding_dim: int, k1: float, b: float) -> str:
+        vocab, postings, lengths = {}, [], []
+        for doc_id, chunk in enumerate(chunks):
+            counts = Counter(tokenize(chunk["text"]))
+            lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                term_id = vocab.setdefault(term, len(vocab))
+                if term_id == len(postings):
+                    postings.append([])
+                postings[term_id].append((doc_id, tf))
+
+        sizes = np.array([len(p) for p in postings], dtype=np.int64)
+        np.save(path / "postings_offsets.npy", np.concatenate([[0], np.cumsum(sizes)]))
+        np.save(path / "postings_docs.npy", np.array([d for p in postings for d, _ in p], dtype=np.int32))
+        np.save(path / "postings_tf.npy", np.array([tf for p in postings for _, tf in p], dtype=np.float32))
+        np.save(path / "doc_lengths.npy", np.array(lengths, dtype=np.float32))
+
+        encoded = [chunk["text"].encode("utf-8") for chunk in chunks]
+        with open(path / "chunks.bin", "wb") as f:
+            for text in encoded:
+                f.write(text)
+        np.save(path / "chunk_offsets.npy", np.concatenate([[0], np.cumsum([len(t) for t in encoded])]).astype(np.int64))
+
+        sources = sorted({chunk["source"] for chunk in chunks})
+        source_ids = {source: i for i, source in enumerate(sources)}
+        np.save(path / "chunk_sources.npy", np.array([source_ids[c["source"]] for c in chunks], dtype=np.int32))
+
+        if embedding_dim:
+            np.save(path / "embeddings.npy", hashed_embeddings([c["text"] for c in chunks], embedding_dim))
+
+        digest = hashlib.sha256()
+        for text in encoded:
+            digest.update(text)
+        meta = {
+            "version": f"{digest.hexdigest()[:16]}-{embedding_dim}",
+            "n_chunks": len(chunks),
+            "avg_length": float(np.mean(lengths)) or 1.0,
+            "k1": k1,
+            "b": b,
+            "embedding_dim": embedding_dim,
+            "sources": sources,
+        }
+        with open(path / "vocab.json", "w") as f:
+            json.dump(vocab, f)
+        # meta.json is written last and marks the index as complete
+        with open(path / "meta.json", "w") as f:
+            json.dump(meta, f)
+        return meta["version"]
+
+def _publish(path: Path, target: Path):
+    """Points the `path` symlink at `target` atomically and removes unused older versions."""
+    previous = path.resolve() if path.is_symlink() else None
+    if path.exists() and not path.is_symlink():
+        # An index written in place by an older build; readers' mapped files survive the move
+        path.rename(path.parent / f"{path.name}-unversioned-{int(time.time())}")
+    link = path.parent / f".{path.name}.link"
+    if link.is_symlink():
+        link.unlink()
+    link.symlink_to(target.name)
+    os.replace(link, path)
+    # The previous version stays for processes still opening it; unlinking mapped files is safe
+    for old in path.parent.glob(f"{path.name}-*"):
+        if old.is_dir() and old not in (target, previous):
+            shutil.rmtree(old, ignore_errors=True)
+
+_index: KnowledgeBaseIndex | None = None
+_index_lock = threading.Lock()
+
+def get_index() -> KnowledgeBaseIndex | None:
+    """The current index, or None when none has been ingested yet.
+
+    Each version lives in its own directory, so a changed symlink target means a new
+    version to load.
+    """
+    global _index
+    path = Path(get_knowledge_base_config()["index_dir"])
+    if not (path / "meta.json").exists():
+        return None
+    current = path.resolve()
+    if _index is None or _index.path != current:
+        with _index_lock:
+            if _index is None or _index.path != current:
+                _index = KnowledgeBaseIndex(current)
+    return _index
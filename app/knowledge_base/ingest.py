@@ -0,0 +1,51 @@
+import argparse
+from pathlib import Path
+
+from app.config import get_knowledge_base_config
+from .index import KnowledgeBaseIndex
+
+def chunk_document(text: str, source: str, max_words: int) -> list[dict]:
+    """Packs a document's paragraphs into chunks of at most `max_words` words.
+
+    Paragraphs are never split unless a single one exceeds the limit on its own.
+    """
+    chunks, current = [], []
+    for paragraph in (p.strip() for p in text.split("\n\n")):
+        if not paragraph:
+            continue
+        words = paragraph.split()
+        if current and len(current) + len(words) > max_words:
+            chunks.append(" ".join(current))
+            current = []
+        while len(words) > max_words:
+            chunks.append(" ".join(words[:max_words]))
+            words = words[max_words:]
+        current.extend(words)
+    if current:
+        chunks.append(" ".join(current))
+    return [{"text": chunk, "source": source} for chunk in chunks]
+
+def load_documents(paths: list[str]) -> list[tuple[str, str]]:
+    documents = []
+    for path in map(Path, paths):
+        files = sorted(p for p in path.rglob("*") if p.suffix in (".md", ".txt")) if path.is_dir() else [path]
+        documents.extend((str(f), f.read_text(encoding="utf-8")) for f in files)
+    return documents
+
+# Usage: python -m app.knowledge_base.ingest docs/faq/ [--out data/kb_index] [--dense 256]
+def main():
+    parser = argparse.ArgumentParser(description="Chunk FAQ documents and build the knowledge base index.")
+    parser.add_argument("paths", nargs="+", help="FAQ files or directories of .md/.txt files")
+    parser.add_argument("--out", default=get_knowledge_base_config()["index_dir"])
+    parser.add_argument("--chunk-words", type=int, default=200)
+    parser.add_argument("--dense", type=int, default=0, metavar="DIM", help="also store DIM-dimensional vectors")
+    args = parser.parse_args()
+
+    chunks = []
+    for source, text in load_documents(args.paths):
+        chunks.extend(chunk_document(text, source, args.chunk_words))
+    index = KnowledgeBaseIndex.build(chunks, args.out, embedding_dim=args.dense)
+    print(f"indexed {len(index)} chunks into {args.out} (version {index.version})")
+
+if __name__ == "__main__":
+    main()
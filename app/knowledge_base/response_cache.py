@@ -0,0 +1,180 @@
+from functools import lru_cache
+
+import numpy as np
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.runnables import Runnable, RunnableLambda
+from langgraph.store.base import BaseStore
+
+from app.assistants.factory import decline_tool_calls
+from app.assistants.prerouter import PREROUTED_ID_PREFIX
+from app.caching import LRUCache
+from app.config import get_response_cache_config
+from app.metrics import Counter
+from app.state import State
+from app.store import STORE_ERRORS, get_store
+from app.tools import ToKnowledgeBaseAssistant, faq_lookup
+from .index import get_index, hashed_embeddings, tokenize
+
+EMBEDDING_DIM = 256
+RESPONSE_NAMESPACE = "kb_response"
+# Only answers grounded in these tools alone are shared; they don't read anything about the user
+GROUNDING_TOOLS = frozenset({faq_lookup.name})
+
+response_cache_lookups = Counter("kb_response_cache_lookups_total", "Knowledge base response cache lookups by result (hit, near_hit or miss).", ("result",))
+
+def normalize_query(query: str) -> str:
+    return " ".join(tokenize(query))
+
+class ResponseCache:
+    """Knowledge base answers shared by all users and workers, keyed on the hand-off question.
+
+    Entries live in the long-term store, under the knowledge base index version so
+    re-ingesting the FAQ invalidates them, and expire after `ttl` seconds. Lookups
+    match the normalized question exactly first, then fall back to the most similar
+    of the `maxsize` most recent questions, if it is at least `threshold` similar.
+    A store that can't be reached counts as a miss.
+    """
+    def __init__(self, store: BaseStore, maxsize: int, ttl: float, threshold: float):
+        self.store = store
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self._vectors = LRUCache(maxsize=maxsize, ttl=ttl)  # normalized question -> embedding
+
+    def _vector(self, normalized: str) -> np.ndarray:
+        vector = self._vectors.get(normalized)
+        if vector is None:
+            vector = hashed_embeddings([normalized], EMBEDDING_DIM)[0]
+            self._vectors.set(normalized, vector)
+        return vector
+
+    def _lookup(self, normalized: str, version: str) -> tuple[str | None, str]:
+        namespace = (RESPONSE_NAMESPACE, version)
+        item = self.store.get(namespace, normalized)
+        if item is not None:
+            return item.value["answer"], "hit"
+
+        candidates = self.store.search(namespace, limit=self.maxsize)
+        if candidates:
+            similarities = np.stack([self._vector(c.key) for c in candidates]) @ self._vector(normalized)
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.threshold:
+                return candidates[best].value["answer"], "near_hit"
+        return None, "miss"
+
+    def get(self, question: str, version: str) -> str | None:
+        normalized = normalize_query(question)
+        answer, result = None, "miss"
+        if normalized:
+            try:
+                answer, result = self._lookup(normalized, version)
+            except STORE_ERRORS:
+                pass
+        response_cache_lookups.inc(result=result)
+        return answer
+
+    def put(self, question: str, version: str, answer: str):
+        normalized = normalize_query(question)
+        if not normalized:
+            return
+        try:
+            self.store.put((RESPONSE_NAMESPACE, version), normalized, {"answer": answer}, ttl=self.ttl / 60)
+        except STORE_ERRORS:
+            pass
+
+@lru_cache(maxsize=1)
+def get_response_cache() -> ResponseCache:
+    cfg = get_response_cache_config()
+    return ResponseCache(get_store(), maxsize=cfg["maxsize"], ttl=cfg["ttl"], threshold=cfg["threshold"])
+
+def _index_version() -> str:
+    index = get_index()
+    return index.version if index else "none"
+
+def _handoff(messages: list) -> tuple[int, str | None]:
+    """Position of the latest hand-off to the knowledge base, and its question if it can be shared.
+
+    The supervisor writes the request as a standalone question. A pre-routed request
+    is the user's own message, which may lean on earlier turns, so it is only used
+    when it opens the conversation.
+    """
+    for i in range(len(messages) - 1, -1, -1):
+        message = messages[i]
+        if not isinstance(message, AIMessage):
+            continue
+        for tool_call in message.tool_calls:
+            if tool_call["name"] != ToKnowledgeBaseAssistant.__name__:
+                continue
+            if tool_call["id"].startswith(PREROUTED_ID_PREFIX) and sum(isinstance(m, HumanMessage) for m in messages[:i]) > 1:
+                return i, None
+            return i, tool_call["args"].get("request")
+    return len(messages), None
+
+def _mentions_user(text: str, profile: dict) -> bool:
+    name = profile.get("name") or ""
+    values = [profile.get("email"), profile.get("user_id"), name, *name.split()]
+    lowered = text.lower()
+    return any(value and len(value) > 2 and value.lower() in lowered for value in values)
+
+def create_cache_lookup_node(cache: ResponseCache) -> Runnable:
+    """Node placed in front of the knowledge base entry node.
+
+    On a hit it answers the supervisor's hand-off tool calls and the user directly,
+    skipping the assistant and its tool loop. On a miss it leaves the state untouched.
+    """
+    def knowledge_base_cache(state: State) -> dict:
+        messages = state["messages"]
+        _, question = _handoff(messages)
+        answer = cache.get(question, _index_version()) if question else None
+        if answer is None:
+            return {}
+        tool_call, *other_tool_calls = messages[-1].tool_calls
+        return {
+            "messages": [
+                ToolMessage(content="Answered from the knowledge base response cache.", tool_call_id=tool_call["id"]),
+                *decline_tool_calls(other_tool_calls, "Only one assistant can be delegated to at a time."),
+                AIMessage(content=answer),
+            ]
+        }
+    return RunnableLambda(knowledge_base_cache)
+
+def route_cache_lookup(state: State) -> str:
+    # On a miss the last message is still the supervisor's hand-off tool call
+    last_message = state["messages"][-1]
+    if isinstance(last_message, AIMessage) and not last_message.tool_calls:
+        return "hit"
+    return "miss"
+
+def create_cache_writer(node: Runnable, cache: ResponseCache) -> Runnable:
+    """Wraps the knowledge base assistant node to cache its final answers for everyone.
+
+    An answer is only cached when the assistant looked it up with the grounding
+    tools and nothing else since the hand-off, and neither it nor the question
+    mentions the user's name, email or id.
+    """
+    def store(state: State, update: dict) -> dict:
+        response = update["messages"][-1]
+        if response.tool_calls or not isinstance(response.content, str) or not response.content:
+            return update
+        messages = state["messages"]
+        start, question = _handoff(messages)
+        if not question:
+            return update
+        tools_used = {
+            tool_call["name"]
+            for message in messages[start + 1:]
+            if isinstance(message, AIMessage)
+            for tool_call in message.tool_calls
+        }
+        profile = state.get("user_profile") or {}
+        if tools_used and tools_used <= GROUNDING_TOOLS and not _mentions_user(f"{question}\n{response.content}", profile):
+            cache.put(question, _index_version(), response.content)
+        return update
+
+    def knowledge_base(state: State) -> dict:
+        return store(state, node.invoke(state))
+
+    async def aknowledge_base(state: State) -> dict:
+        return store(state, await node.ainvoke(state))
+
+    return RunnableLambda(knowledge_base, afunc=aknowledge_base)
@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import time
+import weakref
+from contextlib import asynccontextmanager
+
+import redis
+
+from app.caching import ar
+from app.config import get_thread_lock_config
+
+logger = logging.getLogger(__name__)
+
+LOCK_KEY = "thread-lock:{thread_id}"
+
+_cfg = get_thread_lock_config()
+# One lock per thread with a turn running or waiting; unused locks are dropped
+_local_locks: weakref.WeakValueDictionary[str, asyncio.Lock] = weakref.WeakValueDictionary()
+
+class ThreadBusyError(Exception):
+    """Raised when another turn on the same thread holds the lock for longer than THREAD_LOCK_WAIT."""
+
+class ThreadLockLost(ThreadBusyError):
+    """Raised in a turn whose lock could not be renewed, since another turn may now run on the thread."""
+
+async def _renew(lock, interval: float, turn: asyncio.Task) -> bool:
+    """Renews `lock` until cancelled; if renewing fails, cancels `turn` rather than let it run unlocked."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await lock.reacquire()
+        except (redis.RedisError, OSError):
+            logger.warning("failed to renew thread lock %s, cancelling the turn", lock.name)
+            turn.cancel()
+            return False
+
+@asynccontextmanager
+async def _redis_lock(thread_id: str, wait: float):
+    """Holds the thread's Redis lock, renewing it so long turns keep it.
+
+    A crashed worker's lock expires after THREAD_LOCK_TIMEOUT. When Redis is down,
+    turns are only serialized within this worker rather than failing. A turn whose
+    lock can't be renewed is cancelled, and ThreadLockLost raised in its place.
+    """
+    lock = ar.lock(LOCK_KEY.format(thread_id=thread_id), timeout=_cfg["timeout"], blocking_timeout=max(wait, 0))
+    try:
+        acquired = await lock.acquire()
+    except (redis.RedisError, OSError):
+        logger.warning("thread lock unavailable, serializing thread %s in this worker only", thread_id)
+        acquired = None
+    if acquired is None:
+        yield
+        return
+    if not acquired:
+        raise ThreadBusyError(f"thread {thread_id} is busy")
+
+    turn = asyncio.current_task()
+    renewal = asyncio.create_task(_renew(lock, _cfg["timeout"] / 3, turn))
+    try:
+        yield
+    except asyncio.CancelledError:
+        if renewal.done() and not renewal.cancelled():
+            turn.uncancel()
+            raise ThreadLockLost(f"lost the lock on thread {thread_id}")
+        raise
+    finally:
+        renewal.cancel()
+        try:
+            await lock.release()
+        except (redis.RedisError, OSError):
+            pass  # expired or unreachable; it times out on its own
+
+@asynccontextmanager
+async def thread_lock(thread_id: str):
+    """Runs the body while no other turn on `thread_id` does.
+
+    Waiters in this worker queue on an asyncio lock, so only one of them at a time
+    polls the Redis lock. Both waits together take at most THREAD_LOCK_WAIT.
+    """
+    lock = _local_locks.get(thread_id)
+    if lock is None:
+        lock = _local_locks[thread_id] = asyncio.Lock()
+    deadline = time.monotonic() + _cfg["wait"]
+    try:
+        await asyncio.wait_for(lock.acquire(), _cfg["wait"])
+    except asyncio.TimeoutError:
+        raise ThreadBusyError(f"thread {thread_id} is busy")
+    try:
+        if _cfg["backend"] == "redis":
+            async with _redis_lock(thread_id, deadline - time.monotonic()):
+                yield
+        else:
+            yield
+    finally:
+        lock.release()
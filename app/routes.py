@@ -1,24 +1,29 @@
+import asyncio
+import math
 from urllib.parse import urlencode
 from urllib.parse import urlparse, parse_qs
 
 from fastapi import APIRouter, Request, Form, Depends, HTTPException
-from fastapi.responses import RedirectResponse, HTMLResponse
+from fastapi.responses import RedirectResponse, HTMLResponse, PlainTextResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 import markdown as md
 
-from google_auth_oauthlib.flow import Flow
-
 from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app.database import db, models, queries
-from app.auth import hash_password, verify_password
-from app.graph import graph_updates, graph_reject_tool_call, SENSITIVE_NODE
-from app.config import get_google_client_config, get_google_client_scopes, get_authorised_redirect_uris
-from app.caching import cache_gmail_token, get_cached_gmail_token
+from app.graph import graph_stream, SENSITIVE_NODE
+from app.config import get_google_client_config, get_google_client_scopes, get_authorised_redirect_uris, get_message_page_size, get_metrics_config
+from app import admission, auth, google_auth, jobs, locks, metrics, turns
+from app.store import ainvalidate_user_profile
 
 router = APIRouter()
 templates = Jinja2Templates(directory="app/templates")
 
+CHAT_BUSY_MESSAGE = "I'm still working on your previous message. Please try again in a moment."
+JOB_FAILED_MESSAGE = "Sorry, something went wrong while working on that. Please try again."
+OVERLOADED_MESSAGE = "I'm handling a lot of messages right now. Please try again in a moment."
+
 @router.get("/signup")
 def signup_form(request: Request):
     return templates.TemplateResponse("signup.html", {"request": request})
@@ -30,38 +35,67 @@ def login_form(request: Request):
 
 
 @router.post("/signup")
-def signup(request: Request, name: str = Form(), email: str = Form(), password: str = Form(), session: Session = Depends(db.get_session)):
-    user = queries.get_user_by_email(session, email)
+async def signup(request: Request, name: str = Form(), email: str = Form(), password: str = Form(), session: AsyncSession = Depends(db.get_async_session)):
+    user = await queries.aget_user_by_email(session, email)
     if user:
         return templates.TemplateResponse("login.html", {"request": request, "error": "Email already exists"})
-    hashed_password = hash_password(password)
+    try:
+        hashed_password = await auth.ahash_password(password)
+    except auth.HashingBusyError:
+        return _busy("signup.html", request)
     user = models.User(name=name, email=email, password=hashed_password)
-    queries.create_user(session, user)
+    await queries.acreate_user(session, user)
     return RedirectResponse("/login", status_code=302)
 
 
 @router.post("/login")
-def login(request: Request, email: str = Form(), password: str = Form(), session: Session = Depends(db.get_session)):
-    user = queries.get_user_by_email(session, email)
-    if not user or not verify_password(password, user.password):
-        return templates.TemplateResponse("login.html", {"request": request, "error": "Invalid credentials"})
+async def login(request: Request, email: str = Form(), password: str = Form(), session: AsyncSession = Depends(db.get_async_session)):
+    user = await queries.aget_user_by_email(session, email)
+    try:
+        if not user or not await auth.averify_password(password, user.password):
+            return templates.TemplateResponse("login.html", {"request": request, "error": "Invalid credentials"})
+        if auth.needs_rehash(user.password):
+            # The bcrypt cost changed; upgrade the hash while the plain password is at hand
+            await queries.aupdate_user_password(session, user, await auth.ahash_password(password))
+            await ainvalidate_user_profile(user.id)
+    except auth.HashingBusyError:
+        return _busy("login.html", request)
     request.session["user_id"] = user.id
     return RedirectResponse("/chat", status_code=302)
 
 
+def _busy(template: str, request: Request):
+    return templates.TemplateResponse(
+        template,
+        {"request": request, "error": "Too many sign-in attempts right now, please try again in a moment."},
+        status_code=503,
+        headers={"Retry-After": "5"},
+    )
+
+
+@router.get("/metrics")
+def get_metrics():
+    if not get_metrics_config()["enabled"]:
+        raise HTTPException(status_code=404)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 @router.get("/chat")
-def chat_form(request: Request, session: Session = Depends(db.get_session)):
+async def chat_form(request: Request, session: AsyncSession = Depends(db.get_async_session)):
     user_id = request.session.get("user_id")
     if not user_id:
         return RedirectResponse("/login", status_code=401)
-    user = queries.get_user_by_id(session, user_id)
-    chats = queries.get_chats_by_user(session, user_id)
+    async def load():
+        return await queries.aget_user_by_id(session, user_id), await queries.aget_chats_by_user(session, user_id)
+
+    # The Redis lookup runs while the database is queried
+    google_credentials, (user, chats) = await asyncio.gather(google_auth.ahas_credentials(user_id), load())
     return templates.TemplateResponse("chat.html", {
         "request": request,
         "user": user,
         "chats": chats,
         "selected_chat": None,
-        "google_credentials": bool(get_cached_gmail_token(user_id)),
+        "google_credentials": google_credentials,
     })
 
 
@@ -77,17 +111,22 @@ def new_chat(request: Request, session: Session = Depends(db.get_session)):
 
 
 @router.get("/chat/{chat_id}")
-def chat_page(request: Request, chat_id: str, session: Session = Depends(db.get_session)):
+async def chat_page(request: Request, chat_id: str, session: AsyncSession = Depends(db.get_async_session)):
     user_id = request.session.get("user_id")
     if not user_id:
         return RedirectResponse("/login", status_code=401)
 
-    user = queries.get_user_by_id(session, user_id)
-
-    chats = queries.get_chats_by_user(session, user_id)
-    selected_chat = queries.get_chat_by_id(session, chat_id)
+    async def load():
+        user = await queries.aget_user_by_id(session, user_id)
+        chats = await queries.aget_chats_by_user(session, user_id)
+        selected_chat = await queries.aget_chat_by_id(session, chat_id)
+        chat_messages, next_cursor = await queries.aget_messages_page(session, chat_id, limit=get_message_page_size())
+        return user, chats, selected_chat, chat_messages, next_cursor
 
-    chat_messages = queries.get_messages_by_chat_id(session, chat_id)
+    # The Redis lookup runs while the database is queried
+    google_credentials, (user, chats, selected_chat, chat_messages, next_cursor) = await asyncio.gather(
+        google_auth.ahas_credentials(user_id), load()
+    )
 
     return templates.TemplateResponse("chat.html", {
         "request": request,
@@ -95,72 +134,183 @@ def chat_page(request: Request, chat_id: str, session: Session = Depends(db.get_
         "chats": chats,
         "selected_chat": selected_chat,
         "messages": chat_messages,
-        "google_credentials": bool(get_cached_gmail_token(user_id)),
+        "next_cursor": next_cursor,
+        "chat_id": chat_id,
+        "google_credentials": google_credentials,
     })
 
 
-@router.post("/chat/{chat_id}/send")
-async def send_message(request: Request, chat_id: str, user_message: str = Form(...), tool_confirmation: str = Form(None), session: Session = Depends(db.get_session)):
+@router.get("/chat/{chat_id}/messages")
+def chat_history(request: Request, chat_id: str, before: str, session: Session = Depends(db.get_session)):
     user_id = request.session.get("user_id")
     if not user_id:
         return RedirectResponse("/login", status_code=401)
 
-    # Access the graph instance stored in app state
-    graph = request.app.state.graph
+    try:
+        chat_messages, next_cursor = queries.get_messages_page(session, chat_id, limit=get_message_page_size(), before=before)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid cursor")
 
-    # flow was interrupted by a sensitive tool
-    if tool_confirmation:
-        return _handle_tool_confirmation(request, chat_id, user_id, tool_confirmation, graph, session)
+    return templates.TemplateResponse("partials/message_history.html", {
+        "request": request,
+        "chat_id": chat_id,
+        "messages": chat_messages,
+        "next_cursor": next_cursor,
+    })
 
-    queries.create_message(session, chat_id=chat_id, role='user', content=user_message)
 
-    messages = graph_updates(graph, thread_id=chat_id, user_id=user_id, user_input=user_message)
+@router.post("/chat/{chat_id}/send")
+async def send_message(request: Request, chat_id: str, user_message: str = Form(...), tool_confirmation: str = Form(None), confirmation_id: int = Form(None)):
+    user_id = request.session.get("user_id")
+    if not user_id:
+        return RedirectResponse("/login", status_code=401)
 
-     # Check for sensitive tool interruption
-    snapshot = graph.get_state({"configurable": {"thread_id": chat_id}})
-    if snapshot.next and SENSITIVE_NODE in snapshot.next[0]:
-        confirmation_prompt = "This action requires permission to use a sensitive tool. Do you wish to proceed?"
-        message = queries.create_message(session, chat_id=chat_id, role='ai', content=confirmation_prompt)
+    # The turn runs as a background job, so slow tools don't hold the request open; the page polls for it
+    if tool_confirmation:
+        # flow was interrupted by a sensitive tool
+        if tool_confirmation not in turns.CONFIRMATION_REPLIES:
+            raise HTTPException(status_code=400, detail="invalid confirmation value")
+        payload = {"chat_id": chat_id, "confirmation": tool_confirmation, "confirmation_id": confirmation_id}
+        job_id = await jobs.aenqueue("confirmation", user_id, payload)
+    else:
+        try:
+            await admission.admit_message(user_id)
+        except admission.AdmissionRejected as e:
+            return templates.TemplateResponse(
+                "partials/message.html",
+                {"request": request, "ai_message": OVERLOADED_MESSAGE},
+                status_code=429,
+                headers=_retry_after(e),
+            )
+        job_id = await jobs.aenqueue("message", user_id, {"chat_id": chat_id, "user_message": user_message})
+
+    return templates.TemplateResponse("partials/job_pending.html", {
+        "request": request,
+        "job_id": job_id,
+        "confirmation_id": confirmation_id,
+        "confirmation_reply": turns.CONFIRMATION_REPLIES.get(tool_confirmation),
+    })
 
-        return templates.TemplateResponse("partials/confirmation_message.html", {
-            "request": request,
-            "chat_id": chat_id,
-            "message": message,
-        })
 
-    # Get assistant's reply (last message)
-    raw_reply = messages["messages"][-1].content
-    queries.create_message(session, chat_id=chat_id, role='ai', content=raw_reply)
-    html_reply = md.markdown(text=raw_reply).replace('\n', '')
+@router.get("/jobs/{job_id}")
+async def job_status(request: Request, job_id: str):
+    user_id = request.session.get("user_id")
+    if not user_id:
+        return RedirectResponse("/login", status_code=401)
 
+    job = await jobs.aget_job(job_id)
+    if not job or job["user_id"] != user_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    payload = job["payload"]
+    match job["status"]:
+        case jobs.DONE:
+            return _job_result(request, payload["chat_id"], job["result"])
+        case jobs.FAILED:
+            return templates.TemplateResponse("partials/job_failed.html", {
+                "request": request,
+                "chat_id": payload["chat_id"],
+                "ai_message": JOB_FAILED_MESSAGE,
+                "confirmation_id": payload.get("confirmation_id"),
+            })
+        case _:
+            return templates.TemplateResponse("partials/job_pending.html", {
+                "request": request,
+                "job_id": job_id,
+                "confirmation_id": payload.get("confirmation_id"),
+                "confirmation_reply": turns.CONFIRMATION_REPLIES.get(payload.get("confirmation")),
+            })
+
+def _job_result(request, chat_id, result):
+    message = {"id": result["message_id"], "content": result["content"]}
+    match result["type"]:
+        case "confirmation_request":
+            return templates.TemplateResponse("partials/confirmation_message.html", {
+                "request": request,
+                "chat_id": chat_id,
+                "message": message,
+            })
+        case "confirmation":
+            return templates.TemplateResponse("partials/confirmation_message_processed.html", {
+                "request": request,
+                "chat_id": chat_id,
+                "message": message,
+                "confirmation": result["confirmation"],
+            })
+    html_reply = md.markdown(text=result["content"]).replace('\n', '')
     return templates.TemplateResponse("partials/message.html", {
         "request": request,
-        "user_message": user_message,
         "ai_message": html_reply,
     })
 
-def _handle_tool_confirmation(request, chat_id, user_id, tool_confirmation, graph, session):
-    match tool_confirmation:
-        case "accepted":
-            # continue the graph execution
-            messages = graph_updates(graph, thread_id=chat_id, user_id=user_id)
-            content = "Confirmed ✅"
-        case "rejected":
-            messages = graph_reject_tool_call(graph, thread_id=chat_id)
-            content = "Rejected ❌"
-        case _:
-            raise HTTPException(status_code=400, detail="invalid confirmation value")
 
-    message = queries.create_message(session, chat_id=chat_id, role='user', content=content)
-    reply = messages["messages"][-1].content
-    message = queries.create_message(session, chat_id=chat_id, role='ai', content=reply)
+@router.post("/chat/{chat_id}/stream")
+async def stream_message(request: Request, chat_id: str, user_message: str = Form(...)):
+    user_id = request.session.get("user_id")
+    if not user_id:
+        return RedirectResponse("/login", status_code=401)
 
-    return templates.TemplateResponse("partials/confirmation_message_processed.html", {
+    graph = request.app.state.graph
+
+    def busy(message: str) -> str:
+        html = templates.get_template("partials/message.html").render({
+            "request": request,
+            "ai_message": message,
+        })
+        return _sse("done", html)
+
+    try:
+        await admission.admit_message(user_id)
+    except admission.AdmissionRejected as e:
+        return StreamingResponse(iter([busy(OVERLOADED_MESSAGE)]), status_code=429, headers=_retry_after(e), media_type="text/event-stream")
+
+    async def event_stream():
+        try:
+            async with locks.thread_lock(chat_id):
+                async for event in _stream_turn(request, chat_id, user_id, user_message, graph):
+                    yield event
+        except locks.ThreadBusyError:
+            yield busy(CHAT_BUSY_MESSAGE)
+        except admission.AdmissionRejected:
+            # An LLM call of the turn waited too long for a slot
+            yield busy(OVERLOADED_MESSAGE)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+async def _stream_turn(request, chat_id, user_id, user_message, graph):
+    async for kind, data in graph_stream(graph, thread_id=chat_id, user_id=user_id, user_input=user_message):
+        yield _sse(kind, data)
+
+    # Persist the turn only once the run has completed
+    snapshot = await graph.aget_state({"configurable": {"thread_id": chat_id}})
+    async with db.new_async_session() as session:
+        if snapshot.next and SENSITIVE_NODE in snapshot.next[0]:
+            _, message = await queries.acreate_messages(session, chat_id, [("user", user_message), ("ai", turns.CONFIRMATION_PROMPT)])
+            html = templates.get_template("partials/confirmation_message.html").render({
+                "request": request,
+                "chat_id": chat_id,
+                "message": message,
+            })
+            yield _sse("confirmation", html)
+            return
+
+        raw_reply = snapshot.values["messages"][-1].content
+        await queries.acreate_messages(session, chat_id, [("user", user_message), ("ai", raw_reply)])
+
+    html_reply = md.markdown(text=raw_reply).replace('\n', '')
+    html = templates.get_template("partials/message.html").render({
         "request": request,
-        "chat_id": chat_id,
-        "message": message,
-        "confirmation": tool_confirmation,
+        "ai_message": html_reply,
     })
+    yield _sse("done", html)
+
+def _retry_after(error: admission.AdmissionRejected) -> dict:
+    return {"Retry-After": str(max(1, math.ceil(error.retry_after)))}
+
+def _sse(event: str, data: str) -> str:
+    """Formats a server-sent event, splitting multi-line data into `data:` fields."""
+    lines = "\n".join(f"data: {line}" for line in data.split("\n"))
+    return f"event: {event}\n{lines}\n\n"
 
 
 @router.delete("/chat/{chat_id}")
@@ -177,6 +327,8 @@ def delete_chat(request: Request, chat_id: str, session: Session = Depends(db.ge
 
 @router.get("/auth/gmail")
 def auth_gmail(request: Request):
+    from google_auth_oauthlib.flow import Flow
+
     flow = Flow.from_client_config(get_google_client_config(), scopes=get_google_client_scopes())
     flow.redirect_uri = get_authorised_redirect_uris()[0]
 
@@ -200,6 +352,8 @@ def auth_callback(request: Request):
     state = request.query_params.get("state")
     code = request.query_params.get("code")
 
+    from google_auth_oauthlib.flow import Flow
+
     flow = Flow.from_client_config(get_google_client_config(), scopes=get_google_client_scopes())
     flow.redirect_uri = get_authorised_redirect_uris()[0]
     flow.fetch_token(code=code)
@@ -209,14 +363,7 @@ def auth_callback(request: Request):
     user_id = request.session.get("user_id")
     if not user_id:
         return RedirectResponse("/login", status_code=401)
-    cache_gmail_token(user_id, {
-        "token": credentials.token,
-        "refresh_token": credentials.refresh_token,
-        "token_uri": credentials.token_uri,
-        "client_id": credentials.client_id,
-        "client_secret": credentials.client_secret,
-        "scopes": credentials.scopes,
-    }, credentials.expiry)
+    google_auth.save_credentials(user_id, credentials)
 
     state_data = parse_qs(state)
     return_to = state_data.get("return_to", ["/"])[0]
@@ -19,3 +19,4 @@ def update_dialog_stack(left: list[str], right: Optional[str]) -> list[str]:
 class State(MessagesState):
     user_profile: UserProfile
     dialog_state: Annotated[list[str], update_dialog_stack]
+    summary: str
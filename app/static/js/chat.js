@@ -22,4 +22,60 @@ function clearChatThread(event) {
     if (chatName) {
         chatName.innerHTML = "";
     }
-}
\ No newline at end of file
+}
+
+function parseEvent(raw) {
+    let name = 'message';
+    const data = [];
+    for (const line of raw.split('\n')) {
+        if (line.startsWith('event: ')) name = line.slice(7);
+        else if (line.startsWith('data: ')) data.push(line.slice(6));
+    }
+    return {name, data: data.join('\n')};
+}
+
+async function streamMessage(event) {
+    event.preventDefault();
+    const chatId = event.target.getAttribute("data-chat-id");
+    const message = document.getElementById('chat-input').value.trim();
+    if (!message) return;
+    addUserMessage(event);
+
+    const chatThread = document.getElementById('chat-thread-'+chatId);
+    const pending = document.createElement('p');
+    pending.innerHTML = '<strong>AI:</strong> <span></span> <em></em>';
+    chatThread.appendChild(pending);
+    const tokens = pending.querySelector('span');
+    const progress = pending.querySelector('em');
+
+    const response = await fetch(`/chat/${chatId}/stream`, {
+        method: 'POST',
+        body: new URLSearchParams({user_message: message}),
+    });
+    const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+    let buffer = '';
+    while (true) {
+        const {value, done} = await reader.read();
+        if (done) break;
+        buffer += value;
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const {name, data} = parseEvent(buffer.slice(0, boundary));
+            buffer = buffer.slice(boundary + 2);
+            switch (name) {
+                case 'token':
+                    tokens.textContent += data;
+                    break;
+                case 'tool':
+                    progress.textContent = `(running ${data}...)`;
+                    break;
+                case 'done':
+                case 'confirmation':
+                    // Replace the live message with the rendered partial
+                    pending.remove();
+                    htmx.swap(chatThread, data, {swapStyle: 'beforeend'});
+                    break;
+            }
+        }
+    }
+}
@@ -0,0 +1,349 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Iterable
+
+import redis
+from langgraph.store.base import (
+    BaseStore,
+    GetOp,
+    Item,
+    ListNamespacesOp,
+    MatchCondition,
+    Op,
+    PutOp,
+    Result,
+    SearchItem,
+    SearchOp,
+)
+
+from app.caching import LRUCache
+from app.config import get_agent_connection_string, get_profile_cache_config, get_redis_config, get_store_config
+from app.database import db
+
+def _namespace_key(namespace: tuple[str, ...]) -> str:
+    return ".".join(namespace)
+
+def _timestamp(value: float) -> datetime:
+    return datetime.fromtimestamp(value, tz=timezone.utc)
+
+def _matches(namespace: tuple[str, ...], condition: MatchCondition) -> bool:
+    path = tuple(condition.path)
+    if len(namespace) < len(path):
+        return False
+    labels = namespace[:len(path)] if condition.match_type == "prefix" else namespace[-len(path):]
+    return all(expected == "*" or expected == label for expected, label in zip(path, labels))
+
+class PersistentStore(BaseStore):
+    """Long-term memory store shared across workers, with an in-process LRU tier.
+
+    Subclasses provide the shared backend through `_read`, `_write`, `_delete`,
+    `_scan` and `_namespaces`. Entries can expire per namespace: the first label of
+    the namespace is looked up in `namespace_ttls` (seconds).
+    """
+    supports_ttl = True
+
+    def __init__(self, local_cache_size: int, local_ttl: int, namespace_ttls: dict[str, int] | None = None):
+        self._local = LRUCache(maxsize=local_cache_size, ttl=local_ttl)
+        self.namespace_ttls = namespace_ttls or {}
+
+    def _read(self, namespace: tuple[str, ...], key: str) -> Item | None:
+        raise NotImplementedError
+
+    def _write(self, namespace: tuple[str, ...], key: str, value: dict, ttl: float | None) -> Item:
+        raise NotImplementedError
+
+    def _delete(self, namespace: tuple[str, ...], key: str) -> None:
+        raise NotImplementedError
+
+    def _scan(self, namespace_prefix: tuple[str, ...]) -> Iterable[Item]:
+        raise NotImplementedError
+
+    def _namespaces(self) -> Iterable[tuple[str, ...]]:
+        raise NotImplementedError
+
+    def _ttl_seconds(self, namespace: tuple[str, ...], ttl_minutes: float | None) -> float | None:
+        if ttl_minutes is not None:
+            return ttl_minutes * 60
+        return self.namespace_ttls.get(namespace[0]) if namespace else None
+
+    def _get(self, op: GetOp) -> Item | None:
+        cache_key = (op.namespace, op.key)
+        item = self._local.get(cache_key)
+        if item is None:
+            item = self._read(op.namespace, op.key)
+            if item is not None:
+                self._local.set(cache_key, item)
+        return item
+
+    def _put(self, op: PutOp) -> None:
+        cache_key = (op.namespace, op.key)
+        if op.value is None:
+            self._delete(op.namespace, op.key)
+            self._local.delete(cache_key)
+            return
+        ttl = self._ttl_seconds(op.namespace, op.ttl)
+        item = self._write(op.namespace, op.key, op.value, ttl)
+        self._local.set(cache_key, item, ttl=ttl)
+
+    def _search(self, op: SearchOp) -> list[SearchItem]:
+        # Semantic `query` search needs an embedding index, which this store does not keep
+        results = []
+        for item in self._scan(op.namespace_prefix):
+            if op.filter and any(item.value.get(k) != v for k, v in op.filter.items()):
+                continue
+            results.append(item)
+        results.sort(key=lambda item: item.updated_at, reverse=True)
+        return [
+            SearchItem(
+                namespace=item.namespace,
+                key=item.key,
+                value=item.value,
+                created_at=item.created_at,
+                updated_at=item.updated_at,
+            )
+            for item in results[op.offset:op.offset + op.limit]
+        ]
+
+    def _list_namespaces(self, op: ListNamespacesOp) -> list[tuple[str, ...]]:
+        namespaces = set()
+        for namespace in self._namespaces():
+            if op.match_conditions and not all(_matches(namespace, c) for c in op.match_conditions):
+                continue
+            namespaces.add(namespace[:op.max_depth] if op.max_depth else namespace)
+        return sorted(namespaces)[op.offset:op.offset + op.limit]
+
+    def batch(self, ops: Iterable[Op]) -> list[Result]:
+        results = []
+        for op in ops:
+            match op:
+                case GetOp():
+                    results.append(self._get(op))
+                case PutOp():
+                    results.append(self._put(op))
+                case SearchOp():
+                    results.append(self._search(op))
+                case ListNamespacesOp():
+                    results.append(self._list_namespaces(op))
+                case _:
+                    raise ValueError(f"unknown store operation: {op}")
+        return results
+
+    async def abatch(self, ops: Iterable[Op]) -> list[Result]:
+        return await asyncio.to_thread(self.batch, list(ops))
+
+class SqliteStore(PersistentStore):
+    """Store backed by a SQLite table, indexed by (namespace, key)."""
+    SWEEP_INTERVAL_SECONDS = 300
+
+    def __init__(self, conn: sqlite3.Connection, **kwargs):
+        super().__init__(**kwargs)
+        self.conn = conn
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        with self._lock, self.conn:
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS store (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    expires_at REAL,
+                    PRIMARY KEY (namespace, key)
+                )
+                """
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_store_expires_at ON store(expires_at)")
+
+    def _item(self, row) -> Item:
+        namespace, key, value, created_at, updated_at = row
+        return Item(
+            namespace=tuple(namespace.split(".")),
+            key=key,
+            value=json.loads(value),
+            created_at=_timestamp(created_at),
+            updated_at=_timestamp(updated_at),
+        )
+
+    def _read(self, namespace, key):
+        with self._lock:
+            row = self.conn.execute(
+                """
+                SELECT namespace, key, value, created_at, updated_at FROM store
+                WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)
+                """,
+                (_namespace_key(namespace), key, time.time()),
+            ).fetchone()
+        return self._item(row) if row else None
+
+    def _write(self, namespace, key, value, ttl):
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        with self._lock, self.conn:
+            row = self.conn.execute(
+                """
+                INSERT INTO store (namespace, key, value, created_at, updated_at, expires_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (namespace, key) DO UPDATE SET
+                    value = excluded.value,
+                    updated_at = excluded.updated_at,
+                    expires_at = excluded.expires_at
+                RETURNING namespace, key, value, created_at, updated_at
+                """,
+                (_namespace_key(namespace), key, json.dumps(value), now, now, expires_at),
+            ).fetchone()
+            if now - self._last_sweep > self.SWEEP_INTERVAL_SECONDS:
+                self.conn.execute("DELETE FROM store WHERE expires_at <= ?", (now,))
+                self._last_sweep = now
+        return self._item(row)
+
+    def _delete(self, namespace, key):
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM store WHERE namespace = ? AND key = ?", (_namespace_key(namespace), key))
+
+    def _scan(self, namespace_prefix):
+        prefix = _namespace_key(namespace_prefix)
+        with self._lock:
+            rows = self.conn.execute(
+                """
+                SELECT namespace, key, value, created_at, updated_at FROM store
+                WHERE (namespace = ? OR namespace >= ? AND namespace < ?)
+                  AND (expires_at IS NULL OR expires_at > ?)
+                """,
+                # "." + 1 == "/", so this is a range scan over the primary key
+                (prefix, prefix + ".", prefix + "/", time.time()),
+            ).fetchall()
+        return [self._item(row) for row in rows]
+
+    def _namespaces(self):
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT DISTINCT namespace FROM store WHERE expires_at IS NULL OR expires_at > ?",
+                (time.time(),),
+            ).fetchall()
+        return [tuple(row[0].split(".")) for row in rows]
+
+class RedisStore(PersistentStore):
+    """Store backed by Redis, for deployments spanning several hosts.
+
+    Each item is a JSON string with native key expiry. A set per namespace indexes
+    its keys, and a global set indexes the namespaces.
+    """
+    def __init__(self, client: redis.Redis, **kwargs):
+        super().__init__(**kwargs)
+        self.client = client
+
+    def _item_key(self, namespace, key) -> str:
+        return f"store:item:{_namespace_key(namespace)}:{key}"
+
+    def _item(self, namespace, key, raw) -> Item:
+        data = json.loads(raw)
+        return Item(
+            namespace=namespace,
+            key=key,
+            value=data["value"],
+            created_at=_timestamp(data["created_at"]),
+            updated_at=_timestamp(data["updated_at"]),
+        )
+
+    def _read(self, namespace, key):
+        raw = self.client.get(self._item_key(namespace, key))
+        return self._item(namespace, key, raw) if raw else None
+
+    def _write(self, namespace, key, value, ttl):
+        now = time.time()
+        existing = self.client.get(self._item_key(namespace, key))
+        created_at = json.loads(existing)["created_at"] if existing else now
+        raw = json.dumps({"value": value, "created_at": created_at, "updated_at": now})
+
+        pipe = self.client.pipeline()
+        pipe.set(self._item_key(namespace, key), raw, ex=int(ttl) if ttl else None)
+        pipe.sadd(f"store:keys:{_namespace_key(namespace)}", key)
+        pipe.sadd("store:namespaces", _namespace_key(namespace))
+        pipe.execute()
+        return self._item(namespace, key, raw)
+
+    def _delete(self, namespace, key):
+        pipe = self.client.pipeline()
+        pipe.delete(self._item_key(namespace, key))
+        pipe.srem(f"store:keys:{_namespace_key(namespace)}", key)
+        pipe.execute()
+
+    def _scan(self, namespace_prefix):
+        items = []
+        for namespace in self._namespaces():
+            if namespace[:len(namespace_prefix)] != tuple(namespace_prefix):
+                continue
+            keys = [k.decode() for k in self.client.smembers(f"store:keys:{_namespace_key(namespace)}")]
+            if not keys:
+                continue
+            raws = self.client.mget([self._item_key(namespace, key) for key in keys])
+            expired = [key for key, raw in zip(keys, raws) if raw is None]
+            if expired:
+                self.client.srem(f"store:keys:{_namespace_key(namespace)}", *expired)
+            items.extend(self._item(namespace, key, raw) for key, raw in zip(keys, raws) if raw)
+        return items
+
+    def _namespaces(self):
+        return [tuple(ns.decode().split(".")) for ns in self.client.smembers("store:namespaces")]
+
+def create_store() -> PersistentStore:
+    cfg = get_store_config()
+    kwargs = {
+        "local_cache_size": cfg["local_cache_size"],
+        "local_ttl": cfg["local_ttl"],
+        "namespace_ttls": cfg["namespace_ttls"],
+    }
+    if cfg["backend"] == "redis":
+        redis_cfg = get_redis_config()
+        client = redis.Redis.from_url(
+            cfg["redis_url"],
+            socket_timeout=redis_cfg["socket_timeout"],
+            socket_connect_timeout=redis_cfg["connect_timeout"],
+        )
+        return RedisStore(client, **kwargs)
+    conn = db.connect_checkpoint_db(cfg["db_name"] or get_agent_connection_string())
+    return SqliteStore(conn, **kwargs)
+
+@lru_cache(maxsize=1)
+def get_store() -> PersistentStore:
+    """The process-wide store, shared by the graph and the user profile cache."""
+    return create_store()
+
+# User profiles: kept in the store, so all workers share them behind its local tier
+
+PROFILE_NAMESPACE = ("user_profile",)
+# A store that can't be reached is skipped, and the profile is read from the database
+STORE_ERRORS = (redis.RedisError, sqlite3.Error)
+
+_profile_cfg = get_profile_cache_config()
+
+def cache_user_profile(user_id: str, profile: dict):
+    try:
+        get_store().put(PROFILE_NAMESPACE, user_id, profile, ttl=_profile_cfg["ttl"] / 60)
+    except STORE_ERRORS:
+        pass
+
+def get_cached_user_profile(user_id: str) -> dict | None:
+    try:
+        item = get_store().get(PROFILE_NAMESPACE, user_id)
+    except STORE_ERRORS:
+        return None
+    return item.value if item else None
+
+async def ainvalidate_user_profile(user_id: str):
+    """Drops a user's cached profile; call whenever the user row changes.
+
+    Threads re-read the profile on their next turn. Other workers' local copies
+    expire after STORE_LOCAL_TTL.
+    """
+    try:
+        await get_store().adelete(PROFILE_NAMESPACE, user_id)
+    except STORE_ERRORS:
+        pass
@@ -5,6 +5,8 @@ from .routing_tools import *
 
 from . import tools_registry
 
+tools_registry.load_plugins()
+
 __all__ = (
     user_management_tools.__all__ +
     order_management_tools.__all__ +
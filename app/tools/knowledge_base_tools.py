@@ -1,11 +1,17 @@
+from app.config import get_knowledge_base_config
+from app.knowledge_base import get_index
 from .tools_registry import tagged_tool
 
 @tagged_tool("knowledge_base", "safe")
 def faq_lookup(query: str) -> str:
     """Search internal FAQ knowledge base."""
-    # TODO: search index / db
-    faq = """We understand that there are occasions when orders will need to be canceled. 
-Once an order has been placed, buyers have the option to request an order cancellation up until the order has shipped."""
+    index = get_index()
+    if index is None:
+        return "The FAQ knowledge base is not available."
+    results = index.search(query, k=get_knowledge_base_config()["top_k"])
+    if not results:
+        return f"No FAQ results for '{query}'."
+    faq = "\n\n".join(result["text"] for result in results)
     return f"FAQ result for '{query}': {faq}"
 
 
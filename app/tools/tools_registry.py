@@ -1,26 +1,80 @@
-from langchain_core.tools import tool as base_tool
+import importlib
+import os
+import threading
 
-import inspect
+from langchain_core.tools import BaseTool, tool as base_tool
 
-import app.tools as tools
+class ToolRegistry:
+    """Tools indexed by tag, filled once as tools are registered.
+
+    Lookups by tag set are memoized as tuples and frozensets of names, so routing
+    can check "is this call sensitive for assistant X" with a set membership test.
+    """
+    def __init__(self):
+        self._tools: dict[str, BaseTool] = {}
+        self._tags: dict[str, frozenset[str]] = {}
+        self._by_tags: dict[frozenset[str], tuple[BaseTool, ...]] = {}
+        self._names_by_tags: dict[frozenset[str], frozenset[str]] = {}
+        self._lock = threading.Lock()
+
+    def register(self, tool: BaseTool, *tags: str) -> BaseTool:
+        with self._lock:
+            existing = self._tools.get(tool.name)
+            if existing is not None and existing is not tool:
+                raise ValueError(f"a tool named {tool.name!r} is already registered")
+            self._tools[tool.name] = tool
+            self._tags[tool.name] = frozenset(tags)
+            # Registration happens at import time, so the memoized lookups are simply rebuilt
+            self._by_tags = {}
+            self._names_by_tags = {}
+        return tool
+
+    def get_all_tools(self) -> list[BaseTool]:
+        return list(self._tools.values())
+
+    def get_tools_by_tags(self, *tags: str) -> tuple[BaseTool, ...]:
+        key = frozenset(tags)
+        found = self._by_tags.get(key)
+        if found is None:
+            found = tuple(tool for name, tool in self._tools.items() if key <= self._tags[name])
+            self._by_tags[key] = found
+        return found
+
+    def get_tool_names_by_tags(self, *tags: str) -> frozenset[str]:
+        key = frozenset(tags)
+        names = self._names_by_tags.get(key)
+        if names is None:
+            names = frozenset(tool.name for tool in self.get_tools_by_tags(*tags))
+            self._names_by_tags[key] = names
+        return names
+
+registry = ToolRegistry()
 
 def tagged_tool(*tags):
     def tool_decorator(fn):
         wrapped = base_tool(fn)
         wrapped.tags = list(tags)
-        return wrapped
+        return registry.register(wrapped, *tags)
     return tool_decorator
 
+def register_tool(tool: BaseTool, *tags: str) -> BaseTool:
+    """Registers a tool built elsewhere, e.g. by a plugin, under `tags`."""
+    tool.tags = list(tags)
+    return registry.register(tool, *tags)
+
+def load_plugins():
+    """Imports the modules listed in TOOL_PLUGINS, which register their tools on import."""
+    for module in filter(None, os.environ.get("TOOL_PLUGINS", "").split(",")):
+        importlib.import_module(module.strip())
+
 def get_all_tools():
-    # Get all functions that are tools (langchain_core.tools.Tool instances)
-    all_tools  = [
-        tool_fn for name, tool_fn in inspect.getmembers(tools)
-        if hasattr(tool_fn, "tags")
-    ]
-    return all_tools
+    return registry.get_all_tools()
 
 def get_tools_by_tag(tag: str):
-    return [tool_fn for tool_fn in get_all_tools() if tag in tool_fn.tags]
+    return list(registry.get_tools_by_tags(tag))
 
 def get_tools_by_tags(*tags):
-    return [tool_fn for tool_fn in get_all_tools() if all(tag in tool_fn.tags for tag in tags)]
\ No newline at end of file
+    return list(registry.get_tools_by_tags(*tags))
+
+def get_tool_names_by_tags(*tags) -> frozenset[str]:
+    return registry.get_tool_names_by_tags(*tags)
@@ -1,94 +1,51 @@
-import base64
-
 from langchain_core.runnables import RunnableConfig
-from langgraph.config import get_store
-
-from googleapiclient.discovery import build
-from google.oauth2.credentials import Credentials
 
+from app import google_auth
 from app.database import db, queries
-from app.caching import get_cached_gmail_token
+from app.store import get_cached_user_profile, cache_user_profile
 from .tools_registry import tagged_tool
 from app.state import UserProfile
 
 @tagged_tool("user_management", "safe")
 def get_user_info(config: RunnableConfig) -> list[dict]:
     """Fetch user information."""
+    user_id = config.get("configurable").get("user_id")
+    if not user_id:
+        raise ValueError("failed to retrieve user_id from configuration")
+
+    user_profile = get_cached_user_profile(user_id)
+    if user_profile:
+        return {"user_profile": user_profile}
 
     session = next(db.get_session())
     try:
-        user_id = config.get("configurable").get("user_id")
-        if not user_id:
-            return ValueError("failed to retrieve user_id from configuration")
-
-        # Retrieve existing memory from the store
-        namespace = ("user_profile", user_id)
-        store = get_store()
-        existing_memory = store.get(namespace, "user_memory")
-        # Extract the memory
-        if existing_memory:
-            existing_memory.value.get("user_profile")
-            user_profile = existing_memory.dict()["value"]
-            return user_profile
-        else:
-            user = queries.get_user_by_id(session, user_id)
-            user_profile: UserProfile = {
-                "user_id": user_id,
-                "name": user.name,
-                "email": user.email,
-            }
-            # Write value as a dictionary with a memory key
-            store.put(namespace, "user_memory", {"user_profile": user_profile})
-            return {"user_profile": user_profile}
+        user = queries.get_user_by_id(session, user_id)
     finally:
         session.close()
+    # A deleted user's profile is never cached, so a stale one can't outlive the account
+    if user is None:
+        raise ValueError(f"no user with id {user_id}")
+    user_profile: UserProfile = {
+        "user_id": user_id,
+        "name": user.name,
+        "email": user.email,
+    }
+    cache_user_profile(user_id, user_profile)
+    return {"user_profile": user_profile}
 
 
 @tagged_tool("user_management", "safe")
-def get_recent_emails(user_id: str):
-    """Look up the user's most recent emails."""
-    user_credentials = get_cached_gmail_token(user_id)
-    creds = Credentials.from_authorized_user_info(user_credentials)
-    service = build("gmail", "v1", credentials=creds)
-    results = service.users().messages().list(userId="me", maxResults=5).execute()
-    messages = results.get("messages", [])
-
-    emails = []
-    for msg in messages:
-        full = service.users().messages().get(userId="me", id=msg["id"]).execute()
-        snippet = full.get("snippet", "")
-        subject = next(
-            (h["value"] for h in full["payload"]["headers"] if h["name"].lower() == "subject"),
-            None
-        )
-        sender = next(
-            (h["value"] for h in full["payload"]["headers"] if h["name"].lower() == "from"),
-            None
-        )
-
-        body_data = extract_body(full["payload"])
-
-        emails.append({
-            "id": msg["id"],
-            "snippet": snippet,
-            "sender": sender,
-            "subject": subject,
-            "body": body_data,
-        })
-    return emails
-
-# Helper Functions
-
-def extract_body(payload):
-    if "parts" in payload:
-        for part in payload["parts"]:
-            if part.get("mimeType") in ["text/plain", "text/html"]:
-                data = part["body"].get("data")
-                if data:
-                    return base64.urlsafe_b64decode(data).decode("utf-8")
-            # Recursively check nested parts
-            if "parts" in part:
-                return extract_body(part)
-    return None
+def get_recent_emails(user_id: str, include_body: bool = False):
+    """Look up the user's most recent emails.
+
+    Set include_body only when the email contents are needed; sender, subject and snippet are always included.
+    """
+    # The Google API client is slow to import and only needed here
+    from app import gmail
+
+    credentials = google_auth.get_credentials(user_id)
+    if credentials is None:
+        return "The user has not connected a Gmail account. Ask them to connect it from the chat page first."
+    return gmail.get_recent_messages(user_id, credentials, max_results=5, include_body=include_body)
 
 __all__ = ["get_user_info", "get_recent_emails"]
\ No newline at end of file
@@ -0,0 +1,65 @@
+from app.database import db, queries
+from app.graph import graph_updates, graph_reject_tool_call, SENSITIVE_NODE
+from app import locks
+
+CONFIRMATION_PROMPT = "This action requires permission to use a sensitive tool. Do you wish to proceed?"
+CONFIRMATION_REPLIES = {"accepted": "Confirmed ✅", "rejected": "Rejected ❌"}
+
+def _interrupted(snapshot) -> bool:
+    return bool(snapshot.next) and SENSITIVE_NODE in snapshot.next[0]
+
+async def run_message(graph, chat_id: str, user_id: str, user_message: str, turn_id: str) -> dict:
+    """Runs one user turn and stores it in the chat.
+
+    The user's message is added to the thread with id `turn_id`, so a retried turn
+    resumes from its last checkpoint instead of adding the message twice. A retry of
+    a turn that already stopped for confirmation only stores it.
+    """
+    config = {"configurable": {"thread_id": chat_id}}
+    async with locks.thread_lock(chat_id):
+        snapshot = await graph.aget_state(config)
+        if not any(message.id == turn_id for message in snapshot.values.get("messages", [])):
+            await graph_updates(graph, thread_id=chat_id, user_id=user_id, user_input=user_message, message_id=turn_id)
+        elif not _interrupted(snapshot):
+            # Resuming an interrupted thread would run the sensitive tool unconfirmed
+            await graph_updates(graph, thread_id=chat_id, user_id=user_id)
+
+        snapshot = await graph.aget_state(config)
+        async with db.new_async_session() as session:
+            if _interrupted(snapshot):
+                _, message = await queries.acreate_messages(session, chat_id, [("user", user_message), ("ai", CONFIRMATION_PROMPT)])
+                return {"type": "confirmation_request", "message_id": message.id, "content": message.content}
+            reply = snapshot.values["messages"][-1].content
+            _, message = await queries.acreate_messages(session, chat_id, [("user", user_message), ("ai", reply)])
+    return {"type": "message", "message_id": message.id, "content": reply}
+
+async def run_confirmation(graph, chat_id: str, user_id: str, confirmation: str) -> dict:
+    """Resumes a thread interrupted before a sensitive tool, running or rejecting its calls.
+
+    A retry after the continuation failed part-way resumes from the last checkpoint.
+    """
+    config = {"configurable": {"thread_id": chat_id}}
+    async with locks.thread_lock(chat_id):
+        snapshot = await graph.aget_state(config)
+        if _interrupted(snapshot) and confirmation == "rejected":
+            await graph_reject_tool_call(graph, thread_id=chat_id, user_id=user_id)
+        elif snapshot.next:
+            await graph_updates(graph, thread_id=chat_id, user_id=user_id)
+
+        snapshot = await graph.aget_state(config)
+        reply = snapshot.values["messages"][-1].content
+        async with db.new_async_session() as session:
+            _, message = await queries.acreate_messages(session, chat_id, [("user", CONFIRMATION_REPLIES[confirmation]), ("ai", reply)])
+    return {"type": "confirmation", "message_id": message.id, "content": reply, "confirmation": confirmation}
+
+def create_job_handlers(graph) -> dict:
+    """Job handlers for `app.jobs.run_workers`, running turns of `graph`."""
+    async def message(job: dict) -> dict:
+        payload = job["payload"]
+        return await run_message(graph, payload["chat_id"], job["user_id"], payload["user_message"], turn_id=job["id"])
+
+    async def confirmation(job: dict) -> dict:
+        payload = job["payload"]
+        return await run_confirmation(graph, payload["chat_id"], job["user_id"], payload["confirmation"])
+
+    return {"message": message, "confirmation": confirmation}
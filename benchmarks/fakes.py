@@ -0,0 +1,222 @@
+import asyncio
+import base64
+import json
+import re
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+FALLBACK_REPLY = "Is there anything else I can help you with?"
+
+def _token_count(text: str) -> int:
+    return max(1, len(text) // 4)
+
+class Script:
+    """The recorded LLM responses of one conversation turn, replayed in order.
+
+    A response with a `node` is only given to an LLM call made by that graph node,
+    so calls the current graph skips (e.g. a supervisor call replaced by the
+    pre-router) leave their response unused instead of shifting the rest.
+    """
+    def __init__(self, responses: list[dict], context: dict):
+        self.responses = deque(responses)
+        self.context = context
+        self.calls = 0
+        self.misses = 0
+
+    def next_message(self, node: str) -> AIMessage:
+        self.calls += 1
+        for response in self.responses:
+            if response.get("node") in (None, node):
+                self.responses.remove(response)
+                return self._message(response)
+        self.misses += 1
+        return AIMessage(content=FALLBACK_REPLY)
+
+    def _message(self, response: dict) -> AIMessage:
+        tool_calls = [
+            {
+                "name": call["name"],
+                "args": {k: v.format(**self.context) if isinstance(v, str) else v for k, v in call.get("args", {}).items()},
+                "id": f"call_{uuid.uuid4().hex[:24]}",
+            }
+            for call in response.get("tool_calls", [])
+        ]
+        return AIMessage(content=response.get("content", ""), tool_calls=tool_calls)
+
+    @property
+    def unused(self) -> int:
+        return len(self.responses)
+
+class ScriptedChatModel(BaseChatModel):
+    """Chat model replaying scripted responses, looked up by the run's thread_id.
+
+    `latency` seconds are slept per call to stand in for the provider round trip.
+    Token usage is estimated from the message lengths so token metrics stay populated.
+    """
+    latency: float = 0.0
+    scripts: dict = {}
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _respond(self, messages, run_manager) -> ChatResult:
+        metadata = (run_manager.metadata if run_manager else None) or {}
+        script = self.scripts.get(metadata.get("thread_id"))
+        node = metadata.get("langgraph_node", "")
+        message = script.next_message(node) if script else AIMessage(content=FALLBACK_REPLY)
+        prompt_tokens = sum(_token_count(str(m.content)) for m in messages)
+        completion_tokens = _token_count(message.content or json.dumps(message.tool_calls))
+        message.usage_metadata = {
+            "input_tokens": prompt_tokens,
+            "output_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._respond(messages, run_manager)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._respond(messages, run_manager)
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_redis() -> str:
+    """Starts an in-process Redis stand-in and returns its URL.
+
+    Needs fakeredis (see benchmarks/requirements.txt); pass --redis-url to use a real server instead.
+    """
+    try:
+        from fakeredis import TcpFakeServer
+    except ImportError:
+        raise SystemExit("fakeredis is not installed: pip install -r benchmarks/requirements.txt, or pass --redis-url")
+    port = free_port()
+    server = TcpFakeServer(("127.0.0.1", port), server_type="redis")
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"redis://127.0.0.1:{port}/0"
+
+def _mailbox(size: int) -> dict[str, dict]:
+    messages = {}
+    for i in range(size):
+        body = base64.urlsafe_b64encode(f"Hello, this is benchmark email number {i}.".encode()).decode()
+        messages[f"msg{i:04d}"] = {
+            "id": f"msg{i:04d}",
+            "threadId": f"thread{i:04d}",
+            "historyId": str(1000 + i),
+            "internalDate": str(1_700_000_000_000 + i * 60_000),
+            "snippet": f"Benchmark email number {i}",
+            "payload": {
+                "mimeType": "text/plain",
+                "headers": [
+                    {"name": "From", "value": f"sender{i}@example.com"},
+                    {"name": "Subject", "value": f"Benchmark subject {i}"},
+                    {"name": "Date", "value": "Tue, 14 Nov 2023 22:13:20 +0000"},
+                ],
+                "body": {"data": body},
+            },
+        }
+    return messages
+
+class GmailStandIn:
+    """A local HTTP server answering the Gmail API calls made by app.gmail.
+
+    Every user sees the same static mailbox, so incremental syncs find no changes.
+    Point the app at it with GMAIL_API_ROOT_URL=`url`.
+    """
+    def __init__(self, mailbox_size: int = 20):
+        self.messages = _mailbox(mailbox_size)
+        self.history_id = str(1000 + mailbox_size)
+        self.requests = 0
+        self._server = ThreadingHTTPServer(("127.0.0.1", free_port()), self._handler())
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}/"
+
+    def start(self) -> "GmailStandIn":
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+
+    def handle(self, path: str) -> tuple[int, dict]:
+        url = urlparse(path)
+        query = parse_qs(url.query)
+        if url.path.endswith("/messages"):
+            newest = sorted(self.messages, key=lambda i: -int(self.messages[i]["internalDate"]))
+            limit = int(query.get("maxResults", ["100"])[0])
+            return 200, {"messages": [{"id": i, "threadId": self.messages[i]["threadId"]} for i in newest[:limit]]}
+        match = re.search(r"/messages/(\w+)$", url.path)
+        if match:
+            message = self.messages.get(match.group(1))
+            if message is None:
+                return 404, {"error": {"code": 404, "message": "Requested entity was not found."}}
+            return 200, message
+        if url.path.endswith("/history"):
+            return 200, {"history": [], "historyId": self.history_id}
+        if url.path.endswith("/profile"):
+            return 200, {"emailAddress": "me@example.com", "historyId": self.history_id}
+        return 404, {"error": {"code": 404, "message": "Not found."}}
+
+    def handle_batch(self, body: str, content_type: str) -> bytes:
+        boundary = re.search(r'boundary="?([^";]+)', content_type).group(1)
+        parts = []
+        for part in body.split(f"--{boundary}")[1:-1]:
+            content_id = re.search(r"Content-ID: <(.+?)>", part).group(1)
+            path = re.search(r"GET (\S+) HTTP", part).group(1)
+            status, payload = self.handle(path)
+            parts.append(
+                "--batch_response\r\n"
+                "Content-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} OK\r\n"
+                "Content-Type: application/json; charset=UTF-8\r\n\r\n"
+                f"{json.dumps(payload)}\r\n"
+            )
+        return ("".join(parts) + "--batch_response--\r\n").encode()
+
+    def _handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status: int, body: bytes, content_type: str):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                stand_in.requests += 1
+                status, payload = stand_in.handle(self.path)
+                self._reply(status, json.dumps(payload).encode(), "application/json; charset=UTF-8")
+
+            def do_POST(self):
+                stand_in.requests += 1
+                body = self.rfile.read(int(self.headers["Content-Length"])).decode()
+                self._reply(200, stand_in.handle_batch(body, self.headers["Content-Type"]), "multipart/mixed; boundary=batch_response")
+
+        return Handler
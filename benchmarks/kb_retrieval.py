@@ -0,0 +1,100 @@
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from benchmarks.replay import peak_rss_bytes, summarize
+
+GENERATE_BATCH = 10_000
+
+def word_weights(vocabulary: int) -> np.ndarray:
+    """Zipf frequencies, so a few terms have very long postings like in real text."""
+    weights = 1 / np.arange(1, vocabulary + 1)
+    return weights / weights.sum()
+
+def synthetic_chunks(count: int, words: int, vocabulary: int, seed: int) -> list[dict]:
+    rng = np.random.default_rng(seed)
+    weights = word_weights(vocabulary)
+    chunks = []
+    for start in range(0, count, GENERATE_BATCH):
+        ids = rng.choice(vocabulary, size=(min(GENERATE_BATCH, count - start), words), p=weights)
+        chunks += [{"text": " ".join(f"w{i}" for i in row), "source": f"doc{(start + n) // 100}.md"} for n, row in enumerate(ids)]
+    return chunks
+
+def synthetic_queries(count: int, vocabulary: int, seed: int) -> list[str]:
+    rng = np.random.default_rng(seed + 1)
+    weights = word_weights(vocabulary)
+    return [" ".join(f"w{i}" for i in rng.choice(vocabulary, size=rng.integers(3, 7), p=weights)) for _ in range(count)]
+
+def index_bytes(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.resolve().iterdir())
+
+def run_size(size: int, args, workdir: Path) -> dict:
+    from app.knowledge_base import KnowledgeBaseIndex
+
+    chunks = synthetic_chunks(size, args.chunk_words, args.vocabulary, args.seed)
+    path = workdir / f"kb-{size}"
+    start = time.perf_counter()
+    KnowledgeBaseIndex.build(chunks, path, embedding_dim=args.dense)
+    build_seconds = time.perf_counter() - start
+    del chunks
+
+    start = time.perf_counter()
+    index = KnowledgeBaseIndex(path)
+    open_seconds = time.perf_counter() - start
+    queries = synthetic_queries(args.queries + 1, args.vocabulary, args.seed)
+    # The first search also computes the length norms, so it is reported on its own
+    start = time.perf_counter()
+    index.search(queries[0], k=args.k, dense=bool(args.dense))
+    first_query_seconds = time.perf_counter() - start
+
+    latencies = []
+    for query in queries[1:]:
+        start = time.perf_counter()
+        index.search(query, k=args.k, dense=bool(args.dense))
+        latencies.append(time.perf_counter() - start)
+    return {
+        "chunks": size,
+        "build_seconds": round(build_seconds, 3),
+        "index_bytes": index_bytes(path),
+        "open_seconds": round(open_seconds, 6),
+        "first_query_seconds": round(first_query_seconds, 6),
+        "query_latency": summarize(latencies),
+        "peak_rss_bytes": peak_rss_bytes(),
+    }
+
+def run_benchmark(args) -> dict:
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="kb-retrieval-"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    return {
+        "chunk_words": args.chunk_words,
+        "vocabulary": args.vocabulary,
+        "dense_dim": args.dense,
+        "k": args.k,
+        "sizes": {str(size): run_size(size, args, workdir) for size in args.sizes},
+    }
+
+# Usage: python -m benchmarks.kb_retrieval [--sizes 10000 100000 1000000] [--queries 200] [--dense 256] [--output kb.json]
+def main():
+    parser = argparse.ArgumentParser(description="Build knowledge base indexes of growing size and report build cost and search latency.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000], help="chunks per index")
+    parser.add_argument("--chunk-words", type=int, default=50, help="words per synthetic chunk")
+    parser.add_argument("--vocabulary", type=int, default=50_000, help="distinct words, drawn with Zipf frequencies")
+    parser.add_argument("--queries", type=int, default=200, help="searches timed per index")
+    parser.add_argument("--k", type=int, default=3, help="chunks returned per search")
+    parser.add_argument("--dense", type=int, default=0, metavar="DIM", help="also store DIM-dimensional vectors and fuse them in")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic chunks and queries")
+    parser.add_argument("--workdir", help="directory for the indexes (default: a new temporary directory)")
+    parser.add_argument("--output", help="also write the report to this file")
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.fakes import GmailStandIn, ScriptedChatModel, start_redis
+from benchmarks.replay import (
+    GraphTarget,
+    build_faq_index,
+    configure_environment,
+    create_schema,
+    load_corpus,
+    replay_session,
+    seed_sessions,
+    summarize,
+)
+
+MODES = ("blocking", "async")
+PROBE_INTERVAL = 0.01
+
+class BlockingTarget(GraphTarget):
+    """Runs turns with the synchronous graph API on the event loop, as the routes did before they went async.
+
+    Rejected confirmations still go through `graph_reject_tool_call`; they are a small
+    share of the corpus's turns.
+    """
+    @staticmethod
+    def _config(session: dict) -> dict:
+        return {"configurable": {"thread_id": session["chat_id"], "user_id": session["user_id"]}}
+
+    async def send(self, session: dict, text: str):
+        from langchain_core.messages import HumanMessage
+        self.graph.invoke({"messages": [HumanMessage(content=text)]}, self._config(session))
+
+    async def confirm(self, session: dict, confirmation: str):
+        if confirmation == "accepted":
+            self.graph.invoke(None, self._config(session))
+        else:
+            await super().confirm(session, confirmation)
+
+async def probe_loop_lag(lags: list[float], stop: asyncio.Event):
+    """Records how late a `PROBE_INTERVAL` sleep wakes up, i.e. how long the loop was blocked."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append(max(0.0, time.perf_counter() - start - PROBE_INTERVAL))
+
+async def run_mode(target, llm: ScriptedChatModel, sessions: list[dict]) -> dict:
+    stats = {"errors": 0, "turn_seconds": [], "llm_calls": 0, "unscripted_llm_calls": 0, "unused_responses": 0}
+    lags, stop = [], asyncio.Event()
+    probe = asyncio.create_task(probe_loop_lag(lags, stop))
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(replay_session(target, llm, session, stats) for session in sessions))
+    finally:
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await probe
+
+    turns = len(stats["turn_seconds"])
+    return {
+        "turns": turns,
+        "errors": stats["errors"],
+        "seconds": round(elapsed, 3),
+        "throughput_turns_per_second": round(turns / elapsed, 3) if elapsed else 0.0,
+        "turn_latency": summarize(stats["turn_seconds"]),
+        "loop_lag": summarize(lags),
+    }
+
+async def run_benchmark(args) -> dict:
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="load-"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    gmail = GmailStandIn().start()
+    # The Redis checkpointer has both the sync and the async API, so both modes use it
+    configure_environment(workdir, args.redis_url or start_redis(), gmail.url, "redis")
+    create_schema(os.environ["SQLITE_DB_NAME"])
+
+    llm = ScriptedChatModel(latency=args.llm_latency)
+    from app import config
+    config._init_llm = lambda llm_name, llm_provider: llm
+
+    from app.checkpointer import create_checkpointer
+    from app.graph import build_graph
+
+    build_faq_index()
+    corpus = load_corpus(args.corpus)
+    conversations = [{**corpus[i % len(corpus)], "id": f"{corpus[i % len(corpus)]['id']}-{i}"} for i in range(args.chats)]
+    # Every mode replays the same conversations in chats of its own, so none starts from another's history
+    sessions = seed_sessions(conversations, len(args.modes))
+    graph = build_graph(checkpointer=create_checkpointer())
+
+    modes = {}
+    try:
+        for i, mode in enumerate(args.modes):
+            target = BlockingTarget(graph) if mode == "blocking" else GraphTarget(graph)
+            modes[mode] = await run_mode(target, llm, sessions[i * args.chats:(i + 1) * args.chats])
+    finally:
+        gmail.stop()
+
+    report = {"chats": args.chats, "llm_latency": args.llm_latency, "modes": modes}
+    if set(MODES) <= modes.keys() and modes["async"]["turn_latency"]["p99"]:
+        report["p99_speedup"] = round(modes["blocking"]["turn_latency"]["p99"] / modes["async"]["turn_latency"]["p99"], 2)
+    return report
+
+# Usage: python -m benchmarks.load benchmarks/corpus.jsonl [--chats 32] [--llm-latency 0.2] [--modes blocking async] [--output load.json]
+def main():
+    parser = argparse.ArgumentParser(description="Run many chats at once and report turn latency and event loop lag, blocking vs async.")
+    parser.add_argument("corpus", help="jsonl file with one conversation per line")
+    parser.add_argument("--chats", type=int, default=32, help="chats replayed at the same time in each mode")
+    parser.add_argument("--llm-latency", type=float, default=0.2, metavar="SECONDS", help="simulated provider latency per LLM call")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES), help="which graph API to drive the turns with")
+    parser.add_argument("--redis-url", help="use this Redis server instead of the in-process stand-in")
+    parser.add_argument("--workdir", help="directory for the benchmark databases (default: a new temporary directory)")
+    parser.add_argument("--output", help="also write the report to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    report = asyncio.run(run_benchmark(args))
+    print(json.dumps(report, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
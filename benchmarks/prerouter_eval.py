@@ -0,0 +1,49 @@
+import argparse
+import json
+from collections import Counter
+from pathlib import Path
+
+def evaluate(router, examples: list[dict]) -> dict:
+    """Scores the router on examples labelled with the assistant the supervisor picked.
+
+    Each correct route saves the supervisor call. A wrong route costs one, because the
+    assistant has to escalate back to the supervisor.
+    """
+    counts = Counter()
+    for example in examples:
+        predicted = router.route(example["text"])
+        if predicted is None:
+            counts["fallback"] += 1
+        elif predicted == example["assistant"]:
+            counts["correct"] += 1
+        else:
+            counts["wrong"] += 1
+    total = len(examples)
+    routed = counts["correct"] + counts["wrong"]
+    return {
+        "examples": total,
+        "routed": routed,
+        "coverage": routed / total if total else 0.0,
+        "accuracy": counts["correct"] / routed if routed else 0.0,
+        "llm_calls_saved_per_1k": 1000 * (counts["correct"] - counts["wrong"]) / total if total else 0.0,
+    }
+
+# Usage: python -m benchmarks.prerouter_eval messages.jsonl [--output prerouter.json]
+# Each line is {"text": "<user message>", "assistant": "<assistant name or null>"}.
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the deterministic pre-router on logged messages.")
+    parser.add_argument("path", help="jsonl file with one labelled user message per line")
+    parser.add_argument("--output", help="also write the report to this file")
+    args = parser.parse_args()
+
+    from app.assistants.prerouter import get_router
+
+    with open(args.path, encoding="utf-8") as f:
+        examples = [json.loads(line) for line in f if line.strip()]
+    report = evaluate(get_router(), examples)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
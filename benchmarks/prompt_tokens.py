@@ -0,0 +1,138 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+from pathlib import Path
+
+from benchmarks.fakes import GmailStandIn, Script, ScriptedChatModel, start_redis
+from benchmarks.replay import build_faq_index, configure_environment, create_schema, seed_sessions
+
+SUPERVISOR_NODE = "supervisor"
+SUMMARY_NODE = "summarize_conversation"
+# Context settings of each variant; the full history is a window no conversation fills
+VARIANTS = {
+    "full_history": {"CONTEXT_MAX_TOKENS": str(10**9), "CONTEXT_SUMMARY_ENABLED": "false"},
+    "window": {"CONTEXT_SUMMARY_ENABLED": "false"},
+    "window_summary": {"CONTEXT_SUMMARY_ENABLED": "true"},
+}
+REPORTED_TURNS = (1, 10, 50, 100, 150, 200)
+WORDS = "order refund shipping invoice address delivery account password email package return warranty payment card status".split()
+
+class RecordingChatModel(ScriptedChatModel):
+    """Scripted model that also records the node and prompt tokens of every call."""
+    calls: list = []
+
+    def _respond(self, messages, run_manager):
+        result = super()._respond(messages, run_manager)
+        node = ((run_manager.metadata if run_manager else None) or {}).get("langgraph_node", "")
+        self.calls.append((node, result.generations[0].message.usage_metadata["input_tokens"]))
+        return result
+
+def synthetic_turns(count: int, seed: int) -> list[dict]:
+    """User messages and supervisor replies of a long chat that never leaves the supervisor."""
+    rng = random.Random(seed)
+    def text(words: int) -> str:
+        return " ".join(rng.choice(WORDS) for _ in range(words))
+    return [
+        {
+            "user": f"Question {i} about order {1000 + i}: {text(30)}",
+            "responses": [
+                {"node": SUPERVISOR_NODE, "content": f"Answer {i}: {text(60)}"},
+                {"node": SUMMARY_NODE, "content": f"Summary up to turn {i}: {text(120)}"},
+            ],
+        }
+        for i in range(1, count + 1)
+    ]
+
+def slope(points: list[tuple[int, int]]) -> float:
+    """Least-squares growth of prompt tokens per turn."""
+    if len(points) < 2:
+        return 0.0
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / variance
+
+async def run_variant(llm: RecordingChatModel, session: dict, turns: list[dict]) -> dict:
+    from langgraph.checkpoint.memory import MemorySaver
+
+    from app.graph import build_graph, graph_updates
+
+    graph = build_graph(checkpointer=MemorySaver())
+    supervisor, summaries = [], []
+    for i, turn in enumerate(turns, start=1):
+        llm.scripts[session["chat_id"]] = Script(turn["responses"], {"user_id": session["user_id"]})
+        llm.calls.clear()
+        await graph_updates(graph, thread_id=session["chat_id"], user_id=session["user_id"], user_input=turn["user"])
+        supervisor.append((i, sum(tokens for node, tokens in llm.calls if node == SUPERVISOR_NODE)))
+        summaries += [tokens for node, tokens in llm.calls if node == SUMMARY_NODE]
+    llm.scripts.pop(session["chat_id"], None)
+
+    tokens = [count for _, count in supervisor]
+    return {
+        "prompt_tokens_at_turn": {turn: tokens[turn - 1] for turn in REPORTED_TURNS if turn <= len(tokens)},
+        "mean": round(sum(tokens) / len(tokens)),
+        "max": max(tokens),
+        "total": sum(tokens),
+        "slope_last_half": round(slope(supervisor[len(supervisor) // 2:]), 2),
+        "summary_calls": len(summaries),
+        "summary_prompt_tokens": sum(summaries),
+    }
+
+async def run_benchmark(args) -> dict:
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="prompt-tokens-"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    gmail = GmailStandIn().start()
+    configure_environment(workdir, args.redis_url or start_redis(), gmail.url, "sqlite")
+    # Every turn goes to the supervisor LLM, whose prompt is what's measured
+    os.environ["PREROUTER_ENABLED"] = "false"
+    create_schema(os.environ["SQLITE_DB_NAME"])
+
+    llm = RecordingChatModel()
+    from app import config
+    config._init_llm = lambda llm_name, llm_provider: llm
+
+    build_faq_index()
+    turns = synthetic_turns(args.turns, args.seed)
+    sessions = seed_sessions([{"id": name, "turns": []} for name in args.variants], 1)
+    base = dict(os.environ)
+    variants = {}
+    try:
+        for name, session in zip(args.variants, sessions):
+            os.environ.clear()
+            os.environ.update({**base, **VARIANTS[name]})
+            variants[name] = await run_variant(llm, session, turns)
+    finally:
+        os.environ.clear()
+        os.environ.update(base)
+        gmail.stop()
+
+    report = {"turns": args.turns, "context_max_tokens": int(os.environ.get("CONTEXT_MAX_TOKENS", 4000)), "variants": variants}
+    if "full_history" in variants:
+        full = variants["full_history"]["total"]
+        report["saved_vs_full_history"] = {
+            name: round(1 - (v["total"] + v["summary_prompt_tokens"]) / full, 3)
+            for name, v in variants.items() if name != "full_history"
+        }
+    return report
+
+# Usage: python -m benchmarks.prompt_tokens [--turns 200] [--variants full_history window window_summary] [--output tokens.json]
+def main():
+    parser = argparse.ArgumentParser(description="Run a long chat and report how the supervisor's prompt tokens grow per turn.")
+    parser.add_argument("--turns", type=int, default=200, help="turns in the synthetic chat")
+    parser.add_argument("--variants", nargs="+", choices=list(VARIANTS), default=list(VARIANTS), help="context settings to compare")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic messages")
+    parser.add_argument("--redis-url", help="use this Redis server instead of the in-process stand-in")
+    parser.add_argument("--workdir", help="directory for the benchmark databases (default: a new temporary directory)")
+    parser.add_argument("--output", help="also write the report to this file")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_benchmark(args))
+    print(json.dumps(report, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from benchmarks.replay import create_schema
+
+SEED_BATCH = 50_000
+SEED_START = datetime(2024, 1, 1)
+STATEMENT = re.compile(r"^\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\b", re.IGNORECASE)
+FULL_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)")
+# Queries that read a whole table on purpose, and why
+FULL_SCAN_ALLOWED = {
+    "get_chat_ids": "lists every chat for checkpoint compaction",
+}
+
+def _timestamp(seconds: int) -> str:
+    # The format SQLAlchemy stores datetimes in, so seeded rows sort like the app's own
+    return (SEED_START + timedelta(seconds=seconds)).isoformat(sep=" ", timespec="microseconds")
+
+def seed(path: str, users: int, chats: int, messages: int):
+    """Fills the app database with `users`, `chats` spread across them and `messages` spread across those."""
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany(
+            "INSERT INTO users (id, name, email, password, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            ((f"user-{i}", "Benchmark User", f"user-{i}@bench.example.com", "benchmark", _timestamp(i), _timestamp(i)) for i in range(users)),
+        )
+        conn.executemany(
+            "INSERT INTO chats (id, user_id, name, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+            ((f"chat-{i}", f"user-{i % users}", f"Chat {i}", _timestamp(i), _timestamp(messages + i)) for i in range(chats)),
+        )
+    for start in range(0, messages, SEED_BATCH):
+        with conn:
+            conn.executemany(
+                "INSERT INTO messages (chat_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+                ((f"chat-{i % chats}", ("user", "ai")[i // chats % 2], f"Benchmark message {i}", _timestamp(i)) for i in range(start, min(start + SEED_BATCH, messages))),
+            )
+    conn.execute("ANALYZE")
+    conn.close()
+
+def query_calls(sample: dict) -> dict:
+    """One representative call per function in `queries.__all__`, taking the session to run it in."""
+    from app.database import queries
+    from app.database.models import Chat, User
+
+    def new_user() -> User:
+        return User(name="Benchmark User", email=f"{uuid.uuid4().hex}@bench.example.com", password="benchmark")
+
+    async def aupdate_user_password(session):
+        user = await queries.aget_user_by_id(session, sample["user_id"])
+        return await queries.aupdate_user_password(session, user, "benchmark-updated")
+
+    return {
+        "create_user": lambda session: queries.create_user(session, new_user()),
+        "acreate_user": lambda session: queries.acreate_user(session, new_user()),
+        "get_user_by_email": lambda session: queries.get_user_by_email(session, sample["email"]),
+        "aget_user_by_email": lambda session: queries.aget_user_by_email(session, sample["email"]),
+        "get_user_by_id": lambda session: queries.get_user_by_id(session, sample["user_id"]),
+        "aget_user_by_id": lambda session: queries.aget_user_by_id(session, sample["user_id"]),
+        "aupdate_user_password": aupdate_user_password,
+        "create_chat": lambda session: queries.create_chat(session, Chat(user_id=sample["user_id"], name="Benchmark chat")),
+        "get_chats_by_user": lambda session: queries.get_chats_by_user(session, sample["user_id"]),
+        "aget_chats_by_user": lambda session: queries.aget_chats_by_user(session, sample["user_id"]),
+        "get_chat_by_id": lambda session: queries.get_chat_by_id(session, sample["chat_id"]),
+        "aget_chat_by_id": lambda session: queries.aget_chat_by_id(session, sample["chat_id"]),
+        "get_chat_ids": lambda session: queries.get_chat_ids(session, updated_before=datetime.now()),
+        "delete_chat_by_id": lambda session: queries.delete_chat_by_id(session, sample["deleted_chat_id"]),
+        "create_message": lambda session: queries.create_message(session, sample["chat_id"], "user", "Benchmark message"),
+        "acreate_messages": lambda session: queries.acreate_messages(session, sample["chat_id"], [("user", "Benchmark message"), ("ai", "Benchmark reply")]),
+        "get_messages_by_chat_id": lambda session: queries.get_messages_by_chat_id(session, sample["chat_id"]),
+        "get_messages_page": lambda session: queries.get_messages_page(session, sample["chat_id"], 50, before=sample["cursor"]),
+        "aget_messages_page": lambda session: queries.aget_messages_page(session, sample["chat_id"], 50, before=sample["cursor"]),
+    }
+
+def plan_problems(plan: list[str], tables: set[str]) -> list[str]:
+    problems = []
+    for detail in plan:
+        match = FULL_SCAN.match(detail)
+        if match and match.group(1) in tables:
+            problems.append(f"full scan: {detail}")
+        elif "USE TEMP B-TREE" in detail:
+            problems.append(f"sort without an index: {detail}")
+    return problems
+
+async def check_queries(path: str, sample: dict) -> tuple[dict, list[str]]:
+    from sqlalchemy import event
+    from sqlmodel import Session
+
+    from app.database import db, queries
+
+    captured = []
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if STATEMENT.match(statement):
+            # A batch (which SQLAlchemy also uses for single-row inserts) is planned like its first row
+            if executemany and parameters and isinstance(parameters[0], (tuple, list, dict)):
+                parameters = parameters[0]
+            captured.append((statement, parameters))
+
+    event.listen(db.engine, "before_cursor_execute", capture)
+    event.listen(db.async_engine.sync_engine, "before_cursor_execute", capture)
+    conn = sqlite3.connect(path)
+    tables = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+    calls = query_calls(sample)
+    results, failures = {}, []
+    for name in queries.__all__:
+        if name not in calls:
+            failures.append(f"{name}: no call in the benchmark's call table")
+            continue
+        captured.clear()
+        start = time.perf_counter()
+        if inspect.iscoroutinefunction(getattr(queries, name)):
+            async with db.new_async_session() as session:
+                await calls[name](session)
+        else:
+            with Session(db.engine) as session:
+                calls[name](session)
+        elapsed = time.perf_counter() - start
+
+        statements = []
+        for statement, parameters in captured:
+            plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)]
+            problems = [] if name in FULL_SCAN_ALLOWED else plan_problems(plan, tables)
+            failures += [f"{name}: {problem}" for problem in problems]
+            statements.append({"sql": " ".join(statement.split()), "plan": plan, "problems": problems})
+        results[name] = {"ms": round(elapsed * 1000, 3), "statements": statements}
+        if name in FULL_SCAN_ALLOWED:
+            results[name]["allowed_full_scan"] = FULL_SCAN_ALLOWED[name]
+    conn.close()
+    return results, failures
+
+def run_benchmark(args) -> dict:
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="query-plans-"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    path = str(workdir / "app.db")
+    os.environ["SQLITE_DB_NAME"] = path
+    os.environ.setdefault("SESSION_SECRET", "benchmark")
+    create_schema(path)
+
+    chats = args.chats or max(1, args.messages // 50)
+    users = args.users or max(1, chats // 10)
+    start = time.perf_counter()
+    seed(path, users, chats, args.messages)
+    seed_seconds = time.perf_counter() - start
+
+    # A long chat, paged from the middle, and one other chat to delete
+    sample = {"user_id": "user-0", "email": "user-0@bench.example.com", "chat_id": "chat-0", "deleted_chat_id": f"chat-{chats - 1}"}
+    conn = sqlite3.connect(path)
+    created_at, id = conn.execute(
+        "SELECT created_at, id FROM messages WHERE chat_id = ? ORDER BY created_at DESC, id DESC LIMIT 1 OFFSET ?",
+        (sample["chat_id"], args.messages // chats // 2),
+    ).fetchone()
+    conn.close()
+    sample["cursor"] = f"{datetime.fromisoformat(created_at).isoformat()}_{id}"
+
+    queries, failures = asyncio.run(check_queries(path, sample))
+    return {
+        "users": users,
+        "chats": chats,
+        "messages": args.messages,
+        "seed_seconds": round(seed_seconds, 3),
+        "queries": queries,
+        "failures": failures,
+    }
+
+# Usage: python -m benchmarks.query_plans [--messages 1000000] [--chats 20000] [--users 2000] [--output plans.json]
+def main():
+    parser = argparse.ArgumentParser(description="Run every query against a large database and fail on plans that scan a whole table.")
+    parser.add_argument("--messages", type=int, default=1_000_000, help="messages to seed")
+    parser.add_argument("--chats", type=int, help="chats to spread the messages across (default: one per 50 messages)")
+    parser.add_argument("--users", type=int, help="users to spread the chats across (default: one per 10 chats)")
+    parser.add_argument("--workdir", help="directory for the benchmark database (default: a new temporary directory)")
+    parser.add_argument("--output", help="also write the report to this file")
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+
+    for failure in report["failures"]:
+        print(f"query plan: {failure}", file=sys.stderr)
+    if report["failures"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
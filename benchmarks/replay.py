@@ -0,0 +1,400 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import resource
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from benchmarks.fakes import GmailStandIn, Script, ScriptedChatModel, start_redis
+
+logger = logging.getLogger(__name__)
+
+ROOT = Path(__file__).resolve().parent.parent
+MIGRATIONS = ROOT / "sql" / "migrations"
+FAQ = Path(__file__).resolve().parent / "faq.md"
+BENCH_PASSWORD = "benchmark-password"
+# Report fields compared against a baseline, and whether a larger value is better
+REGRESSION_CHECKS = {
+    ("throughput_turns_per_second",): True,
+    ("turn_latency", "p95"): False,
+    ("checkpoint", "bytes_per_turn"): False,
+    ("peak_rss_bytes",): False,
+}
+
+def configure_environment(workdir: Path, redis_url: str, gmail_url: str, checkpoint_backend: str):
+    """Points the app at the benchmark's databases and stand-ins; must run before app modules are imported."""
+    os.environ.update({
+        "CHECKPOINT_BACKEND": checkpoint_backend,
+        "CHECKPOINT_REDIS_URL": redis_url,
+        "SQLITE_DB_NAME": str(workdir / "app.db"),
+        "AGENT_STATE_DB_NAME": str(workdir / "agent.db"),
+        "KB_INDEX_DIR": str(workdir / "kb_index"),
+        "REDIS_URL": redis_url,
+        "GMAIL_API_ROOT_URL": gmail_url,
+        "LLM_NAME": "scripted",
+        "LLM_PROVIDER": "scripted",
+        "METRICS_ENABLED": "true",
+        "CHECKPOINT_COMPACTION_INTERVAL": "0",
+        "GOOGLE_TOKEN_REFRESH_INTERVAL": "0",
+        # The scripted model has no provider rate limit to stay under
+        "ADMISSION_PROVIDER_RATE": "1000000",
+    })
+    os.environ.setdefault("SESSION_SECRET", "benchmark")
+    os.environ.setdefault("GOOGLE_CLIENT_ID", "benchmark")
+    os.environ.setdefault("GOOGLE_CLIENT_SECRET", "benchmark")
+    os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+def create_schema(path: str):
+    conn = sqlite3.connect(path)
+    try:
+        for migration in sorted(MIGRATIONS.glob("*.sql")):
+            conn.executescript(migration.read_text().split("-- +goose Down")[0])
+    finally:
+        conn.close()
+
+def build_faq_index():
+    from app.config import get_knowledge_base_config
+    from app.knowledge_base import KnowledgeBaseIndex
+    from app.knowledge_base.ingest import chunk_document
+
+    KnowledgeBaseIndex.build(chunk_document(FAQ.read_text(), FAQ.name, 200), get_knowledge_base_config()["index_dir"])
+
+def load_corpus(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def seed_sessions(corpus: list[dict], repeat: int) -> list[dict]:
+    """One user and chat per replayed conversation, with Google credentials served by the Gmail stand-in."""
+    from google.oauth2.credentials import Credentials
+
+    from app import auth, google_auth
+
+    sessions = []
+    for round_ in range(repeat):
+        for conversation in corpus:
+            user_id = str(uuid.uuid4())
+            sessions.append({
+                "conversation": conversation,
+                "user_id": user_id,
+                "chat_id": str(uuid.uuid4()),
+                "email": f"{conversation['id']}-{round_}@bench.example.com",
+            })
+    password = auth.hash_password(BENCH_PASSWORD)
+    conn = sqlite3.connect(os.environ["SQLITE_DB_NAME"])
+    with conn:
+        conn.executemany(
+            "INSERT INTO users (id, name, email, password) VALUES (?, ?, ?, ?)",
+            [(s["user_id"], "Benchmark User", s["email"], password) for s in sessions],
+        )
+        conn.executemany("INSERT INTO chats (id, user_id) VALUES (?, ?)", [(s["chat_id"], s["user_id"]) for s in sessions])
+    conn.close()
+
+    expiry = (datetime.now(timezone.utc) + timedelta(days=1)).replace(tzinfo=None)
+    for session in sessions:
+        google_auth.save_credentials(session["user_id"], Credentials(token="benchmark", refresh_token="benchmark", expiry=expiry))
+    return sessions
+
+async def _interrupted(graph, chat_id: str) -> bool:
+    from app.graph import SENSITIVE_NODE
+
+    snapshot = await graph.aget_state({"configurable": {"thread_id": chat_id}})
+    return bool(snapshot.next) and SENSITIVE_NODE in snapshot.next[0]
+
+class GraphTarget:
+    """Replays turns by calling the graph helpers the routes use."""
+    def __init__(self, graph):
+        self.graph = graph
+
+    async def start(self, session: dict):
+        pass
+
+    async def send(self, session: dict, text: str):
+        from app.graph import graph_updates
+        await graph_updates(self.graph, thread_id=session["chat_id"], user_id=session["user_id"], user_input=text)
+
+    async def confirm(self, session: dict, confirmation: str):
+        from app.graph import graph_reject_tool_call, graph_updates
+        if confirmation == "accepted":
+            await graph_updates(self.graph, thread_id=session["chat_id"], user_id=session["user_id"])
+        else:
+            await graph_reject_tool_call(self.graph, thread_id=session["chat_id"], user_id=session["user_id"])
+
+    async def stop(self, session: dict):
+        pass
+
+    async def close(self):
+        pass
+
+class HttpTarget(GraphTarget):
+    """Replays turns through the FastAPI app, logged in as the session's user.
+
+    The routes queue turns as background jobs, so this runs the job workers too and
+    polls each job until it has finished.
+    """
+    POLL_INTERVAL = 0.02
+
+    def __init__(self, graph):
+        from app.app import create_app
+
+        super().__init__(graph)
+        self.app = create_app()
+        self.app.state.graph = graph
+        self.job_workers = None
+
+    async def start(self, session: dict):
+        import httpx
+        from app.jobs import run_workers
+        from app.turns import create_job_handlers
+
+        if self.job_workers is None:
+            self.job_workers = asyncio.create_task(run_workers(create_job_handlers(self.graph)))
+        session["client"] = client = httpx.AsyncClient(transport=httpx.ASGITransport(app=self.app), base_url="http://benchmark")
+        response = await client.post("/login", data={"email": session["email"], "password": BENCH_PASSWORD})
+        if response.status_code != 302:
+            raise RuntimeError(f"login failed with status {response.status_code}")
+
+    async def _post(self, session: dict, data: dict):
+        response = await session["client"].post(f"/chat/{session['chat_id']}/send", data=data)
+        response.raise_for_status()
+        job_url = re.search(r'hx-get="(/jobs/\w+)"', response.text).group(1)
+        while 'hx-get="/jobs/' in response.text:
+            await asyncio.sleep(self.POLL_INTERVAL)
+            response = await session["client"].get(job_url)
+            response.raise_for_status()
+        if "job-failed" in response.text:
+            raise RuntimeError(f"job {job_url} failed")
+
+    async def send(self, session: dict, text: str):
+        await self._post(session, {"user_message": text})
+
+    async def confirm(self, session: dict, confirmation: str):
+        await self._post(session, {"user_message": "", "tool_confirmation": confirmation})
+
+    async def stop(self, session: dict):
+        await session.pop("client").aclose()
+
+    async def close(self):
+        if self.job_workers:
+            self.job_workers.cancel()
+            await asyncio.gather(self.job_workers, return_exceptions=True)
+
+async def replay_session(target, llm: ScriptedChatModel, session: dict, stats: dict):
+    await target.start(session)
+    try:
+        for turn in session["conversation"]["turns"]:
+            script = Script(turn.get("responses", []), {"user_id": session["user_id"], "chat_id": session["chat_id"]})
+            llm.scripts[session["chat_id"]] = script
+            start = time.perf_counter()
+            try:
+                await target.send(session, turn["user"])
+                # A turn can stop at several sensitive tool confirmations in a row
+                for _ in range(turn.get("max_confirmations", 5)):
+                    if not await _interrupted(target.graph, session["chat_id"]):
+                        break
+                    await target.confirm(session, turn.get("confirm", "accepted"))
+            except Exception:
+                stats["errors"] += 1
+                logger.exception("turn failed in conversation %s", session["conversation"]["id"])
+                continue
+            stats["turn_seconds"].append(time.perf_counter() - start)
+            stats["llm_calls"] += script.calls
+            stats["unscripted_llm_calls"] += script.misses
+            stats["unused_responses"] += script.unused
+    finally:
+        llm.scripts.pop(session["chat_id"], None)
+        await target.stop(session)
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def summarize(values: list[float]) -> dict:
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 6) if values else 0.0,
+        "p50": round(percentile(values, 0.5), 6),
+        "p95": round(percentile(values, 0.95), 6),
+        "p99": round(percentile(values, 0.99), 6),
+        "max": round(max(values, default=0.0), 6),
+    }
+
+def checkpoint_bytes(path: str) -> dict:
+    from app.checkpoints import get_checkpoint_metrics
+
+    conn = sqlite3.connect(path)
+    try:
+        metrics = get_checkpoint_metrics(conn)
+        checkpoints = conn.execute("SELECT COALESCE(SUM(LENGTH(checkpoint) + LENGTH(metadata)), 0) FROM checkpoints").fetchone()[0]
+        writes = conn.execute("SELECT COALESCE(SUM(LENGTH(value)), 0) FROM writes").fetchone()[0]
+    finally:
+        conn.close()
+    return {**metrics, "checkpoint_bytes": checkpoints, "write_bytes": writes}
+
+def redis_checkpoint_bytes(client) -> dict:
+    from app import checkpointer
+
+    stats = {"threads": 0, "checkpoints": 0, "writes": 0, "checkpoint_bytes": 0, "write_bytes": 0}
+    for thread_id in checkpointer.thread_ids(client):
+        stats["threads"] += 1
+        for checkpoint_ns in map(checkpointer._decode, client.smembers(checkpointer.NAMESPACES_KEY.format(thread_id=thread_id))):
+            index_key = checkpointer.INDEX_KEY.format(thread_id=thread_id, checkpoint_ns=checkpoint_ns)
+            for checkpoint_id in map(checkpointer._decode, client.zrange(index_key, 0, -1)):
+                ids = {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id}
+                stored = client.hmget(checkpointer.CHECKPOINT_KEY.format(**ids), "checkpoint", "metadata")
+                writes = client.hvals(checkpointer.WRITES_KEY.format(**ids))
+                stats["checkpoints"] += 1
+                stats["writes"] += len(writes)
+                stats["checkpoint_bytes"] += sum(len(value or b"") for value in stored)
+                stats["write_bytes"] += sum(map(len, writes))
+    return stats
+
+def peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # kilobytes on Linux
+
+async def run_benchmark(args) -> dict:
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="replay-"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    gmail = GmailStandIn().start()
+    configure_environment(workdir, args.redis_url or start_redis(), gmail.url, args.checkpoint_backend)
+    os.environ.setdefault("JOB_WORKERS", str(args.concurrency))
+    create_schema(os.environ["SQLITE_DB_NAME"])
+
+    # Every caller of get_llm() gets the scripted model
+    llm = ScriptedChatModel(latency=args.llm_latency)
+    from app import config
+    config._init_llm = lambda llm_name, llm_provider: llm
+
+    from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+    from app import instrumentation
+    from app.checkpointer import create_checkpointer
+    from app.database import db
+    from app.graph import build_graph
+
+    build_faq_index()
+    spans = defaultdict(list)
+    instrumentation.add_turn_listener(lambda tracer: [spans[(s["type"], s["name"])].append(s["seconds"]) for s in tracer.spans])
+
+    corpus = load_corpus(args.corpus)
+    sessions = seed_sessions(corpus, args.repeat)
+    # Same checkpointer choice as the web app's lifespan
+    conn = None
+    if args.checkpoint_backend == "redis":
+        saver = create_checkpointer()
+    else:
+        conn = await db.aconnect_checkpoint_db(os.environ["AGENT_STATE_DB_NAME"])
+        saver = AsyncSqliteSaver(conn)
+    target = None
+    try:
+        graph = build_graph(checkpointer=saver)
+        target = HttpTarget(graph) if args.target == "http" else GraphTarget(graph)
+        stats = {"errors": 0, "turn_seconds": [], "llm_calls": 0, "unscripted_llm_calls": 0, "unused_responses": 0}
+        pending = asyncio.Queue()
+        for session in sessions:
+            pending.put_nowait(session)
+
+        async def worker():
+            while not pending.empty():
+                await replay_session(target, llm, pending.get_nowait(), stats)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+    finally:
+        if target:
+            await target.close()
+        if conn:
+            await conn.close()
+        gmail.stop()
+
+    turns = len(stats["turn_seconds"])
+    if args.checkpoint_backend == "redis":
+        storage = redis_checkpoint_bytes(saver.client)
+    else:
+        storage = checkpoint_bytes(os.environ["AGENT_STATE_DB_NAME"])
+    return {
+        "target": args.target,
+        "checkpoint_backend": args.checkpoint_backend,
+        "concurrency": args.concurrency,
+        "llm_latency": args.llm_latency,
+        "conversations": len(sessions),
+        "turns": turns,
+        "errors": stats["errors"],
+        "seconds": round(elapsed, 3),
+        "throughput_turns_per_second": round(turns / elapsed, 3) if elapsed else 0.0,
+        "turn_latency": summarize(stats["turn_seconds"]),
+        "nodes": {name: summarize(values) for (kind, name), values in sorted(spans.items()) if kind == "node"},
+        "llm": {
+            "calls": stats["llm_calls"],
+            "unscripted_calls": stats["unscripted_llm_calls"],
+            "unused_responses": stats["unused_responses"],
+            "by_node": {name: summarize(values) for (kind, name), values in sorted(spans.items()) if kind == "llm"},
+        },
+        "tools": {name: summarize(values) for (kind, name), values in sorted(spans.items()) if kind == "tool"},
+        "gmail_requests": gmail.requests,
+        "checkpoint": {
+            **storage,
+            "bytes_per_turn": round((storage["checkpoint_bytes"] + storage["write_bytes"]) / turns) if turns else 0,
+            "checkpoints_per_turn": round(storage["checkpoints"] / turns, 2) if turns else 0,
+        },
+        "peak_rss_bytes": peak_rss_bytes(),
+    }
+
+def find_regressions(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Fields that got worse than `baseline` by more than `tolerance` (a fraction)."""
+    regressions = []
+    for path, higher_is_better in REGRESSION_CHECKS.items():
+        current, previous = report, baseline
+        for key in path:
+            current, previous = current.get(key, {}), previous.get(key, {})
+        if not isinstance(current, (int, float)) or not isinstance(previous, (int, float)) or not previous:
+            continue
+        change = (current - previous) / previous
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append(f"{'.'.join(path)}: {previous} -> {current} ({change:+.1%})")
+    return regressions
+
+# Usage: python -m benchmarks.replay benchmarks/corpus.jsonl [--concurrency 8] [--repeat 10] [--llm-latency 0.2]
+#        [--target graph|http] [--checkpoint-backend sqlite|redis] [--output report.json] [--baseline previous.json --tolerance 0.2]
+def main():
+    parser = argparse.ArgumentParser(description="Replay a scripted conversation corpus through the graph and report performance.")
+    parser.add_argument("corpus", help="jsonl file with one conversation per line")
+    parser.add_argument("--concurrency", type=int, default=4, help="conversations replayed at the same time")
+    parser.add_argument("--repeat", type=int, default=1, help="replay the corpus this many times, each in new chats")
+    parser.add_argument("--llm-latency", type=float, default=0.0, metavar="SECONDS", help="simulated provider latency per LLM call")
+    parser.add_argument("--target", choices=["graph", "http"], default="graph", help="call graph_updates directly or go through send_message")
+    parser.add_argument("--checkpoint-backend", choices=["sqlite", "redis"], default="sqlite", help="where the graph checkpoints")
+    parser.add_argument("--redis-url", help="use this Redis server instead of the in-process stand-in")
+    parser.add_argument("--workdir", help="directory for the benchmark databases (default: a new temporary directory)")
+    parser.add_argument("--output", help="also write the report to this file")
+    parser.add_argument("--baseline", help="report of a previous run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression against the baseline, as a fraction")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    report = asyncio.run(run_benchmark(args))
+    print(json.dumps(report, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+
+    if args.baseline:
+        regressions = find_regressions(report, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import argparse
+import inspect
+import json
+import os
+import timeit
+from pathlib import Path
+
+def _call(name: str, i: int = 0) -> dict:
+    return {"name": name, "args": {}, "id": f"call_{name}_{i}", "type": "tool_call"}
+
+def _state(*tool_calls: dict, dialog_state: list | None = None, answered: tuple = ()) -> dict:
+    from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+    messages = [HumanMessage(content="Where is my order 12345?"), AIMessage(content="" if tool_calls else "Here you go.", tool_calls=list(tool_calls))]
+    messages += [ToolMessage(content="done", tool_call_id=call["id"]) for call in answered]
+    return {"messages": messages, "dialog_state": dialog_state or []}
+
+def reflective_route_tools(assistant_name: str):
+    """The assistant router as it was before the tool registry, reflecting over app.tools per decision."""
+    import app.tools
+    from langgraph.prebuilt import tools_condition
+    from langgraph.graph import END
+
+    def route_node(state: dict):
+        if tools_condition(state) == END:
+            return END
+        tool_calls = state["messages"][-1].tool_calls
+        if any(tool_call["name"] == "CompleteOrEscalate" for tool_call in tool_calls):
+            return "leave_skill"
+        all_tools = [tool for _, tool in inspect.getmembers(app.tools) if hasattr(tool, "tags")]
+        sensitive_tools_names = [tool.name for tool in all_tools if all(tag in tool.tags for tag in (assistant_name, "sensitive"))]
+        if all(tool_call["name"] in sensitive_tools_names for tool_call in tool_calls):
+            return f"sensitive_tools_{assistant_name}"
+        return f"safe_tools_{assistant_name}"
+    return route_node
+
+def routing_cases() -> dict:
+    """(router, state) of every routing decision a turn can make, by name."""
+    from app.assistants import factory
+    from app.assistants.registry import get_assistants
+    from app.tools import tools_registry
+
+    cases = {}
+    for name, cfg in get_assistants().items():
+        sensitive = sorted(tools_registry.get_tool_names_by_tags(name, "sensitive"))
+        safe = sorted(tools_registry.get_tool_names_by_tags(name) - set(sensitive))
+        route_tools = factory.create_assistant_route_tools(name)
+        states = {"no_tool_call": _state(), "escalate": _state(_call("CompleteOrEscalate"))}
+        if safe:
+            states["safe_call"] = _state(_call(safe[0]))
+        if sensitive:
+            states["sensitive_call"] = _state(_call(sensitive[0]))
+        if safe and sensitive:
+            states["mixed_calls"] = _state(_call(safe[0]), _call(sensitive[0]))
+            cases[f"{name}/after_safe_tools"] = (factory.create_safe_tools_route(name), _state(_call(safe[0]), _call(sensitive[0]), answered=(_call(safe[0]),)))
+        for case, state in states.items():
+            cases[f"{name}/{case}"] = (route_tools, state)
+        cases[f"supervisor/to_{name}"] = (factory.route_supervisor, _state(_call(cfg["entry_tool"].__name__)))
+        cases[f"workflow/{name}"] = (factory.route_to_workflow, _state(dialog_state=[name]))
+    cases["supervisor/reply"] = (factory.route_supervisor, _state())
+    return cases
+
+def microseconds(fn, state: dict, number: int, repeat: int) -> float:
+    """Best time of one call over `repeat` rounds of `number` calls."""
+    return round(min(timeit.repeat(lambda: fn(state), number=number, repeat=repeat)) / number * 1e6, 3)
+
+def run_benchmark(args) -> dict:
+    from app.assistants.registry import get_assistants
+    from app.tools import tools_registry
+
+    cases = routing_cases()
+    routes = {}
+    for name, (router, state) in cases.items():
+        routes[name] = {"route": router(state), "us": microseconds(router, state, args.number, args.repeat)}
+
+    reflective = {}
+    for name in get_assistants():
+        router = reflective_route_tools(name)
+        for case, result in routes.items():
+            # Only calls to tools reach the lookup the registry replaced
+            if case in (f"{name}/safe_call", f"{name}/sensitive_call", f"{name}/mixed_calls"):
+                state = cases[case][1]
+                if router(state) != result["route"]:
+                    raise SystemExit(f"{case}: the reflective router routes to {router(state)!r}, the registry to {result['route']!r}")
+                reflective[case] = {"us": microseconds(router, state, args.number, args.repeat)}
+                reflective[case]["speedup"] = round(reflective[case]["us"] / result["us"], 1) if result["us"] else None
+
+    return {
+        "tools": len(tools_registry.get_all_tools()),
+        "number": args.number,
+        "routes": routes,
+        "reflective_baseline": reflective,
+        "tag_lookup_us": microseconds(lambda _: tools_registry.get_tool_names_by_tags("order_management", "sensitive"), None, args.number, args.repeat),
+    }
+
+# Usage: python -m benchmarks.routing [--number 10000] [--repeat 5] [--output routing.json]
+def main():
+    parser = argparse.ArgumentParser(description="Time every routing decision of the graph, against the reflective tool lookup it replaced.")
+    parser.add_argument("--number", type=int, default=10_000, help="calls per timing round")
+    parser.add_argument("--repeat", type=int, default=5, help="timing rounds; the best is reported")
+    parser.add_argument("--output", help="also write the report to this file")
+    args = parser.parse_args()
+
+    os.environ.setdefault("SESSION_SECRET", "benchmark")
+    report = run_benchmark(args)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from benchmarks.replay import ROOT
+
+IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$")
+# Imported on first use rather than at startup
+LAZY_MODULES = ("googleapiclient", "langchain.chat_models", "google_auth_oauthlib")
+
+def startup_environment(workdir: Path) -> dict:
+    env = {
+        **os.environ,
+        "SQLITE_DB_NAME": str(workdir / "app.db"),
+        "AGENT_STATE_DB_NAME": str(workdir / "agent.db"),
+        "KB_INDEX_DIR": str(workdir / "kb_index"),
+    }
+    for name in ("SESSION_SECRET", "GOOGLE_CLIENT_ID", "GOOGLE_CLIENT_SECRET"):
+        env.setdefault(name, "benchmark")
+    return env
+
+def run_python(code: str, env: dict, *flags: str) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, *flags, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+
+def parse_importtime(stderr: str) -> list[dict]:
+    """The `-X importtime` entries, in the order the imports finished."""
+    imports = []
+    for line in stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            imports.append({"module": module, "self_us": int(self_us), "cumulative_us": int(cumulative_us), "depth": len(indent) // 2})
+    return imports
+
+def run_benchmark(args) -> dict:
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="startup-"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    env = startup_environment(workdir)
+    code = f"import {args.module}"
+
+    run_python(code, env)  # compiles the bytecode, so every measured run is warm
+    imports = parse_importtime(run_python(code, env, "-X", "importtime").stderr)
+    walls, baseline = [], []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        run_python(code, env)
+        walls.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        run_python("pass", env)
+        baseline.append(time.perf_counter() - start)
+
+    packages = defaultdict(int)
+    for entry in imports:
+        packages[entry["module"].split(".")[0]] += entry["self_us"]
+    total_us = sum(entry["self_us"] for entry in imports)
+    loaded = {entry["module"] for entry in imports}
+    return {
+        "module": args.module,
+        "import_seconds": round(total_us / 1e6, 3),
+        "modules_imported": len(imports),
+        "wall_seconds_median": round(statistics.median(walls), 3),
+        "interpreter_seconds_median": round(statistics.median(baseline), 3),
+        "top_packages": [
+            {"package": name, "seconds": round(us / 1e6, 3)}
+            for name, us in sorted(packages.items(), key=lambda item: -item[1])[:args.top]
+        ],
+        "top_modules": [
+            {"module": entry["module"], "cumulative_seconds": round(entry["cumulative_us"] / 1e6, 3)}
+            for entry in sorted(imports, key=lambda entry: -entry["cumulative_us"])
+            if entry["module"] != args.module
+        ][:args.top],
+        "lazy_modules_loaded": [name for name in LAZY_MODULES if name in loaded],
+    }
+
+# Usage: python -m benchmarks.startup [--module main] [--repeat 5] [--top 15] [--output startup.json]
+def main():
+    parser = argparse.ArgumentParser(description="Measure what importing the app costs at startup with -X importtime.")
+    parser.add_argument("--module", default="main", help="module to import, as the server does on start")
+    parser.add_argument("--repeat", type=int, default=5, help="timed imports; the median is reported")
+    parser.add_argument("--top", type=int, default=15, help="packages and modules listed by import time")
+    parser.add_argument("--workdir", help="directory for the databases the app points at (default: a new temporary directory)")
+    parser.add_argument("--output", help="also write the report to this file")
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+
+    for name in report["lazy_modules_loaded"]:
+        print(f"startup: {name} is imported at startup, but should load on first use", file=sys.stderr)
+    if report["lazy_modules_loaded"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,55 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 import uvicorn
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
 
 from app.graph import build_graph
 from app.app import create_app
+from app.config import get_agent_connection_string, get_checkpoint_compaction_config, get_checkpointer_config, get_google_credentials_config, get_server_config
+from app.checkpointer import create_checkpointer
+from app.checkpoints import run_compaction_job
+from app.google_auth import run_refresh_job
+from app.jobs import run_workers
+from app.turns import create_job_handlers
+from app.database import db
+
+@asynccontextmanager
+async def lifespan(app):
+    # The async checkpointer binds to the running event loop, so the graph is built on startup
+    conn = job_workers = None
+    if get_checkpointer_config()["backend"] == "redis":
+        checkpointer = create_checkpointer()
+        interval = 0  # Redis threads expire on their own
+    else:
+        conn = await db.aconnect_checkpoint_db(get_agent_connection_string())
+        checkpointer = AsyncSqliteSaver(conn)
+        interval = get_checkpoint_compaction_config()["interval_seconds"]
+    compaction = asyncio.create_task(run_compaction_job(interval)) if interval else None
+    refresh_interval = get_google_credentials_config()["refresh_interval"]
+    token_refresh = asyncio.create_task(run_refresh_job(refresh_interval)) if refresh_interval else None
+    try:
+        app.state.graph = build_graph(checkpointer=checkpointer)
+        job_workers = asyncio.create_task(run_workers(create_job_handlers(app.state.graph)))
+        yield
+    finally:
+        if job_workers:
+            job_workers.cancel()
+            await asyncio.gather(job_workers, return_exceptions=True)
+        if compaction:
+            compaction.cancel()
+        if token_refresh:
+            token_refresh.cancel()
+        if conn:
+            await conn.close()
 
-app = create_app()
-graph = build_graph()
-app.state.graph = graph
+app = create_app(lifespan=lifespan)
 
 import app.tools as tools
 
 def main():
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    cfg = get_server_config()
+    uvicorn.run("main:app", host=cfg["host"], port=cfg["port"], reload=cfg["reload"], workers=cfg["workers"])
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
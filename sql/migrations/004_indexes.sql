@@ -0,0 +1,7 @@
+-- +goose Up
+CREATE INDEX IF NOT EXISTS idx_chats_user_id_updated_at ON chats(user_id, updated_at);
+CREATE INDEX IF NOT EXISTS idx_messages_chat_id_created_at ON messages(chat_id, created_at);
+
+-- +goose Down
+DROP INDEX IF EXISTS idx_messages_chat_id_created_at;
+DROP INDEX IF EXISTS idx_chats_user_id_updated_at;
\ No newline at end of file